@@ -0,0 +1,89 @@
+"""
+Import time of the client, each import timed in a fresh interpreter.
+
+    python benchmarks/import_time.py --repeat 10 --max-seconds 0.5
+
+pandas, numpy, pyarrow, aiohttp and tqdm are imported by the first call needing them, not by ``import
+synmax.hyperion``. The script exits with status 1 when one of them is imported anyway, or when the median import time
+exceeds ``--max-seconds``, so it can guard against regressions in CI. Results are printed, or written to ``--output``,
+as json.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# imported on first use only
+DEFERRED_MODULES = ('pandas', 'numpy', 'pyarrow', 'aiohttp', 'httpx', 'tqdm', 'orjson')
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_measure = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [name for name in {deferred!r} if name in sys.modules]]))
+'''
+
+
+def measure_import(module: str = 'synmax.hyperion', deferred=DEFERRED_MODULES) -> tuple:
+    """
+    Import ``module`` in a fresh interpreter.
+
+    :return: seconds the import took, and the modules of ``deferred`` it imported
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (_ROOT, os.environ.get('PYTHONPATH')))))
+    output = subprocess.run([sys.executable, '-c', _measure.format(module=module, deferred=tuple(deferred))],
+                            check=True, capture_output=True, text=True, env=env).stdout
+    seconds, imported = json.loads(output.strip().splitlines()[-1])
+    return seconds, imported
+
+
+def run(modules, repeat: int) -> list:
+    results = []
+    for module in modules:
+        # the first run warms the file system caches
+        measure_import(module)
+        times, imported = [], set()
+        for _ in range(repeat):
+            seconds, deferred = measure_import(module)
+            times.append(seconds)
+            imported.update(deferred)
+        results.append({'module': module, 'median_seconds': statistics.median(times), 'min_seconds': min(times),
+                        'max_seconds': max(times), 'deferred_modules_imported': sorted(imported)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=['synmax.hyperion', 'synmax.common'], help='modules timed')
+    parser.add_argument('--repeat', type=int, default=10, help='fresh interpreters per module')
+    parser.add_argument('--max-seconds', type=float, default=None, help='fail above this median import time')
+    parser.add_argument('--output', help='json file, printed when omitted')
+    args = parser.parse_args()
+
+    results = run(args.modules, args.repeat)
+    report = json.dumps({'python': sys.version.split()[0], 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+    failed = False
+    for result in results:
+        if result['deferred_modules_imported']:
+            print(f"{result['module']} imports {result['deferred_modules_imported']}", file=sys.stderr)
+            failed = True
+        if args.max_seconds is not None and result['median_seconds'] > args.max_seconds:
+            print(f"{result['module']} takes {result['median_seconds']:.3f}s to import, more than "
+                  f"{args.max_seconds}s", file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
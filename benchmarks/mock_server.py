@@ -0,0 +1,229 @@
+"""
+Local stand-in for the Hyperion api, implementing the paginated contract of the ``/v3/*`` endpoints.
+
+POST bodies are answered with ``{"data": [...], "pagination": {"start", "page_size", "total_count"}}``, with the rows
+of the ``state_code`` filter of the body if any. Requests over the concurrency limit get a 429 with
+``rate_limit_request_count``, and every response waits ``latency`` seconds, plus a random delay of up to ``jitter``
+seconds so that concurrent pages complete out of order.
+
+    python benchmarks/mock_server.py --port 8080 --total-count 100000
+    # then HyperionApiClient(local_server=True)
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+_states = [('TX', 'MIDLAND'), ('TX', 'REEVES'), ('NM', 'EDDY'), ('NM', 'LEA'), ('ND', 'MCKENZIE'), ('PA', 'GREENE'),
+           ('LA', 'CADDO'), ('OK', 'KINGFISHER'), ('CO', 'WELD'), ('WY', 'CONVERSE')]
+_operators = [f'OPERATOR {i:03d}' for i in range(200)]
+_reference_body = json.dumps({'data': [{'region': 'permian', 'sub_region': 'midland'}]}).encode('utf-8')
+_reference_etag = '"%s"' % hashlib.sha1(_reference_body).hexdigest()
+
+
+def make_row(index: int) -> dict:
+    """Deterministic production_by_well like row."""
+    rng = random.Random(index)
+    state, county = _states[index % len(_states)]
+    return {
+        'api': 42000000000000 + index // 24,
+        'date': f'{2000 + (index // 12) % 24}-{index % 12 + 1:02d}-01',
+        'state_ab': state,
+        'county': county,
+        'operator_name': _operators[index % len(_operators)],
+        'region': 'permian' if state in ('TX', 'NM') else 'other',
+        'production_month': index % 24 + 1,
+        'gas_monthly': round(rng.uniform(0, 50000), 2),
+        'oil_monthly': round(rng.uniform(0, 20000), 2),
+        'water_monthly': round(rng.uniform(0, 80000), 2) if index % 7 else None,
+    }
+
+
+class MockHyperionServer:
+    """
+    Threaded mock server, started in a background thread.
+
+    >>> with MockHyperionServer(total_count=10000) as server:
+    ...     ApiClient(access_token='x').post(f'{server.url}/v3/productionbywell', ApiPayload(), return_json=True)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, total_count=10000, page_size=1000, latency=0.0,
+                 rate_limit: int = None, compress=True, jitter=0.0):
+        """
+
+        :param host:
+        :param port: 0 picks a free port
+        :param total_count: rows of every paginated endpoint
+        :param page_size: rows per page
+        :param latency: seconds every response is delayed by
+        :param rate_limit: (optional) requests in flight above which a 429 is returned
+        :param compress: gzip the responses when the client accepts it
+        :param jitter: maximum random delay, in seconds, added to the latency of every response
+        """
+        self.total_count = total_count
+        self.page_size = page_size
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.compress = compress
+        self.jitter = jitter
+
+        self.requests = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._pages = {}
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockHyperionServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-hyperion', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def delay(self) -> float:
+        """Seconds the next response waits."""
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _indexes(self, state_codes: tuple = None):
+        """Indexes of the rows of the states ``state_codes``, all rows when None."""
+        if not state_codes:
+            return range(self.total_count)
+        return [index for index in range(self.total_count) if _states[index % len(_states)][0] in state_codes]
+
+    def page(self, start: int, state_codes: tuple = None) -> bytes:
+        """Json body of the page starting at row ``start`` of the rows of ``state_codes``, built once."""
+        key = (start, state_codes)
+        body = self._pages.get(key)
+        if body is None:
+            indexes = self._indexes(state_codes)
+            rows = [make_row(index) for index in indexes[start:start + self.page_size]]
+            body = json.dumps({
+                'data': rows,
+                'pagination': {'start': start, 'page_size': self.page_size, 'total_count': len(indexes)},
+            }).encode('utf-8')
+            self._pages[key] = body
+        return body
+
+    def _enter(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            over = self.rate_limit is not None and self.in_flight > self.rate_limit
+            if over:
+                self.throttled += 1
+            return not over
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, body: bytes, headers: dict = None):
+                if server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body, compresslevel=1)
+                    headers = dict(headers or {}, **{'Content-Encoding': 'gzip'})
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                allowed = server._enter()
+                try:
+                    delay = server.delay()
+                    if delay:
+                        time.sleep(delay)
+                    if not allowed:
+                        self._send_json(429, b'{"error": "Too Many Requests"}',
+                                        {'rate_limit_request_count': str(server.rate_limit)})
+                        return
+                    start = int((payload.get('pagination') or {}).get('start') or 0)
+                    state_codes = tuple(sorted(payload.get('state_code') or ())) or None
+                    self._send_json(200, server.page(start, state_codes))
+                finally:
+                    server._exit()
+
+            def do_GET(self):
+                allowed = server._enter()
+                try:
+                    delay = server.delay()
+                    if delay:
+                        time.sleep(delay)
+                    if not allowed:
+                        self._send_json(429, b'{"error": "Too Many Requests"}',
+                                        {'rate_limit_request_count': str(server.rate_limit)})
+                        return
+                    # reference data never changes, revalidations get a 304
+                    if self.headers.get('If-None-Match') == _reference_etag:
+                        self.send_response(304)
+                        self.send_header('ETag', _reference_etag)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self._send_json(200, _reference_body, {'ETag': _reference_etag})
+                finally:
+                    server._exit()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--total-count', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=None)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockHyperionServer(args.host, args.port, total_count=args.total_count, page_size=args.page_size,
+                                latency=args.latency, rate_limit=args.rate_limit, jitter=args.jitter)
+    print(f'Serving {args.total_count} rows per endpoint on {server.url}', flush=True)
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == '__main__':
+    main()
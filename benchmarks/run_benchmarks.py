@@ -0,0 +1,202 @@
+"""
+Client side benchmarks against the local mock server, no access token or network needed.
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000 --latency 0.02 --output bench.json
+
+Each benchmark is timed ``--repeat`` times, then run once more under tracemalloc for its peak memory. The mock server
+runs in a child process so that neither its time nor its allocations are counted. Results are printed, or written
+to ``--output``, as json: one entry per benchmark and size with the call times, rows per second, peak memory and the
+latency percentiles of the HTTP requests.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+# progress bars would interleave with the report
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import numpy  # noqa: E402
+
+from mock_server import MockHyperionServer, make_row  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synmax.common import ApiClient, ApiClientAsync, MetricsCollector  # noqa: E402
+from synmax.common.frames import frame_from_records  # noqa: E402
+from synmax.hyperion import ApiPayload, add_daily, get_fips, get_fips_lookup  # noqa: E402
+from synmax.hyperion.schemas import endpoint_schema  # noqa: E402
+
+ENDPOINT = 'v3/productionbywell'
+
+
+def _serve(connection, options: dict):
+    server = MockHyperionServer(**options)
+    connection.send(server.url)
+    server._server.serve_forever()
+
+
+class ServerProcess:
+    """:class:`MockHyperionServer` in a child process."""
+
+    def __init__(self, **options):
+        self.options = options
+        self.url = None
+        self._process = None
+
+    def __enter__(self):
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(child, self.options), daemon=True)
+        self._process.start()
+        self.url = parent.recv()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._process.terminate()
+        self._process.join()
+
+
+def percentiles(values, points=(50, 90, 99)) -> dict:
+    if not values:
+        return {f'p{point}': None for point in points}
+    return {f'p{point}': float(value) for point, value in zip(points, numpy.percentile(values, points))}
+
+
+def measure(function, repeat: int, rows: int = None) -> dict:
+    """
+    Time ``function`` and trace its peak memory.
+
+    :param function: called without arguments, once to warm up, ``repeat`` times timed and once traced
+    :param repeat: number of timed calls
+    :param rows: rows handled per call, for the throughput
+    """
+    function()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        'rows': rows,
+        'repeat': repeat,
+        'seconds': {'min': min(timings), 'median': median, 'max': max(timings)},
+        'rows_per_second': rows / median if rows and median else None,
+        'peak_memory_bytes': peak,
+    }
+
+
+def bench_client(name: str, client_class, server_options: dict, size: int, repeat: int) -> dict:
+    """Benchmark ``client_class.post`` of a query returning ``size`` rows."""
+    latencies = []
+    metrics = MetricsCollector(hooks=[lambda request: latencies.append(request.duration)])
+    with ServerProcess(total_count=size, **server_options) as server:
+        client = client_class(access_token='benchmark', metrics=metrics)
+        url = f'{server.url}/{ENDPOINT}'
+        schema = endpoint_schema(ENDPOINT)
+        try:
+            def query():
+                df = client.post(url, ApiPayload(), return_json=True, use_cache=False, schema=schema)
+                assert len(df) == size, f'{name} returned {len(df)} rows instead of {size}'
+
+            result = measure(query, repeat, rows=size)
+        finally:
+            client.close()
+
+    requests_ = [row for row in metrics.summary() if row['endpoint'] == ENDPOINT]
+    result.update({
+        'benchmark': name,
+        'requests': sum(row['requests'] for row in requests_),
+        'throttled': sum(row['requests'] for row in requests_ if row['status'] == '429'),
+        'latency_seconds': percentiles(latencies),
+    })
+    return result
+
+
+def bench_add_daily(size: int, repeat: int) -> dict:
+    df = frame_from_records([make_row(index) for index in range(size)], endpoint_schema(ENDPOINT))
+    result = measure(lambda: add_daily(df, inplace=False), repeat, rows=size)
+    result['benchmark'] = 'add_daily'
+    return result
+
+
+def bench_get_fips(repeat: int) -> list:
+    def cold():
+        get_fips_lookup.cache_clear()
+        return get_fips()
+
+    results = []
+    for name, function in (('get_fips_cold', cold), ('get_fips', get_fips)):
+        result = measure(function, repeat, rows=len(get_fips()))
+        result['benchmark'] = name
+        results.append(result)
+    return results
+
+
+def run(sizes, repeat: int, server_options: dict, clients=('ApiClient.post', 'ApiClientAsync.post')) -> dict:
+    client_classes = {'ApiClient.post': ApiClient, 'ApiClientAsync.post': ApiClientAsync}
+    results = []
+    for size in sizes:
+        for name in clients:
+            logging.info('%s, %s rows', name, size)
+            results.append(bench_client(name, client_classes[name], server_options, size, repeat))
+        logging.info('add_daily, %s rows', size)
+        results.append(bench_add_daily(size, repeat))
+    logging.info('get_fips')
+    results.extend(bench_get_fips(repeat))
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'server': server_options,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='rows per query')
+    parser.add_argument('--repeat', type=int, default=3, help='timed calls per benchmark')
+    parser.add_argument('--page-size', type=int, default=1000, help='rows per page of the mock server')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the mock server delays each response')
+    parser.add_argument('--rate-limit', type=int, default=None,
+                        help='requests in flight above which the mock server answers 429')
+    parser.add_argument('--no-compression', action='store_true', help='send the responses uncompressed')
+    parser.add_argument('--sync-only', action='store_true', help='skip ApiClientAsync.post')
+    parser.add_argument('--output', help='json file, printed when omitted')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    # the clients log every page
+    logging.getLogger('synmax').setLevel(logging.WARNING)
+
+    server_options = {'page_size': args.page_size, 'latency': args.latency, 'rate_limit': args.rate_limit,
+                      'compress': not args.no_compression}
+    clients = ('ApiClient.post',) if args.sync_only else ('ApiClient.post', 'ApiClientAsync.post')
+    report = run(args.sizes, args.repeat, server_options, clients)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+        logging.info('Wrote %s', args.output)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,12 @@ NAME = "synmax-api-python-client"
 # http://pypi.python.org/pypi/setuptools
 
 # DEV_REQUIRES = ["pytest", "black"]
+EXTRAS_REQUIRE = {
+    "parquet": ["pyarrow>=10.0.0"],
+    "fast-json": ["orjson>=3.6.0"],
+    "http2": ["httpx[http2]>=0.23.0"],
+    "compression": ["brotli>=1.0.9", "zstandard>=0.18.0"],
+}
 
 from pip._internal.req import parse_requirements
 
@@ -44,6 +50,7 @@ setup(
     author_email="",
     install_requires=load_requirements("requirements.txt"),
     # extras_require={"dev": DEV_REQUIRES},
+    extras_require=EXTRAS_REQUIRE,
     python_requires=">=3.7",
     include_package_data=True,
     package_data={
@@ -1,2 +1,12 @@
 from .api_client import ApiClient, ApiClientAsync, PayloadModelBase
 from .model import PayloadModelBase
+from .rate_limiter import AdaptiveRateLimiter
+from .shared_limiter import SharedRateLimiter
+from .retry import RetryPolicy, RetryBudget, CircuitBreaker, CircuitOpenError
+from .sinks import ParquetSink
+from .cache import ResponseCache
+from .spool import PageSpool
+from .decoder import JsonDecoder
+from .transport import Transport, AiohttpTransport, HttpxTransport
+from .compression import TransferStats
+from .metrics import MetricsCollector, RequestMetrics
@@ -1,60 +1,157 @@
+from __future__ import annotations
+
+import abc
 import asyncio
+import contextvars
+import functools
 import logging
-from typing import List, Dict
+import queue
+import threading
+import time
+import weakref
+from typing import List, Dict, Iterator, AsyncIterator, Mapping, Optional, Tuple, Union
 
-import aiohttp
-import pandas
 import requests
-from aioretry import (
-    retry,
-    # Tuple[bool, Union[int, float]]
-    RetryPolicyStrategy,
-    RetryInfo
-)
 from requests.adapters import HTTPAdapter
-from tenacity import retry, wait_random_exponential, before_sleep_log, retry_if_exception_type
-from tqdm import tqdm
-from urllib3 import Retry
 
+from synmax.common.cache import ResponseCache
+from synmax.common.compression import TransferStats, accept_encoding
+from synmax.common.decoder import JsonDecoder, get_decoder
+from synmax.common.frames import FrameBuilder, Schema, frame_from_records
+from synmax.common.lazy import LazyModule
+from synmax.common.metrics import MetricsCollector, QueryMetrics, RequestMetrics, current_query, ATTRS_KEY
 from synmax.common.model import PayloadModelBase
+from synmax.common.rate_limiter import AdaptiveRateLimiter
+from synmax.common.retry import RetryPolicy, current_budget
+from synmax.common.sinks import ParquetSink
+from synmax.common.spool import PageSpool
+from synmax.common.transport import Transport, TransportResponse, get_transport
+
+pandas = LazyModule('pandas')
 
-logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
 _api_timeout = 600
 PARALLEL_REQUESTS = 25
+# errors of the requests session retried by the retry policy
+_retryable_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                     requests.exceptions.ChunkedEncodingError)
+
+
+def _mark_incomplete():
+    """The api refused a page of the current query, its result misses rows."""
+    query = current_query.get()
+    if query is not None:
+        query.complete = False
 
 
-class ApiClientBase:
-    def __init__(self, access_token):
+def _progress_bar(**kwargs):
+    """tqdm progress bar, tqdm is imported by the first query showing progress."""
+    from tqdm import tqdm
+    return tqdm(**kwargs)
+
+
+class ApiClientBase(abc.ABC):
+    def __init__(self, access_token, rate_limiter: AdaptiveRateLimiter = None, cache: ResponseCache = None,
+                 json_decoder: Union[str, JsonDecoder] = None, metrics: MetricsCollector = None,
+                 spool: PageSpool = None, retry_policy: RetryPolicy = None):
         self.access_key = access_token
+        self.cache = cache
+        # pages of paginated queries checkpointed on disk, interrupted downloads resume from them
+        self.spool = spool
+        # timings of every request, see MetricsCollector.add_hook
+        self.metrics = metrics or MetricsCollector()
+        # orjson or msgspec when installed
+        self.json_decoder = get_decoder(json_decoder)
+        # bytes received, compressed and decompressed
+        self.transfer_stats = TransferStats()
+        # shared by every request of this client, pass the same instance to clients hitting the same api key
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(max_concurrency=PARALLEL_REQUESTS)
+        # retries of the sync and async requests, its circuit breaker is shared by the clients of the policy
+        self.retry_policy = retry_policy or RetryPolicy()
         self.session = requests.Session()
         self.session.verify = False
         # update headers
         self.session.headers.update(self.headers)
 
-        # HTTPAdapter
-        retry_strategy = Retry(
-            total=10,
-            backoff_factor=2,
-            status_forcelist=[408, 500, 502, 503, 504, 505],
-            method_whitelist=["HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE"],
-
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        # keep-alive connections reused across calls, enough for concurrent sharded queries.
+        # Not retried by urllib3, requests are retried by the retry policy.
+        adapter = HTTPAdapter(pool_maxsize=PARALLEL_REQUESTS)
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
 
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
     @property
     def headers(self):
         return {
             'Content-Type': 'application/json',
             'access_key': self.access_key,
             'User-Agent': "Synmax-api-client/1.0.1/python",
+            # decoded by urllib3, which has no zstd support
+            'Accept-Encoding': accept_encoding(zstd=False),
         }
 
-    @staticmethod
-    def _return_response(response, return_json=False):
+    def _record_transfer(self, response: requests.Response, metrics: RequestMetrics):
+        """Count the compressed and decompressed size of a requests response, its body already read."""
+        raw = getattr(response, 'raw', None)
+        decoded_bytes = len(response.content or b'')
+        try:
+            wire_bytes = raw.tell()
+        except (AttributeError, TypeError, ValueError):
+            wire_bytes = decoded_bytes
+        metrics.wire_bytes, metrics.decoded_bytes = wire_bytes or decoded_bytes, decoded_bytes
+        self.transfer_stats.add(metrics.wire_bytes, decoded_bytes)
+
+    def _send(self, method: str, url: str, attempt: int = 1, **kwargs) -> requests.Response:
+        """
+        Send a request through the rate limiter and the session, and measure it. The metrics of successful
+        responses are published by :meth:`_return_response`, once the body is decoded.
+        """
+        metrics = RequestMetrics(method, url, attempt)
+        started = time.monotonic()
+        self.rate_limiter.acquire()
+        metrics.queue_wait = time.monotonic() - started
+
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception as e:
+            self.rate_limiter.release()
+            metrics.error = type(e).__name__
+            self.metrics.record(metrics)
+            raise
+        elapsed = time.monotonic() - started
+        self.rate_limiter.release(response.status_code, response.headers)
+
+        metrics.status = response.status_code
+        metrics.ttfb = min(response.elapsed.total_seconds(), elapsed)
+        metrics.transfer_time = elapsed - metrics.ttfb
+        self._record_transfer(response, metrics)
+        if response.ok:
+            response.synmax_metrics = metrics
+        else:
+            self.metrics.record(metrics)
+        return response
+
+    def _send_retrying(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        :meth:`_send` with the retries of the retry policy.
+
+        :return: response of the last attempt, which is an error response when no retry was left
+        """
+        response = self.retry_policy.call(lambda attempt: self._send(method, url, attempt, **kwargs), url,
+                                          retry_on=_retryable_errors)
+        if response.status_code == 429:
+            LOGGER.warning(
+                'Too Many Requests, rate_limit_request_count: %s',
+                response.headers.get('rate_limit_request_count')
+            )
+        return response
+
+    def _return_response(self, response, return_json=False):
         """
 
         :param response:
@@ -66,25 +163,218 @@ class ApiClientBase:
             # logging.error('Error in response. %s')
             return None
 
+        metrics = response.__dict__.pop('synmax_metrics', None)
         if return_json:
-            json_data = response.json()
+            started = time.monotonic()
+            json_data = self.json_decoder.loads(response.content)
+            if metrics is not None:
+                metrics.decode_time = time.monotonic() - started
+                metrics.rows = _row_count(json_data)
+                self.metrics.record(metrics)
             if 'error' in json_data:
                 # raise Exception(json_data['error'])
                 logging.error(json_data['error'])
                 return None
             return json_data
 
+        if metrics is not None:
+            self.metrics.record(metrics)
         return response
 
+    def _cached(self, key_args, fetch, use_cache=True, refresh_cache=False) -> pandas.DataFrame:
+        """
+        Serve ``fetch()`` from the response cache when one is configured.
+
+        :param key_args: url, payload and params of the request
+        :param fetch: callable returning the DataFrame from the api
+        :param use_cache: False to bypass the cache entirely
+        :param refresh_cache: True to ignore the cached entry and replace it with a fresh result
+        :return:
+        """
+        if self.cache is None or not use_cache:
+            return fetch()
+
+        key = self.cache.key(*key_args, scope=self.access_key)
+        if not refresh_cache:
+            df = self.cache.get(key)
+            if df is not None:
+                LOGGER.info('Loaded %s rows from cache for %s', len(df), key_args[0])
+                df.attrs[ATTRS_KEY] = {'url': key_args[0], 'cache_hit': True, 'rows': len(df)}
+                return df
+
+        df = fetch()
+        # failed or empty queries are not cached
+        if df is not None and not df.empty:
+            self.cache.put(key, df)
+        return df
+
+    def post(self, url, payload: PayloadModelBase = None, return_json=False, use_cache=True, refresh_cache=False,
+             schema: Schema = None, **kwargs) -> pandas.DataFrame:
+        r"""Sends a POST request.
+
+        :param url: URL for the new :class:`Request` object.
+        :param payload: (optional) Dictionary, list of tuples, bytes, or file-like
+            object to send in the body of the :class:`Request`.
+        :param return_json:
+        :param use_cache: (optional) False to bypass the response cache
+        :param refresh_cache: (optional) True to fetch from the api and replace the cached result
+        :param schema: (optional) column dtypes of the result, other columns are inferred
+        :param \*\*kwargs: Optional arguments that ``request`` takes.
+        :return: :class:`Response <Response>` object
+        :rtype: requests.Response
+        """
+        return self._cached(
+            (url, payload), lambda: self._measured(url, self._post_all, url, payload, return_json, schema=schema,
+                                                   **kwargs),
+            use_cache, refresh_cache
+        )
+
+    def _measured(self, url, post_all, *args, **kwargs) -> pandas.DataFrame:
+        """
+        Run ``post_all`` as the current query, with one retry budget for all its requests, and attach its summary
+        to the result.
+        """
+        query = QueryMetrics(url)
+        token = current_query.set(query)
+        budget_token = current_budget.set(self.retry_policy.new_budget())
+        try:
+            df = post_all(*args, **kwargs)
+        finally:
+            current_budget.reset(budget_token)
+            current_query.reset(token)
+        query.finish()
+        if df is not None:
+            df.attrs[ATTRS_KEY] = query.as_dict()
+        return df
+
+    def _query_context(self) -> contextvars.Context:
+        """Copy of the current context with a new retry budget, shared by all the requests of one query."""
+        context = contextvars.copy_context()
+        context.run(current_budget.set, self.retry_policy.new_budget())
+        return context
+
+    def _build_frame(self, url, builder: FrameBuilder) -> pandas.DataFrame:
+        """Build the result of a query, timed."""
+        started = time.monotonic()
+        df = builder.build()
+        build_time = time.monotonic() - started
+        self.metrics.record_frame(url, len(df), build_time)
+        query = current_query.get()
+        if query is not None:
+            query.build_time += build_time
+        return df
+
+    @abc.abstractmethod
+    def _post_all(self, url, payload: PayloadModelBase, return_json=False, schema: Schema = None,
+                  **kwargs) -> pandas.DataFrame:
+        """Fetch every page of a paginated POST and build the result."""
+
+    @abc.abstractmethod
+    def iter_json_pages(self, url, payload: PayloadModelBase = None, return_json=False, read_ahead=2,
+                        ordered=True, **kwargs) -> Iterator[Dict]:
+        """Fetch the pages of a paginated POST and yield the json body of each page."""
+
+    def iter_pages(self, url, payload: PayloadModelBase = None, return_json=False, read_ahead: int = None,
+                   schema: Schema = None, **kwargs) -> Iterator[pandas.DataFrame]:
+        r"""
+        Sends a paginated POST request and yields one DataFrame per page, in page order unless ``ordered=False``
+        is passed.
+
+        :param url: URL for the new :class:`Request` object.
+        :param payload: query filters
+        :param return_json:
+        :param read_ahead: (optional) number of pages fetched or buffered ahead of the consumer
+        :param schema: (optional) column dtypes of the pages, other columns are inferred
+        :param \*\*kwargs: Optional arguments that ``request`` takes.
+        :return: iterator of :class:`pandas.DataFrame`, one per page
+        """
+        if read_ahead is not None:
+            kwargs['read_ahead'] = read_ahead
+        for json_result in self.iter_json_pages(url, payload, return_json, **kwargs):
+            yield frame_from_records(json_result['data'], schema)
+
+    def write_pages(self, sink: ParquetSink, url, payload: PayloadModelBase = None, return_json=False,
+                    read_ahead: int = None, **kwargs) -> ParquetSink:
+        r"""
+        Sends a paginated POST request and appends each page to ``sink`` as it arrives, without building
+        a DataFrame of the full result.
+
+        :param sink: destination of the rows
+        :param url: URL for the new :class:`Request` object.
+        :param payload: query filters
+        :param return_json:
+        :param read_ahead: (optional) number of pages fetched or buffered ahead of the writer
+        :param \*\*kwargs: Optional arguments that ``request`` takes.
+        :return: the sink
+        """
+        if read_ahead is not None:
+            kwargs['read_ahead'] = read_ahead
+        with sink:
+            for json_result in self.iter_json_pages(url, payload, return_json, **kwargs):
+                sink.write_records(json_result['data'])
+        LOGGER.info('Total rows written to %s: %s', sink.path, sink.rows_written)
+        return sink
+
+    @staticmethod
+    def _page_count(pagination) -> int:
+        """Number of pages, first page included, needed to read ``total_count`` rows."""
+        if not pagination['page_size']:
+            return 1
+        return max(1, -(-pagination['total_count'] // pagination['page_size']))
+
+    def _fetch_json_page(self, url, payload: PayloadModelBase, **kwargs) -> Optional[Dict]:
+        """
+        POST the page at ``payload.pagination_start``.
+
+        :return: json body of the page, None on 401
+        :raises requests.exceptions.HTTPError: when the api answers with an error
+        """
+        response = self._send_retrying('POST', url, data=payload.payload(), timeout=_api_timeout, **kwargs)
+        if response.status_code == 401:
+            LOGGER.error(response.text)
+            _mark_incomplete()
+            return None
+        response.raise_for_status()
+        # pages are always decoded, pagination is read from the body
+        json_result = self._return_response(response, return_json=True)
+        if json_result is None:
+            raise requests.exceptions.HTTPError(f'No data in the response of {url}', response=response)
+        return json_result
+
+    def _spool_key(self, url, payload: PayloadModelBase) -> str:
+        return self.spool.key(url, payload, scope=self.access_key)
+
+    def _spooled_page(self, url, payload: PayloadModelBase, pagination_start: int, fetch) -> Optional[Dict]:
+        """
+        Page at ``pagination_start`` read from the spool, or fetched with ``fetch()`` and spooled. The first page
+        is always fetched, the spooled pages are checked against its pagination.
+        """
+        if self.spool is None:
+            return fetch()
+
+        key = self._spool_key(url, payload)
+        if pagination_start:
+            json_result = self.spool.read_page(key, pagination_start)
+            if json_result is not None:
+                LOGGER.debug('Read page at %s of %s from the spool', pagination_start, url)
+                return json_result
+        json_result = fetch()
+        if json_result is not None:
+            if not pagination_start:
+                self.spool.check(key, json_result['pagination'])
+            self.spool.write_page(key, pagination_start, json_result, url=url, payload=payload)
+        return json_result
+
+    def _finish_spool(self, url, payload: PayloadModelBase, total_pages: int):
+        """Drop the spooled pages of a query once all of them were read."""
+        if self.spool is not None:
+            self.spool.finish(self._spool_key(url, payload), total_pages)
+
 
 class ApiClient(ApiClientBase):
 
-    @retry(
-        wait=wait_random_exponential(multiplier=15, min=20, max=60),
-        before_sleep=before_sleep_log(LOGGER, logging.INFO),
-        retry=retry_if_exception_type(requests.exceptions.HTTPError)
-    )
-    def get(self, url, params=None, return_json=False, **kwargs) -> pandas.DataFrame:
+    def get(self, url, params=None, return_json=False, use_cache=True, refresh_cache=False,
+            **kwargs) -> pandas.DataFrame:
         r"""Sends a GET request.
 
 
@@ -92,20 +382,20 @@ class ApiClient(ApiClientBase):
         :param params: (optional) Dictionary, list of tuples or bytes to send
             in the query string for the :class:`Request`.
         :param return_json:
+        :param use_cache: (optional) False to bypass the response cache
+        :param refresh_cache: (optional) True to fetch from the api and replace the cached result
         :param \*\*kwargs: Optional arguments that ``request`` takes.
         :return: :class:`Response <Response>` object
         :rtype: requests.Response
         """
-        LOGGER.info(url)
-        response = self.session.get(url, params=params, timeout=_api_timeout, **kwargs)
+        return self._cached(
+            (url, None, params), lambda: self._query_context().run(self._get, url, params, return_json, **kwargs),
+            use_cache, refresh_cache
+        )
 
-        if response.status_code == 429:
-            resp_headers = response.headers
-            LOGGER.warning(
-                'Too Many Requests, rate_limit_request_count: %s',
-                resp_headers.get('rate_limit_request_count')
-            )
-            raise requests.exceptions.HTTPError("Too Many Requests")
+    def _get(self, url, params=None, return_json=False, **kwargs) -> pandas.DataFrame:
+        LOGGER.info(url)
+        response = self._send_retrying('GET', url, params=params, timeout=_api_timeout, **kwargs)
 
         json_result = self._return_response(response, return_json)
 
@@ -115,73 +405,107 @@ class ApiClient(ApiClientBase):
 
         return None
 
-    @retry(
-        wait=wait_random_exponential(multiplier=15, min=20, max=60),
-        before_sleep=before_sleep_log(LOGGER, logging.INFO),
-        retry=retry_if_exception_type(requests.exceptions.HTTPError)
-    )
-    def _post_retry(self, url, data, timeout, **kwargs) -> requests.Response:
-
-        response = self.session.post(url, data=data, timeout=timeout, **kwargs)
-
-        if response.status_code == 429:
-            resp_headers = response.headers
-            LOGGER.warning(
-                'Too Many Requests, rate_limit_request_count: %s',
-                resp_headers.get('rate_limit_request_count')
-            )
-            raise requests.exceptions.HTTPError("Too Many Requests")
-
-        return response
-
-    def post(self, url, payload: PayloadModelBase = None, return_json=False, **kwargs) -> pandas.DataFrame:
-        r"""Sends a POST request.
+    def get_revalidated(self, url, etag: str = None, last_modified: str = None, params=None,
+                        **kwargs) -> Tuple[int, Optional[Dict], Mapping[str, str]]:
+        r"""
+        Conditional GET, answered with 304 and no body when the resource did not change.
 
-        :param url: URL for the new :class:`Request` object.
-        :param payload: (optional) Dictionary, list of tuples, bytes, or file-like
-            object to send in the body of the :class:`Request`.
-        :param return_json:
+        :param url:
+        :param etag: (optional) ``ETag`` of the copy held, sent as ``If-None-Match``
+        :param last_modified: (optional) ``Last-Modified`` of the copy held, sent as ``If-Modified-Since``
+        :param params: (optional) query string parameters
         :param \*\*kwargs: Optional arguments that ``request`` takes.
-        :return: :class:`Response <Response>` object
-        :rtype: requests.Response
+        :return: HTTP status, json body (None on 304 or error) and response headers
         """
+        headers = dict(kwargs.pop('headers', None) or {})
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        LOGGER.info(url)
+        response = self._query_context().run(self._send_retrying, 'GET', url, params=params, headers=headers,
+                                             timeout=_api_timeout, **kwargs)
+        if response.status_code == 304:
+            self._return_response(response)
+            return response.status_code, None, response.headers
+        return response.status_code, self._return_response(response, return_json=True), response.headers
+
+    def _iter_json_pages(self, url, payload: PayloadModelBase, return_json=False, first_page: Dict = None,
+                         **kwargs) -> Iterator[Dict]:
+        """
+        Fetch the pages of a paginated POST one after another and yield the json body of each page.
 
+        :param url:
+        :param payload:
+        :param return_json:
+        :param first_page: (optional) json body of the first page when it was fetched already, e.g. by a query plan
+        :param kwargs:
+        :return:
+        """
         LOGGER.info('Payload data: %s', payload)
 
-        data_list: List[Dict] = []
         got_first_page = False
         total_count = -1
+        total_pages = 1
 
-        with tqdm(desc=F"Querying API {url} pages", total=1, dynamic_ncols=True, miniters=0) as progress_bar:
-            while not got_first_page or total_count >= pagination['start'] + pagination['page_size']:
-                try:
+        def fetch():
+            return self._fetch_json_page(url, payload, **kwargs)
+
+        try:
+            with _progress_bar(desc=F"Querying API {url} pages", total=1, dynamic_ncols=True,
+                               miniters=0) as progress_bar:
+                while not got_first_page or total_count > pagination['start'] + pagination['page_size']:
                     progress_bar.refresh()
-                    response = self._post_retry(url, data=payload.payload(), timeout=_api_timeout, **kwargs)
-                    if response.status_code == 401:
+                    # retried by the retry policy, when it gives up the pages already received stay in the spool,
+                    # if any, for the next attempt
+                    if not got_first_page and first_page is not None:
+                        json_result = first_page
+                    else:
+                        json_result = self._spooled_page(url, payload, payload.pagination_start, fetch)
+                    if json_result is None:
                         progress_bar.update()
-                        LOGGER.error(response.text)
-                        return pandas.DataFrame()
+                        return
 
-                    json_result = self._return_response(response, return_json)
                     pagination = json_result['pagination']
 
                     if not got_first_page:
                         total_count = pagination['total_count']
-                        total_pages = pagination['total_count'] // pagination['page_size']
-                        total_pages = total_pages + 1 if total_count % pagination['page_size'] > 0 else 0
+                        total_pages = self._page_count(pagination)
                         progress_bar.reset(total=total_pages)
                         LOGGER.info('Total data size: %s, total pages to scan: %s', total_count, total_pages)
                         got_first_page = True
 
-                    data_list.extend(json_result['data'])
                     payload.pagination_start = pagination['start'] + pagination['page_size']
                     progress_bar.update()
-                except:
-                    pass
-        payload.pagination_start = 0
-        LOGGER.info('Total response data: %s', len(data_list))
-        df = pandas.DataFrame(data_list)
-        return df
+                    yield json_result
+            self._finish_spool(url, payload, total_pages)
+        finally:
+            payload.pagination_start = 0
+
+    def _post_all(self, url, payload: PayloadModelBase, return_json=False, schema: Schema = None,
+                  **kwargs) -> pandas.DataFrame:
+        builder = FrameBuilder(schema)
+        for json_result in self._iter_json_pages(url, payload, return_json, **kwargs):
+            builder.add_records(json_result['data'])
+
+        LOGGER.info('Total response data: %s, %s', builder.rows, self.transfer_stats)
+        return self._build_frame(url, builder)
+
+    def iter_json_pages(self, url, payload: PayloadModelBase = None, return_json=False, read_ahead=2,
+                        ordered=True, **kwargs) -> Iterator[Dict]:
+        r"""
+        Sends a paginated POST request and yields the json body of each page as it arrives.
+
+        :param url: URL for the new :class:`Request` object.
+        :param payload: query filters
+        :param return_json:
+        :param read_ahead: number of pages fetched ahead of the consumer, 0 fetches on demand
+        :param ordered: pages are fetched one after another, always in page order
+        :param \*\*kwargs: Optional arguments that ``request`` takes.
+        :return: iterator of json bodies with ``data`` and ``pagination``
+        """
+        pages = _iterate_in_context(self._query_context(), self._iter_json_pages(url, payload, return_json, **kwargs))
+        return _read_ahead(pages, read_ahead)
 
     def post_v1(self, url, payload: PayloadModelBase = None, return_json=False, **kwargs) -> pandas.DataFrame:
         r"""Sends a POST request.
@@ -199,145 +523,614 @@ class ApiClient(ApiClientBase):
 
         data_list: List[Dict] = []
 
-        response = self.session.post(url, data=payload.payload(), timeout=_api_timeout, **kwargs)
-        json_result = self._return_response(response, return_json)
+        json_result = self._fetch_json_page(url, payload, **kwargs)
+        if json_result is None:
+            return pandas.DataFrame()
         data_list.extend(json_result['data'])
 
         pagination = json_result['pagination']
         total_count = pagination['total_count']
-        total_pages = pagination['total_count'] // pagination['page_size']
-        total_pages = total_pages + 1 if total_count % pagination['page_size'] > 0 else 0
+        total_pages = self._page_count(pagination)
 
         # first page fetched in the above
         total_pages -= 1
 
         LOGGER.info('Total data size: %s, total pages to scan: %s', total_count, total_pages)
 
-        with tqdm(desc=F"Querying API {url} pages", total=total_pages, dynamic_ncols=True, miniters=0) as progress_bar:
-            while total_count >= pagination['start'] + pagination['page_size']:
-                try:
+        try:
+            with _progress_bar(desc=F"Querying API {url} pages", total=total_pages, dynamic_ncols=True,
+                               miniters=0) as progress_bar:
+                while total_count >= pagination['start'] + pagination['page_size']:
                     progress_bar.refresh()
                     payload.pagination_start = pagination['start'] + pagination['page_size']
-                    response = self.session.post(url, data=payload.payload(), timeout=_api_timeout, **kwargs)
-                    json_result = self._return_response(response, return_json)
+                    json_result = self._fetch_json_page(url, payload, **kwargs)
+                    if json_result is None:
+                        break
 
                     pagination = json_result['pagination']
                     data_list.extend(json_result['data'])
                     progress_bar.update()
-                except:
-                    pass
-        payload.pagination_start = 0
+        finally:
+            payload.pagination_start = 0
         LOGGER.info('Total response data: %s', len(data_list))
         df = pandas.DataFrame(data_list)
         return df
 
 
-def retry_policy(info: RetryInfo) -> RetryPolicyStrategy:
+_end_of_pages = object()
+# slot of a page without data or already yielded
+_missing_page = object()
+
+
+def _read_ahead(iterator: Iterator, size: int) -> Iterator:
     """
-    - It will always retry until succeeded
-    - If fails for the first time, it will retry immediately,
-    - If it fails again,
-      aioretry will perform a 100ms delay before the second retry,
-      200ms delay before the 3rd retry,
-      the 4th retry immediately,
-      100ms delay before the 5th retry,
-      etc...
+    Consume ``iterator`` in a worker thread and yield its items, keeping at most ``size`` items ready ahead
+    of the caller. Errors raised by the iterator are re-raised in the caller.
     """
-    # LOGGER.info('retry_policy: since -> %s, going to sleep sec --> %s', info.since, info.fails)
-    # return False, (info.fails - 1) % 3 * 0.1
+    if size < 1:
+        yield from iterator
+        return
+
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            for item in iterator:
+                if stopped.is_set():
+                    break
+                put((item, None))
+        except BaseException as e:
+            put((None, e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+            put((_end_of_pages, None))
+
+    threading.Thread(target=produce, name='synmax-read-ahead', daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _end_of_pages:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def _iterate_in_context(context: contextvars.Context, iterator: Iterator) -> Iterator:
+    """
+    Yield the items of ``iterator``, advanced in ``context``. The context variables it sets stay in ``context``
+    instead of leaking into the consumer between items.
+    """
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close:
+            context.run(close)
+
+
+async def _in_context(context: contextvars.Context, coroutine):
+    for var, value in context.items():
+        var.set(value)
+    return await coroutine
+
+
+def _row_count(json_data) -> int:
+    data = json_data.get('data') if isinstance(json_data, dict) else None
+    return len(data) if isinstance(data, list) else 0
+
+
+async def _anext(async_iterator: AsyncIterator):
+    return await async_iterator.__anext__()
+
+
+async def _aclose(async_iterator: AsyncIterator):
+    await async_iterator.aclose()
+
+
+class _EventLoopThread:
+    """
+    Event loop running in a daemon thread. Sync code runs its coroutines on it, so that connection pools bound
+    to the loop live as long as the client instead of a single call. Works whether or not the calling thread
+    runs a loop itself, e.g. in notebooks.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_forever, name='synmax-event-loop', daemon=True)
+        self._thread.start()
+
+    def _run_forever(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def run(self, coroutine):
+        """Run ``coroutine`` on the loop and wait for its result, it sees the context variables of the caller."""
+        future = asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coroutine), self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            # e.g. KeyboardInterrupt in the caller
+            future.cancel()
+            raise
+
+    def iterate(self, async_iterator: AsyncIterator) -> Iterator:
+        """Drive ``async_iterator`` on the loop from sync code."""
+        try:
+            while True:
+                try:
+                    yield self.run(_anext(async_iterator))
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(_aclose(async_iterator))
+
+    def stop(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
 
-    return False, info.fails
+def _shutdown_loop_thread(loop_thread: _EventLoopThread, transport: Transport):
+    try:
+        loop_thread.run(transport.close())
+    finally:
+        loop_thread.stop()
 
 
 class ApiClientAsync(ApiClientBase):
 
-    async def _post_async(self, url, payload: PayloadModelBase, data_list, progress_bar, page_size, total_pages,
-                          connector: aiohttp.TCPConnector):
+    def __init__(self, access_token, rate_limiter: AdaptiveRateLimiter = None, cache: ResponseCache = None,
+                 json_decoder: Union[str, JsonDecoder] = None, transport: Union[str, Transport] = None,
+                 metrics: MetricsCollector = None, spool: PageSpool = None, retry_policy: RetryPolicy = None):
         """
 
+        :param access_token:
+        :param rate_limiter: (optional) limiter shared with other clients using the same access token
+        :param cache: (optional) on-disk cache of query results
+        :param json_decoder: (optional) 'orjson', 'msgspec' or 'json'
+        :param transport: (optional) 'aiohttp' (default), 'httpx' or a :class:`Transport` with custom pool settings
+        :param metrics: (optional) collector of the request metrics, shared with other clients
+        :param spool: (optional) checkpoints of the pages on disk, to resume interrupted downloads
+        :param retry_policy: (optional) retries of the requests, shared with the other clients of the api
+        """
+        super().__init__(access_token, rate_limiter=rate_limiter, cache=cache, json_decoder=json_decoder,
+                         metrics=metrics, spool=spool, retry_policy=retry_policy)
+        # pooled connections, kept open until close()
+        self.transport = get_transport(transport, pool_size=PARALLEL_REQUESTS)
+        # the transport decodes the bodies itself and knows zstd when zstandard is installed
+        self._transport_headers = dict(self.headers, **{'Accept-Encoding': accept_encoding()})
+        self._loop_thread: Optional[_EventLoopThread] = None
+        self._loop_thread_lock = threading.Lock()
+        self._shutdown = None
+
+    def _event_loop_thread(self) -> _EventLoopThread:
+        with self._loop_thread_lock:
+            if self._loop_thread is None:
+                self._loop_thread = _EventLoopThread()
+                # also runs when the client is garbage collected or at exit without close()
+                self._shutdown = weakref.finalize(self, _shutdown_loop_thread, self._loop_thread, self.transport)
+            return self._loop_thread
+
+    def close(self):
+        """Close the pooled connections and stop the event loop thread of the sync api."""
+        with self._loop_thread_lock:
+            if self._shutdown is not None:
+                self._shutdown()
+            self._loop_thread, self._shutdown = None, None
+        super().close()
+
+    async def _send_async(self, metrics: RequestMetrics, data=None, params=None) -> TransportResponse:
+        """
+        Send one attempt of a request through the rate limiter and the transport, and measure it. The metrics of
+        successful responses are published by :meth:`_request_async`, once the body is decoded.
+        """
+        method, url = metrics.method, metrics.url
+        started = time.monotonic()
+        await self.rate_limiter.acquire_async()
+        metrics.queue_wait = time.monotonic() - started
+
+        status, resp_headers = None, None
+        try:
+            response = await self.transport.request(method, url, headers=self._transport_headers, data=data,
+                                                    params=params, timeout=_api_timeout)
+            status, resp_headers = response.status, response.headers
+        except Exception as e:
+            metrics.error = type(e).__name__
+            self.metrics.record(metrics)
+            raise
+        finally:
+            await self.rate_limiter.release_async(status, resp_headers)
+        self.transfer_stats.add(response.wire_bytes, len(response.content))
+        metrics.status = status
+        metrics.ttfb, metrics.transfer_time = response.ttfb, response.transfer_time
+        metrics.wire_bytes, metrics.decoded_bytes = response.wire_bytes, len(response.content)
+
+        if not response.ok:
+            self.metrics.record(metrics)
+        return response
+
+    async def _request_async(self, method: str, url: str, data=None, params=None) -> Optional[Dict]:
+        """
+        Send a request through the transport, with the retries of the retry policy, and decode its json body.
+
+        :return: json body, None on 401 or when the api answers with an error
+        :raises HTTPStatusError: when the api answers with an error status and no retry was left
+        """
+        metrics = None
+
+        async def send(attempt):
+            nonlocal metrics
+            metrics = RequestMetrics(method, url, attempt)
+            return await self._send_async(metrics, data=data, params=params)
+
+        response = await self.retry_policy.call_async(send, url, retry_on=self.transport.retryable_errors)
+        if response.status == 401:
+            LOGGER.error(response.text)
+            _mark_incomplete()
+            return None
+        if response.status == 429:
+            LOGGER.warning(
+                'Too Many Requests, rate_limit_request_count: %s',
+                response.headers.get('rate_limit_request_count')
+            )
+        response.raise_for_status()
+        started = time.monotonic()
+        json_data = self.json_decoder.loads(response.content)
+        metrics.decode_time = time.monotonic() - started
+        metrics.rows = _row_count(json_data)
+        self.metrics.record(metrics)
+        if 'error' in json_data:
+            # raise Exception(json_data['error'])
+            logging.error(json_data['error'])
+            _mark_incomplete()
+            return None
+        return json_data
+
+    async def _fetch_page_async(self, url, payload: PayloadModelBase, pagination_start: int) -> Optional[Dict]:
+        """
+
+        :param url:
+        :param payload:
+        :param pagination_start:
+        :return: json body of the page
+        """
+        return await self._request_async('POST', url, data=payload.payload(pagination_start=pagination_start))
+
+    async def _spooled_page_async(self, url, payload: PayloadModelBase, pagination_start: int) -> Optional[Dict]:
+        """:meth:`_spooled_page` for coroutines, the spool files are read and written off the loop."""
+        if self.spool is None:
+            return await self._fetch_page_async(url, payload, pagination_start)
+
+        loop = asyncio.get_running_loop()
+        key = self._spool_key(url, payload)
+        if pagination_start:
+            json_result = await loop.run_in_executor(None, self.spool.read_page, key, pagination_start)
+            if json_result is not None:
+                return json_result
+        json_result = await self._fetch_page_async(url, payload, pagination_start)
+        if json_result is not None:
+            if not pagination_start:
+                await loop.run_in_executor(None, self.spool.check, key, json_result['pagination'])
+            await loop.run_in_executor(None, functools.partial(self.spool.write_page, key, pagination_start,
+                                                               json_result, url=url, payload=payload))
+        return json_result
+
+    async def _iter_pages_async(self, url, payload: PayloadModelBase, page_size, total_pages, progress_bar,
+                                window=PARALLEL_REQUESTS, ordered=True,
+                                reorder_buffer: Optional[int] = None) -> AsyncIterator[Dict]:
+        """
+        Fetch pages 1 to ``total_pages - 1`` concurrently and yield the json body of each page. No more than
+        ``window`` pages are requested at a time.
+
+        Ordered, a page that arrives early waits in its slot until the pages before it were yielded, so the rows
+        come out in the same order as when fetched one after another. ``reorder_buffer`` bounds how many pages
+        may be requested past the oldest page not yielded yet, which bounds the pages held in memory.
+
         :param url:
         :param payload:
-        :param data_list:
+        :param page_size:
+        :param total_pages:
+        :param progress_bar:
+        :param window: maximum number of requests in flight
+        :param ordered: yield the pages in page order, False to yield them as they arrive
+        :param reorder_buffer: (optional) with ``ordered``, maximum number of pages fetched ahead of the oldest
+            page not yielded yet, defaults to ``window``, 0 for no bound
+        :return:
+        """
+        window = max(1, window)
+        reorder_buffer = total_pages if reorder_buffer == 0 else max(window, reorder_buffer or window)
+        # preallocated slot per page, filled as pages arrive, page 0 was fetched by the caller
+        slots: List = [None] * total_pages
+        pending = {}
+        next_page = 1
+        next_to_yield = 1
+        try:
+            while next_page < total_pages or pending:
+                while (next_page < total_pages and len(pending) < window
+                       and (not ordered or next_page - next_to_yield < reorder_buffer)):
+                    task = asyncio.ensure_future(self._spooled_page_async(url, payload, next_page * page_size))
+                    pending[task] = next_page
+                    next_page += 1
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page = pending.pop(task)
+                    progress_bar.update()
+                    # raises once the retry policy gave up the page, the pending pages are cancelled below
+                    json_result = task.result()
+                    if not ordered:
+                        if json_result:
+                            yield json_result
+                        continue
+                    # pages without data are skipped rather than holding back the ones after them
+                    slots[page] = json_result or _missing_page
+
+                while ordered and next_to_yield < total_pages and slots[next_to_yield] is not None:
+                    json_result, slots[next_to_yield] = slots[next_to_yield], _missing_page
+                    next_to_yield += 1
+                    if json_result is not _missing_page:
+                        yield json_result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _post_async(self, url, payload: PayloadModelBase, builder: FrameBuilder, progress_bar, page_size,
+                          total_pages):
+        """
+
+        :param url:
+        :param payload:
+        :param builder: collects the rows of each page, in page order
         :param progress_bar:
         :param page_size:
         :param total_pages:
-        :param connector:
         :return:
         """
+        # fetching never waits on a slow page, pages arrived early are held until the ones before them are added
+        async for json_result in self._iter_pages_async(url, payload, page_size, total_pages, progress_bar,
+                                                        reorder_buffer=0):
+            builder.add_records(json_result['data'])
 
-        semaphore = asyncio.Semaphore(PARALLEL_REQUESTS)
-        session = aiohttp.ClientSession(connector=connector, headers=self.headers)
-
-        @retry(retry_policy)
-        async def fetch_from_api(page_number):
-            async with semaphore:
-                _data = payload.payload(pagination_start=page_number * page_size)
-                async with session.post(url, data=_data, timeout=_api_timeout, verify_ssl=False) as async_resp:
-                    async_resp.raise_for_status()
-                    json_data = await async_resp.json()
-                    if 'error' in json_data:
-                        # raise Exception(json_data['error'])
-                        logging.error(json_data['error'])
-                        return None
-                    return json_data
-
-        tasks = [
-            fetch_from_api(_page) for _page in range(1, total_pages + 1)
-        ]
-        for task in asyncio.as_completed(tasks):
-            try:
-                json_result = await task
-                if json_result:
-                    data_list.extend(json_result['data'])
-            except Exception as e:
-                LOGGER.exception(e, exc_info=True)
+    def _fetch_first_page(self, url, payload: PayloadModelBase, progress_bar, return_json=False,
+                          first_page: Dict = None, **kwargs) -> Optional[Dict]:
+        """
+        First page of a query, which tells the number of pages.
+
+        :param first_page: (optional) json body of the first page when it was fetched already, e.g. by a query plan
+        """
+        json_result = first_page
+        if json_result is None:
+            json_result = self._spooled_page(url, payload, payload.pagination_start,
+                                             lambda: self._fetch_json_page(url, payload, **kwargs))
+        if json_result is None:
             progress_bar.update()
-        await session.close()
+            return None
+
+        pagination = json_result['pagination']
+        total_pages = self._page_count(pagination)
+        progress_bar.reset(total=total_pages)
 
-    def post(self, url, payload: PayloadModelBase = None, return_json=False, **kwargs) -> pandas.DataFrame:
+        LOGGER.info('Total data size: %s, total pages to scan: %s', pagination['total_count'], total_pages)
+        progress_bar.update()
+        return json_result
+
+    def _post_all(self, url, payload: PayloadModelBase, return_json=False, schema: Schema = None,
+                  **kwargs) -> pandas.DataFrame:
+        LOGGER.info('Payload data: %s', payload)
+
+        builder = FrameBuilder(schema)
+
+        try:
+            with _progress_bar(desc=F"Querying API {url} pages", total=1, dynamic_ncols=True,
+                               miniters=0) as progress_bar:
+                json_result = self._fetch_first_page(url, payload, progress_bar, return_json, **kwargs)
+                if json_result is None:
+                    return pandas.DataFrame()
+
+                pagination = json_result['pagination']
+                total_pages = self._page_count(pagination)
+                builder.add_records(json_result['data'])
+
+                if total_pages > 1:
+                    self._event_loop_thread().run(
+                        self._post_async(url, payload, builder, progress_bar, pagination['page_size'], total_pages))
+                self._finish_spool(url, payload, total_pages)
+        finally:
+            payload.pagination_start = 0
+        LOGGER.info('Total response data: %s, %s', builder.rows, self.transfer_stats)
+        return self._build_frame(url, builder)
+
+    def iter_json_pages(self, url, payload: PayloadModelBase = None, return_json=False,
+                        read_ahead=PARALLEL_REQUESTS, ordered=True, **kwargs) -> Iterator[Dict]:
         r"""
-        Sends a POST request.
+        Sends a paginated POST request and yields the json body of each page. Pages are fetched concurrently and
+        yielded in page order, or in the order they complete.
 
         :param url: URL for the new :class:`Request` object.
-        :param payload: (optional) Dictionary, list of tuples, bytes, or file-like
-            object to send in the body of the :class:`Request`.
+        :param payload: query filters
         :param return_json:
+        :param read_ahead: maximum number of pages fetched or buffered ahead of the consumer
+        :param ordered: yield the pages in page order, False to yield each page as soon as it arrives
         :param \*\*kwargs: Optional arguments that ``request`` takes.
-        :return: :class:`Response <Response>` object
-        :rtype: requests.Response
+        :return: iterator of json bodies with ``data`` and ``pagination``
         """
+        return _iterate_in_context(self._query_context(),
+                                   self._iter_json_pages(url, payload, return_json, read_ahead, ordered, **kwargs))
 
+    def _iter_json_pages(self, url, payload: PayloadModelBase, return_json=False, read_ahead=PARALLEL_REQUESTS,
+                         ordered=True, **kwargs) -> Iterator[Dict]:
         LOGGER.info('Payload data: %s', payload)
 
-        data_list: List[Dict] = []
+        with _progress_bar(desc=F"Querying API {url} pages", total=1, dynamic_ncols=True, miniters=0) as progress_bar:
+            json_result = self._fetch_first_page(url, payload, progress_bar, return_json, **kwargs)
+            if json_result is None:
+                return
 
-        with tqdm(desc=F"Querying API {url} pages", total=1, dynamic_ncols=True, miniters=0) as progress_bar:
-            response = self.session.post(url, data=payload.payload(), timeout=_api_timeout, **kwargs)
-            if response.status_code == 401:
-                progress_bar.update()
-                LOGGER.error(response.text)
-                return pandas.DataFrame()
+            pagination = json_result['pagination']
+            total_pages = self._page_count(pagination)
+            yield json_result
+
+            if total_pages > 1:
+                pages = self._event_loop_thread().iterate(
+                    self._iter_pages_async(url, payload, pagination['page_size'], total_pages, progress_bar,
+                                           window=read_ahead, ordered=ordered))
+                # consumed by the read ahead thread, in the context of the query
+                yield from _read_ahead(_iterate_in_context(contextvars.copy_context(), pages), read_ahead)
+            self._finish_spool(url, payload, total_pages)
+
+    # async api, to be awaited from a running event loop
+
+    async def close_async(self):
+        """Close the pooled connections opened by the async api, from the loop that used them."""
+        await self.transport.close()
+
+    async def _cached_async(self, key_args, fetch, use_cache=True, refresh_cache=False) -> pandas.DataFrame:
+        """:meth:`_cached` for coroutines, the cache files are read and written off the loop."""
+        if self.cache is None or not use_cache:
+            return await fetch()
+
+        loop = asyncio.get_running_loop()
+        key = self.cache.key(*key_args, scope=self.access_key)
+        if not refresh_cache:
+            df = await loop.run_in_executor(None, self.cache.get, key)
+            if df is not None:
+                LOGGER.info('Loaded %s rows from cache for %s', len(df), key_args[0])
+                df.attrs[ATTRS_KEY] = {'url': key_args[0], 'cache_hit': True, 'rows': len(df)}
+                return df
+
+        df = await fetch()
+        if df is not None and not df.empty:
+            await loop.run_in_executor(None, self.cache.put, key, df)
+        return df
+
+    async def _get_async(self, url, params=None) -> Optional[Dict]:
+        return await self._request_async('GET', url, params=params)
+
+    async def get_async(self, url, params=None, use_cache=True, refresh_cache=False) -> pandas.DataFrame:
+        """
+        Sends a GET request from the running event loop.
+
+        :param url:
+        :param params: (optional) query string parameters
+        :param use_cache: (optional) False to bypass the response cache
+        :param refresh_cache: (optional) True to fetch from the api and replace the cached result
+        :return: pandas.DataFrame
+        """
+        async def fetch():
+            LOGGER.info(url)
+            budget_token = current_budget.set(self.retry_policy.new_budget())
+            try:
+                json_result = await self._get_async(url, params)
+            finally:
+                current_budget.reset(budget_token)
+            return pandas.DataFrame(json_result['data']) if json_result else pandas.DataFrame()
+
+        return await self._cached_async((url, None, params), fetch, use_cache, refresh_cache)
+
+    async def iter_json_pages_async(self, url, payload: PayloadModelBase = None, read_ahead=PARALLEL_REQUESTS,
+                                    ordered=True, reorder_buffer: int = None) -> AsyncIterator[Dict]:
+        """
+        Sends a paginated POST request from the running event loop and yields the json body of each page, in page
+        order or in completion order.
+
+        :param url:
+        :param payload: query filters
+        :param read_ahead: maximum number of pages requested ahead of the consumer
+        :param ordered: yield the pages in page order, False to yield each page as soon as it arrives
+        :param reorder_buffer: (optional) with ``ordered``, maximum number of pages fetched past the oldest page
+            not yielded yet, defaults to ``read_ahead``, 0 for no bound
+        :return: async iterator of json bodies with ``data`` and ``pagination``
+        """
+        LOGGER.info('Payload data: %s', payload)
+
+        with _progress_bar(desc=F"Querying API {url} pages", total=1, dynamic_ncols=True, miniters=0) as progress_bar:
+            json_result = await self._spooled_page_async(url, payload, payload.pagination_start)
+            progress_bar.update()
+            if json_result is None:
+                return
 
-            json_result = self._return_response(response, return_json)
             pagination = json_result['pagination']
-            total_count = pagination['total_count']
-            total_pages = pagination['total_count'] // pagination['page_size']
-            total_pages = total_pages + 1 if total_count % pagination['page_size'] > 0 else 0
-            page_size = pagination['page_size']
+            total_pages = self._page_count(pagination)
             progress_bar.reset(total=total_pages)
+            progress_bar.update()
+            LOGGER.info('Total data size: %s, total pages to scan: %s', pagination['total_count'], total_pages)
+            yield json_result
 
-            LOGGER.info('Total data size: %s, total pages to scan: %s', total_count, total_pages)
+            if total_pages > 1:
+                async for json_result in self._iter_pages_async(url, payload, pagination['page_size'], total_pages,
+                                                                progress_bar, window=read_ahead, ordered=ordered,
+                                                                reorder_buffer=reorder_buffer):
+                    yield json_result
+            if self.spool is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self._finish_spool, url, payload,
+                                                                 total_pages)
+
+    async def iter_pages_async(self, url, payload: PayloadModelBase = None, read_ahead=PARALLEL_REQUESTS,
+                               schema: Schema = None, ordered=True) -> AsyncIterator[pandas.DataFrame]:
+        """
+        :meth:`iter_json_pages_async` with one DataFrame per page.
 
-            data_list.extend(json_result['data'])
+        :param schema: (optional) column dtypes of the pages, other columns are inferred
+        :param ordered: yield the pages in page order, False to yield each page as soon as it arrives
+        """
+        async for json_result in self.iter_json_pages_async(url, payload, read_ahead, ordered=ordered):
+            yield frame_from_records(json_result['data'], schema)
 
-            if total_pages > 1:
-                connector = aiohttp.TCPConnector(limit=PARALLEL_REQUESTS, limit_per_host=PARALLEL_REQUESTS)
-                loop = asyncio.get_event_loop()
-                loop.run_until_complete(
-                    self._post_async(url, payload, data_list, progress_bar, page_size, total_pages, connector))
-                connector.close()
+    async def post_async(self, url, payload: PayloadModelBase = None, use_cache=True, refresh_cache=False,
+                         schema: Schema = None) -> pandas.DataFrame:
+        """
+        Sends a paginated POST request from the running event loop and returns the full result.
 
-        payload.pagination_start = 0
-        LOGGER.info('Total response data: %s', len(data_list))
-        df = pandas.DataFrame(data_list)
-        return df
+        :param url:
+        :param payload: query filters
+        :param use_cache: (optional) False to bypass the response cache
+        :param refresh_cache: (optional) True to fetch from the api and replace the cached result
+        :param schema: (optional) column dtypes of the result, other columns are inferred
+        :return: pandas.DataFrame
+        """
+        async def fetch():
+            builder = FrameBuilder(schema)
+            # in page order, without holding back requests behind a slow page
+            async for json_result in self.iter_json_pages_async(url, payload, reorder_buffer=0):
+                builder.add_records(json_result['data'])
+            LOGGER.info('Total response data: %s, %s', builder.rows, self.transfer_stats)
+            return self._build_frame(url, builder)
+
+        async def measured():
+            query = QueryMetrics(url)
+            token = current_query.set(query)
+            budget_token = current_budget.set(self.retry_policy.new_budget())
+            try:
+                df = await fetch()
+            finally:
+                current_budget.reset(budget_token)
+                current_query.reset(token)
+            query.finish()
+            if df is not None:
+                df.attrs[ATTRS_KEY] = query.as_dict()
+            return df
+
+        return await self._cached_async((url, payload), measured, use_cache, refresh_cache)
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from synmax.common.lazy import LazyModule
+from synmax.common.model import PayloadModelBase
+
+pandas = LazyModule('pandas')
+
+LOGGER = logging.getLogger(__name__)
+
+_default_cache_dir = os.path.join(Path.home(), '.cache', 'synmax')
+_formats = ('parquet', 'pkl')
+
+
+def _parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_frame(df: pandas.DataFrame, path_stem: str) -> str:
+    """
+    Atomically write ``df`` to ``path_stem`` + '.parquet', or '.pkl' when parquet is unavailable or the
+    frame cannot be stored as parquet. Any previous file with the same stem is replaced.
+
+    :return: path of the written file
+    """
+    directory = os.path.dirname(path_stem) or '.'
+    tmp_path = os.path.join(directory, f'.{os.path.basename(path_stem)}.{uuid.uuid4().hex}.tmp')
+    path = None
+    try:
+        if _parquet_available():
+            try:
+                df.to_parquet(tmp_path, index=False)
+                path = f'{path_stem}.parquet'
+            except Exception as e:
+                # e.g. columns mixing numbers and strings
+                LOGGER.debug('Could not store frame as parquet, using pickle: %s', e)
+        if path is None:
+            df.to_pickle(tmp_path)
+            path = f'{path_stem}.pkl'
+
+        for fmt in _formats:
+            if os.path.exists(f'{path_stem}.{fmt}') and f'{path_stem}.{fmt}' != path:
+                os.remove(f'{path_stem}.{fmt}')
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def find_frame(path_stem: str) -> Optional[str]:
+    """Path of the frame written by :func:`write_frame` under ``path_stem``, None if there is none."""
+    for fmt in _formats:
+        path = f'{path_stem}.{fmt}'
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_frame(path: str) -> pandas.DataFrame:
+    return pandas.read_parquet(path) if path.endswith('.parquet') else pandas.read_pickle(path)
+
+
+def canonical_payload(payload: PayloadModelBase) -> str:
+    """
+    Serialize the query filters of ``payload`` to a stable string, pagination excluded.
+    """
+    if payload is None:
+        return ''
+    return payload.canonical()
+
+
+def query_key(url: str, payload: PayloadModelBase = None, params=None, scope: str = None) -> str:
+    """
+    Hash identifying a query, shared by the response cache and the page spool.
+
+    :param url:
+    :param payload: (optional) POST filters, pagination is ignored
+    :param params: (optional) GET query parameters
+    :param scope: (optional) e.g. the access key
+    :return: hex digest
+    """
+    params = json.dumps(params, sort_keys=True, default=str) if params else ''
+    raw = '\n'.join([scope or '', url, canonical_payload(payload), params])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of query results, keyed on the url and the query filters.
+
+    Results are stored as parquet when pyarrow is installed (pickle otherwise). Entries older than ``ttl`` seconds
+    are ignored, and the least recently used entries are evicted once the cache grows past ``max_size`` bytes.
+    """
+
+    def __init__(self, directory: str = None, ttl: Optional[float] = 24 * 3600, max_size: int = 2 * 1024 ** 3):
+        """
+
+        :param directory: cache folder, defaults to ~/.cache/synmax
+        :param ttl: seconds an entry stays valid, None to never expire
+        :param max_size: maximum size of the cache folder in bytes
+        """
+        self.directory = os.path.expanduser(directory or _default_cache_dir)
+        self.ttl = ttl
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return f'ResponseCache(directory={self.directory!r}, ttl={self.ttl}, max_size={self.max_size})'
+
+    @staticmethod
+    def key(url: str, payload: PayloadModelBase = None, params=None, scope: str = None) -> str:
+        """
+        Cache key of a request.
+
+        :param url:
+        :param payload: (optional) POST filters, pagination is ignored
+        :param params: (optional) GET query parameters
+        :param scope: (optional) e.g. the access key, entries are not shared across scopes
+        :return: hex digest
+        """
+        return query_key(url, payload, params, scope)
+
+    def _path_stem(self, key) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[pandas.DataFrame]:
+        """
+        Cached result for ``key``, None when missing or expired.
+        """
+        path = find_frame(self._path_stem(key))
+        if path is None:
+            return None
+
+        try:
+            stat = os.stat(path)
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                LOGGER.debug('Cache entry expired: %s', path)
+                os.remove(path)
+                return None
+
+            df = read_frame(path)
+            # modification time records when the entry was written, access time drives LRU eviction
+            os.utime(path, (time.time(), stat.st_mtime))
+        except (OSError, ValueError) as e:
+            LOGGER.warning('Ignoring unreadable cache entry %s: %s', path, e)
+            return None
+        return df
+
+    def put(self, key: str, df: pandas.DataFrame):
+        """
+        Store a result under ``key`` and evict old entries if the cache is over its size.
+        """
+        write_frame(df, self._path_stem(key))
+        self._evict()
+
+    def invalidate(self, key: str):
+        path = find_frame(self._path_stem(key))
+        if path is not None:
+            os.remove(path)
+
+    def clear(self):
+        """Remove every entry."""
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(_formats):
+                os.remove(entry.path)
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(_formats):
+                stat = entry.stat()
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        # least recently used first
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            LOGGER.debug('Evicted cache entry %s', path)
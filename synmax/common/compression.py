@@ -0,0 +1,154 @@
+import threading
+import zlib
+from typing import List
+
+# preferred first
+_ENCODINGS = ('zstd', 'br', 'gzip', 'deflate')
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        try:
+            import brotlicffi as brotli
+        except ImportError:
+            return None
+    return brotli
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def available_encodings(zstd=True) -> List[str]:
+    """
+    Content encodings that can be decoded here, preferred first. gzip and deflate are always available, br needs
+    brotli and zstd needs zstandard.
+
+    :param zstd: False when the responses are decoded by urllib3 1.x, which does not know zstd
+    """
+    encodings = []
+    if zstd and _zstandard() is not None:
+        encodings.append('zstd')
+    if _brotli() is not None:
+        encodings.append('br')
+    return encodings + ['gzip', 'deflate']
+
+
+def accept_encoding(zstd=True) -> str:
+    """Accept-Encoding header value for :func:`available_encodings`."""
+    return ', '.join(available_encodings(zstd=zstd))
+
+
+def _has_zlib_header(data: bytes) -> bool:
+    # deflate method in the low bits of CMF, CMF and FLG together a multiple of 31 (RFC 1950)
+    return data[0] & 0x0f == 8 and ((data[0] << 8) | data[1]) % 31 == 0
+
+
+class _Deflate:
+    """deflate is sent with or without the zlib header depending on the server."""
+
+    def __init__(self):
+        self._decompressor = None
+        self._head = b''
+
+    def decompress(self, data: bytes) -> bytes:
+        if self._decompressor is None:
+            # the first two bytes tell whether there is a zlib header, chunks may be shorter
+            self._head += data
+            if len(self._head) < 2:
+                return b''
+            data, self._head = self._head, b''
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS if _has_zlib_header(data) else -zlib.MAX_WBITS)
+        return self._decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        if self._decompressor is None:
+            return zlib.decompressobj(-zlib.MAX_WBITS).decompress(self._head) if self._head else b''
+        return self._decompressor.flush()
+
+
+class StreamDecoder:
+    """
+    Decompresses a response body chunk by chunk as it arrives, and counts the bytes received and produced.
+    """
+
+    def __init__(self, content_encoding: str = None):
+        """
+
+        :param content_encoding: Content-Encoding header of the response, None or identity for no compression
+        :raises ValueError: for an encoding that cannot be decoded here
+        """
+        self.encoding = (content_encoding or 'identity').strip().lower()
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self._chunks = []
+        self._decompressor = self._create_decompressor(self.encoding)
+
+    @staticmethod
+    def _create_decompressor(encoding):
+        if encoding == 'identity':
+            return None
+        if encoding in ('gzip', 'x-gzip'):
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if encoding == 'deflate':
+            return _Deflate()
+        if encoding == 'br' and _brotli() is not None:
+            return _brotli().Decompressor()
+        if encoding == 'zstd' and _zstandard() is not None:
+            return _zstandard().ZstdDecompressor().decompressobj()
+        raise ValueError(f'Cannot decode Content-Encoding {encoding}')
+
+    def _append(self, data: bytes):
+        if data:
+            self._chunks.append(data)
+            self.decoded_bytes += len(data)
+
+    def write(self, chunk: bytes):
+        self.wire_bytes += len(chunk)
+        if self._decompressor is None:
+            self._append(chunk)
+        elif hasattr(self._decompressor, 'decompress'):
+            self._append(self._decompressor.decompress(chunk))
+        else:
+            # brotli
+            self._append(self._decompressor.process(chunk))
+
+    def finish(self) -> bytes:
+        """Flush the decompressor and return the whole decoded body."""
+        flush = getattr(self._decompressor, 'flush', None)
+        if flush is not None:
+            self._append(flush())
+        body = b''.join(self._chunks)
+        self._chunks = []
+        return body
+
+
+class TransferStats:
+    """Bytes received from the api, as sent on the wire and after decompression. Thread safe."""
+
+    def __init__(self):
+        self.responses = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (f'TransferStats(responses={self.responses}, wire_bytes={self.wire_bytes}, '
+                f'decoded_bytes={self.decoded_bytes}, ratio={self.ratio:.1f})')
+
+    @property
+    def ratio(self) -> float:
+        """Compression ratio, decoded bytes per byte received."""
+        return self.decoded_bytes / self.wire_bytes if self.wire_bytes else 1.0
+
+    def add(self, wire_bytes: int, decoded_bytes: int):
+        with self._lock:
+            self.responses += 1
+            self.wire_bytes += wire_bytes
+            self.decoded_bytes += decoded_bytes
@@ -0,0 +1,70 @@
+import json
+import logging
+from typing import Any, Callable, Union
+
+LOGGER = logging.getLogger(__name__)
+
+# fastest first
+DECODERS = ('orjson', 'msgspec', 'json')
+
+
+class JsonDecoder:
+    """
+    Parses response bodies. Uses orjson or msgspec when installed, they parse the raw bytes without decoding
+    them to a str first, and the standard library otherwise.
+    """
+
+    def __init__(self, name: str, loads: Callable[[bytes], Any]):
+        self.name = name
+        self._loads = loads
+
+    def __repr__(self):
+        return f'JsonDecoder({self.name!r})'
+
+    def loads(self, body: Union[bytes, str]) -> Any:
+        return self._loads(body)
+
+    @classmethod
+    def create(cls, name: str) -> 'JsonDecoder':
+        """
+        Decoder backed by the library ``name``, one of :data:`DECODERS`.
+
+        :raises ImportError: when the library is not installed
+        """
+        if name == 'orjson':
+            import orjson
+            return cls(name, orjson.loads)
+        if name == 'msgspec':
+            import msgspec
+            return cls(name, msgspec.json.Decoder().decode)
+        if name == 'json':
+            return cls(name, json.loads)
+        raise ValueError(f'Unknown json decoder {name}, use one of {DECODERS}')
+
+
+def get_decoder(decoder: Union[str, JsonDecoder] = None) -> JsonDecoder:
+    """
+    :param decoder: (optional) decoder or library name, defaults to the fastest installed library
+    :return: JsonDecoder
+    """
+    if isinstance(decoder, JsonDecoder):
+        return decoder
+    if decoder is not None:
+        return JsonDecoder.create(decoder)
+    return _default_decoder()
+
+
+_default = None
+
+
+def _default_decoder() -> JsonDecoder:
+    global _default
+    if _default is None:
+        for name in DECODERS:
+            try:
+                _default = JsonDecoder.create(name)
+                break
+            except ImportError:
+                continue
+        LOGGER.debug('Using %s to parse responses', _default.name)
+    return _default
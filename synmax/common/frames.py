@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import functools
+import logging
+from typing import Dict, List, Optional
+
+from synmax.common.lazy import LazyModule
+
+numpy = LazyModule('numpy')
+pandas = LazyModule('pandas')
+
+LOGGER = logging.getLogger(__name__)
+
+# column name -> dtype, e.g. {'date': 'datetime64[ns]', 'state_ab': 'category', 'api': 'Int64'}
+Schema = Dict[str, str]
+
+
+@functools.lru_cache(maxsize=None)
+def _iso_date_options() -> dict:
+    """Options of ``pandas.to_datetime`` for ISO 8601 dates, format='ISO8601' needs pandas >= 2.0."""
+    if int(pandas.__version__.split('.')[0]) >= 2:
+        return {'format': 'ISO8601'}
+    return {'infer_datetime_format': True}
+
+
+def _typed_column(values: list, dtype: str):
+    if dtype.startswith('datetime64'):
+        # dates repeat across rows, parse each distinct value once
+        codes, uniques = pandas.factorize(pandas.Index(values, dtype=object))
+        dates = pandas.to_datetime(uniques, **_iso_date_options()).astype(dtype)
+        return dates.take(codes, allow_fill=True, fill_value=pandas.NaT)
+    if dtype == 'category':
+        codes, categories = pandas.factorize(numpy.array(values, dtype=object), sort=True)
+        return pandas.Categorical.from_codes(codes, categories=categories)
+    if dtype.startswith('float'):
+        # None becomes NaN
+        return numpy.array(values, dtype=dtype)
+    return pandas.array(values, dtype=dtype)
+
+
+def typed_column(name: str, values: list, dtype: str = None):
+    """
+    Column of ``dtype`` from a list of json values, inferred when ``dtype`` is None or the values do not fit it.
+    """
+    if dtype is not None:
+        try:
+            return _typed_column(values, dtype)
+        except (TypeError, ValueError, OverflowError) as e:
+            LOGGER.debug('Column %s does not fit %s, inferring its type: %s', name, dtype, e)
+    return pandas.Series(values, dtype=object).infer_objects()
+
+
+class FrameBuilder:
+    """
+    Accumulates json records column by column and builds one DataFrame, converting each column to its
+    ``schema`` dtype in a single pass. Columns missing from the schema are inferred.
+    """
+
+    def __init__(self, schema: Optional[Schema] = None):
+        self.schema = schema or {}
+        self.rows = 0
+        self._columns: Dict[str, list] = {}
+
+    def add_records(self, records: List[Dict]):
+        if not records:
+            return
+
+        width = len(records[0])
+        try:
+            # records of a page usually share their keys
+            if any(len(record) != width for record in records):
+                raise KeyError
+            values = {name: [record[name] for record in records] for name in records[0]}
+        except KeyError:
+            names = dict.fromkeys(key for record in records for key in record)
+            values = {name: [record.get(name) for record in records] for name in names}
+
+        for name in values:
+            if name not in self._columns:
+                self._columns[name] = [None] * self.rows
+        for name, column in self._columns.items():
+            column.extend(values.pop(name) if name in values else [None] * len(records))
+        self.rows += len(records)
+
+    def build(self) -> pandas.DataFrame:
+        if not self._columns:
+            return pandas.DataFrame()
+        if not self.schema:
+            return pandas.DataFrame(self._columns)
+
+        columns = {}
+        while self._columns:
+            # free the raw values column by column
+            name, values = next(iter(self._columns.items()))
+            del self._columns[name]
+            columns[name] = typed_column(name, values, self.schema.get(name))
+        return pandas.DataFrame(columns)
+
+
+def frame_from_records(records: List[Dict], schema: Optional[Schema] = None) -> pandas.DataFrame:
+    """DataFrame of json records, with ``schema`` dtypes when given."""
+    if not schema:
+        return pandas.DataFrame(records)
+    builder = FrameBuilder(schema)
+    builder.add_records(records)
+    return builder.build()
+
+
+def concat_frames(frames: List[pandas.DataFrame]) -> pandas.DataFrame:
+    """
+    Concatenate frames, keeping categorical columns categorical when their categories differ.
+    """
+    frames = [df for df in frames if df is not None]
+    if not frames:
+        return pandas.DataFrame()
+    if len(frames) > 1:
+        for name in frames[0].columns:
+            if all(name in df.columns and isinstance(df[name].dtype, pandas.CategoricalDtype) for df in frames):
+                categories = pandas.api.types.union_categoricals([df[name] for df in frames]).categories
+                frames = [df.assign(**{name: df[name].cat.set_categories(categories)}) for df in frames]
+    return pandas.concat(frames, ignore_index=True)
@@ -0,0 +1,40 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    Stands for a module imported on first attribute access, e.g. ``pandas = LazyModule('pandas')``.
+
+    pandas, numpy and pyarrow take most of the time of ``import synmax.hyperion``, while short lived scripts may
+    never build a DataFrame. Modules keep their ``pandas.DataFrame`` style calls, annotations are not evaluated
+    (``from __future__ import annotations``), so the import happens on the first call actually using the module.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, name: str):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'LazyModule({self._name!r}, {state})'
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = self._module
+                if module is None:
+                    module = self.__dict__['_module'] = importlib.import_module(self._name)
+        return module
+
+    def __getattr__(self, name: str):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(self._load(), name, value)
+
+    def __dir__(self):
+        return dir(self._load())
@@ -0,0 +1,245 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+LOGGER = logging.getLogger(__name__)
+
+# key of the query summary in DataFrame.attrs
+ATTRS_KEY = 'synmax_metrics'
+
+
+class RequestMetrics:
+    """
+    Timings and sizes of one HTTP request, retries are separate requests numbered by ``attempt``.
+
+    Durations are in seconds: ``queue_wait`` is the time spent waiting for the rate limiter, ``ttfb`` the time
+    until the response headers arrived, ``transfer_time`` the time to read the body and ``decode_time`` the time
+    to parse the json.
+    """
+
+    __slots__ = ('method', 'url', 'attempt', 'status', 'error', 'started', 'queue_wait', 'ttfb', 'transfer_time',
+                 'decode_time', 'wire_bytes', 'decoded_bytes', 'rows')
+
+    def __init__(self, method: str, url: str, attempt: int = 1):
+        self.method = method
+        self.url = url
+        # 1 for the first attempt, 2 for the first retry, ...
+        self.attempt = attempt
+        self.status: Optional[int] = None
+        self.error: Optional[str] = None
+        self.started = time.time()
+        self.queue_wait = 0.0
+        self.ttfb = 0.0
+        self.transfer_time = 0.0
+        self.decode_time = 0.0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.rows = 0
+
+    def __repr__(self):
+        return (f'RequestMetrics({self.method} {self.url} status={self.status}, attempt={self.attempt}, '
+                f'ttfb={self.ttfb:.3f})')
+
+    @property
+    def endpoint(self) -> str:
+        return urlparse(self.url).path.strip('/')
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status is not None and self.status < 400
+
+    @property
+    def duration(self) -> float:
+        return self.queue_wait + self.ttfb + self.transfer_time + self.decode_time
+
+    def as_dict(self) -> Dict:
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values['endpoint'] = self.endpoint
+        return values
+
+
+class QueryMetrics:
+    """Summary of one paginated query, stored in ``DataFrame.attrs['synmax_metrics']`` of its result."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        self.requests = 0
+        self.failed_requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.rows = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.decode_time = 0.0
+        self.build_time = 0.0
+        # False once the api refused a page, e.g. with a 401, the result then misses rows
+        self.complete = True
+        self._lock = threading.Lock()
+
+    def add(self, request: RequestMetrics):
+        with self._lock:
+            self.requests += 1
+            if not request.ok:
+                self.failed_requests += 1
+            if request.attempt > 1:
+                self.retries += 1
+            if request.status == 429:
+                self.throttled += 1
+            self.rows += request.rows
+            self.wire_bytes += request.wire_bytes
+            self.decoded_bytes += request.decoded_bytes
+            self.decode_time += request.decode_time
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+
+    def as_dict(self) -> Dict:
+        return {
+            'url': self.url,
+            'cache_hit': False,
+            'elapsed': self.elapsed,
+            'requests': self.requests,
+            'retries': self.retries,
+            'failed_requests': self.failed_requests,
+            'throttled': self.throttled,
+            'rows': self.rows,
+            'rows_per_second': self.rows / self.elapsed if self.elapsed else None,
+            'wire_bytes': self.wire_bytes,
+            'decoded_bytes': self.decoded_bytes,
+            'decode_time': self.decode_time,
+            'build_time': self.build_time,
+            'complete': self.complete,
+        }
+
+
+# query of the running call, requests of concurrent pages are attributed to it
+current_query: contextvars.ContextVar = contextvars.ContextVar('synmax_current_query', default=None)
+
+
+class MetricsCollector:
+    """
+    Collects the :class:`RequestMetrics` of every request of the clients it is passed to.
+
+    Hooks are called with each request as it completes, e.g. to forward it to OpenTelemetry or StatsD.
+    :meth:`summary` aggregates per endpoint and :meth:`to_prometheus` renders the counters in the Prometheus text
+    format.
+    """
+
+    def __init__(self, hooks: List[Callable[[RequestMetrics], None]] = None):
+        """
+
+        :param hooks: (optional) callables receiving each :class:`RequestMetrics`
+        """
+        self.hooks = list(hooks or [])
+        self._lock = threading.Lock()
+        self._totals: Dict[tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._frames: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def __repr__(self):
+        return f'MetricsCollector(hooks={len(self.hooks)})'
+
+    def add_hook(self, hook: Callable[[RequestMetrics], None]):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[RequestMetrics], None]):
+        self.hooks.remove(hook)
+
+    def record(self, request: RequestMetrics):
+        """Add a completed request to the totals, to the running query and pass it to the hooks."""
+        status = str(request.status) if request.status is not None else 'error'
+        with self._lock:
+            totals = self._totals[(request.endpoint, status)]
+            totals['requests'] += 1
+            totals['retries'] += request.attempt > 1
+            totals['queue_wait'] += request.queue_wait
+            totals['ttfb'] += request.ttfb
+            totals['transfer_time'] += request.transfer_time
+            totals['decode_time'] += request.decode_time
+            totals['wire_bytes'] += request.wire_bytes
+            totals['decoded_bytes'] += request.decoded_bytes
+            totals['rows'] += request.rows
+
+        query = current_query.get()
+        if query is not None:
+            query.add(request)
+
+        for hook in self.hooks:
+            try:
+                hook(request)
+            except Exception:
+                LOGGER.exception('Metrics hook %s failed', hook)
+
+    def record_frame(self, url: str, rows: int, build_time: float):
+        """Add the construction of a result DataFrame."""
+        with self._lock:
+            totals = self._frames[urlparse(url).path.strip('/')]
+            totals['frames'] += 1
+            totals['rows'] += rows
+            totals['build_time'] += build_time
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self._frames.clear()
+
+    def summary(self) -> List[Dict]:
+        """
+        Totals per endpoint and status code, with mean latencies.
+
+        :return: list of dicts, e.g. ``pandas.DataFrame(collector.summary())``
+        """
+        with self._lock:
+            rows = []
+            for (endpoint, status), totals in sorted(self._totals.items()):
+                count = totals['requests']
+                rows.append({
+                    'endpoint': endpoint,
+                    'status': status,
+                    'requests': int(count),
+                    'retries': int(totals['retries']),
+                    'mean_queue_wait': totals['queue_wait'] / count,
+                    'mean_ttfb': totals['ttfb'] / count,
+                    'mean_transfer_time': totals['transfer_time'] / count,
+                    'mean_decode_time': totals['decode_time'] / count,
+                    'wire_bytes': int(totals['wire_bytes']),
+                    'decoded_bytes': int(totals['decoded_bytes']),
+                    'rows': int(totals['rows']),
+                })
+            return rows
+
+    def to_prometheus(self, prefix='synmax') -> str:
+        """Counters in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{value_}"' for key, value_ in labels.items())
+                lines.append(f'{prefix}_{name}{{{label_text}}} {value}')
+
+        with self._lock:
+            totals = sorted(self._totals.items())
+            frames = sorted(self._frames.items())
+
+        metric('requests_total', 'counter', 'HTTP requests sent.',
+               [({'endpoint': e, 'status': s}, int(t['requests'])) for (e, s), t in totals])
+        metric('retries_total', 'counter', 'HTTP requests sent again after a failed attempt.',
+               [({'endpoint': e, 'status': s}, int(t['retries'])) for (e, s), t in totals])
+        for phase in ('queue_wait', 'ttfb', 'transfer_time', 'decode_time'):
+            metric(f'request_{phase}_seconds_total', 'counter', f'Time spent in {phase}.',
+                   [({'endpoint': e, 'status': s}, t[phase]) for (e, s), t in totals])
+        metric('received_bytes_total', 'counter', 'Bytes received, compressed on the wire and decompressed.',
+               [({'endpoint': e, 'status': s, 'encoding': kind}, int(t[f'{kind}_bytes']))
+                for (e, s), t in totals for kind in ('wire', 'decoded')])
+        metric('rows_total', 'counter', 'Rows received.',
+               [({'endpoint': e, 'status': s}, int(t['rows'])) for (e, s), t in totals])
+        metric('frame_build_seconds_total', 'counter', 'Time spent building result DataFrames.',
+               [({'endpoint': e}, t['build_time']) for e, t in frames])
+        return '\n'.join(lines) + '\n'
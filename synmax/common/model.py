@@ -1,7 +1,14 @@
-from pydantic import BaseModel
+import hashlib
+import json
+import logging
+
+from pydantic import BaseModel, PrivateAttr
 from typing import Optional, List, Union
 from datetime import date
 
+LOGGER = logging.getLogger(__name__)
+
+
 class PayloadModelBase(BaseModel):
     pagination_start: Optional[int] = 0
     start_date: Optional[date] = None
@@ -26,6 +33,42 @@ class PayloadModelBase(BaseModel):
 
     # nerc_id: Optional[Union[str, List[str]]] = None
 
+    # names passed to the constructor that are not filters, the api would ignore them
+    _unknown_fields: tuple = PrivateAttr(default=())
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        # pydantic < 2 has no model_fields
+        fields = getattr(type(self), 'model_fields', None) or type(self).__fields__
+        unknown = tuple(name for name in data if name not in fields)
+        if unknown:
+            LOGGER.warning('Ignoring unknown filters %s of %s', list(unknown), type(self).__name__)
+            self._unknown_fields = unknown
+
+    @property
+    def unknown_fields(self) -> tuple:
+        """Names passed to the constructor that are not filters, rejected when the query is validated."""
+        return self._unknown_fields
+
     def payload(self, pagination_start=None):
         # just intercept the payload calls so they aren't relayed to `object`
         pass
+
+    def canonical(self) -> str:
+        """Filters with sorted keys, pagination excluded: equal queries give equal strings."""
+        body = json.loads(self.payload())
+        body.pop('pagination', None)
+        return json.dumps(body, sort_keys=True, separators=(',', ':'))
+
+    def digest(self) -> str:
+        """Stable hash of :meth:`canonical`, e.g. to de-duplicate queries."""
+        return hashlib.sha256(self.canonical().encode('utf-8')).hexdigest()
+
+    def copy_with(self, **update):
+        """
+        Copy of the payload with some filters replaced, e.g. ``payload.copy_with(start_date='2023-01-01')``.
+        """
+        if hasattr(self, 'model_copy'):
+            return self.model_copy(update=update, deep=True)
+        # pydantic < 2
+        return self.copy(update=update, deep=True)
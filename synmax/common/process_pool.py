@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from synmax.common.frames import FrameBuilder, Schema, concat_frames, frame_from_records
+from synmax.common.lazy import LazyModule
+from synmax.common.metrics import ATTRS_KEY
+from synmax.common.model import PayloadModelBase
+
+pandas = LazyModule('pandas')
+
+LOGGER = logging.getLogger(__name__)
+
+# client of each worker process, created once by _init_worker
+_worker_client = None
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError as e:
+        raise ImportError('Fetching in processes requires pyarrow: '
+                          'pip install "synmax-api-python-client[parquet]"') from e
+    return pyarrow
+
+
+def _limiter_options(limiter, directory: str) -> Dict:
+    """
+    Settings of the :class:`SharedRateLimiter` of the workers: the SQLite file of ``limiter`` when it is shared
+    already, else a file of this query in ``directory`` starting from the limit learned by ``limiter``.
+    """
+    from synmax.common.shared_limiter import SharedRateLimiter
+
+    options = dict(initial_concurrency=limiter.limit, max_concurrency=limiter.max_concurrency,
+                   min_concurrency=limiter.min_concurrency, requests_per_second=limiter.requests_per_second,
+                   cooldown=limiter.cooldown)
+    if isinstance(limiter, SharedRateLimiter):
+        options.update(path=limiter.path, key=limiter.key, poll_interval=limiter.poll_interval,
+                       stale_after=limiter.stale_after, idle_reset=limiter.idle_reset)
+    else:
+        options['path'] = os.path.join(directory, 'rate_limits.sqlite3')
+    return options
+
+
+def _init_worker(client_options: Dict, limiter_options: Dict):
+    global _worker_client
+    from synmax.common.api_client import ApiClientAsync
+    from synmax.common.shared_limiter import SharedRateLimiter
+
+    os.environ.setdefault('TQDM_DISABLE', '1')
+    # the workers share one limiter, their requests together stay within the quota of the access key
+    limiter_options = dict(limiter_options)
+    key = limiter_options.pop('key', None)
+    rate_limiter = SharedRateLimiter(client_options['access_token'], **limiter_options)
+    if key is not None:
+        rate_limiter.key = key
+    _worker_client = ApiClientAsync(rate_limiter=rate_limiter, **client_options)
+
+
+async def _gather_pages(client, url, payload: PayloadModelBase, starts: List[int]) -> List[Optional[Dict]]:
+    return await asyncio.gather(*(client._spooled_page_async(url, payload, start) for start in starts))
+
+
+def _fetch_chunk(url, payload: PayloadModelBase, starts: List[int], schema: Schema, path: str) -> Tuple[int, int]:
+    """
+    Fetch the pages at ``starts`` in a worker, build them into one frame and write it to ``path`` in the Arrow
+    IPC format.
+
+    :return: rows and requests sent
+    """
+    pa = _import_pyarrow()
+    client = _worker_client
+    requests_before = sum(row['requests'] for row in client.metrics.summary())
+    pages = client._event_loop_thread().run(_gather_pages(client, url, payload, starts))
+
+    builder = FrameBuilder(schema)
+    for json_result in pages:
+        if json_result:
+            builder.add_records(json_result['data'])
+    df = builder.build()
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return len(df), sum(row['requests'] for row in client.metrics.summary()) - requests_before
+
+
+def _read_chunk(path: str) -> pandas.DataFrame:
+    pa = _import_pyarrow()
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def split_pages(total_pages: int, page_size: int, tasks: int) -> List[List[int]]:
+    """
+    Pagination starts of pages 1 to ``total_pages - 1``, in at most ``tasks`` contiguous ranges.
+    """
+    pages = list(range(1, total_pages))
+    if not pages:
+        return []
+    per_task = math.ceil(len(pages) / max(1, tasks))
+    return [[page * page_size for page in pages[index:index + per_task]] for index in range(0, len(pages), per_task)]
+
+
+def fetch_in_processes(client, url, payload: PayloadModelBase, client_options: Dict, processes: int = None,
+                       schema: Schema = None, tasks_per_process=2, start_method='spawn') -> pandas.DataFrame:
+    """
+    Fetch a paginated query with a pool of worker processes, so that decoding the json and building the frame
+    run on several cores.
+
+    The first page is fetched here to learn the number of pages, the other pages are split in contiguous ranges.
+    Each worker fetches its ranges concurrently, builds them into a frame and hands it back as an Arrow IPC file,
+    which is memory mapped here instead of pickled. The chunks are concatenated in page order.
+
+    The workers share a :class:`SharedRateLimiter`, the one of ``client`` when it is shared already, else one
+    starting from the limit learned by the limiter of ``client``: all their requests together stay within the quota.
+
+    :param client: client of this process, fetches the first page
+    :param url:
+    :param payload: query filters
+    :param client_options: keyword arguments of the :class:`ApiClientAsync` of each worker, e.g. ``access_token``
+    :param processes: (optional) worker processes, defaults to the number of cores
+    :param schema: (optional) column dtypes of the result
+    :param tasks_per_process: page ranges per worker, more ranges balance the load better
+    :param start_method: multiprocessing start method, 'spawn' is safe with the threads of the clients
+    :return: pandas.DataFrame
+    """
+    _import_pyarrow()
+    processes = processes or os.cpu_count() or 1
+    started = time.monotonic()
+
+    payload.pagination_start = 0
+    first_page = client._spooled_page(url, payload, 0, lambda: client._fetch_json_page(url, payload))
+    if first_page is None:
+        return pandas.DataFrame()
+    pagination = first_page['pagination']
+    total_pages = client._page_count(pagination)
+    ranges = split_pages(total_pages, pagination['page_size'], processes * tasks_per_process)
+    LOGGER.info('Total data size: %s, %s pages in %s ranges over %s processes', pagination['total_count'],
+                total_pages, len(ranges), processes)
+
+    frames = [frame_from_records(first_page['data'], schema)]
+    requests = 1
+    if ranges:
+        context = multiprocessing.get_context(start_method)
+        with tempfile.TemporaryDirectory(prefix='synmax-chunks-') as directory, \
+                ProcessPoolExecutor(max_workers=min(processes, len(ranges)), mp_context=context,
+                                    initializer=_init_worker,
+                                    initargs=(client_options, _limiter_options(client.rate_limiter, directory))) \
+                as executor:
+            paths = [os.path.join(directory, f'{index:06d}.arrow') for index in range(len(ranges))]
+            futures = [executor.submit(_fetch_chunk, url, payload, starts, schema, path)
+                       for starts, path in zip(ranges, paths)]
+            # in page order
+            for future, path in zip(futures, paths):
+                rows, chunk_requests = future.result()
+                requests += chunk_requests
+                frames.append(_read_chunk(path))
+
+    df = concat_frames(frames)
+    elapsed = time.monotonic() - started
+    LOGGER.info('Total response data: %s in %.1fs', len(df), elapsed)
+    df.attrs[ATTRS_KEY] = {
+        'url': url,
+        'cache_hit': False,
+        'elapsed': elapsed,
+        'requests': requests,
+        'rows': len(df),
+        'rows_per_second': len(df) / elapsed if elapsed else None,
+        'processes': processes,
+    }
+    client._finish_spool(url, payload, total_pages)
+    return df
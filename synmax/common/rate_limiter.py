@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+LOGGER = logging.getLogger(__name__)
+
+# how often async waiters re-check for a free slot
+_async_poll_interval = 0.02
+
+
+def _header_number(headers, name) -> Optional[float]:
+    if not headers:
+        return None
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Client side throttle shared by every request of an api client.
+
+    Concurrency is sized with AIMD (additive increase, multiplicative decrease): each window of successful
+    requests allows one more request in flight, while a HTTP 429 halves the allowance and pauses every caller
+    for ``cooldown`` seconds (or the server ``Retry-After``). The ``rate_limit_request_count`` header sent with a
+    429 is used as a ceiling for concurrency. An optional token bucket caps the number of requests per second.
+
+    The limiter is thread safe and can be used from sync code (:meth:`acquire`) and coroutines
+    (:meth:`acquire_async`) at the same time.
+    """
+
+    def __init__(self, initial_concurrency: int = 4, max_concurrency: int = 25, min_concurrency: int = 1,
+                 requests_per_second: float = None, cooldown: float = 1.0):
+        """
+
+        :param initial_concurrency: requests allowed in flight before any feedback from the server
+        :param max_concurrency: upper bound for requests in flight
+        :param min_concurrency: lower bound for requests in flight
+        :param requests_per_second: optional token bucket rate, None to disable
+        :param cooldown: seconds every caller waits after a 429 without ``Retry-After``
+        """
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.concurrency = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.requests_per_second = requests_per_second
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.throttled_count = 0
+        self._successes = 0
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._tokens = float(max(1.0, requests_per_second or 1.0))
+        self._tokens_updated = time.monotonic()
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return (f'AdaptiveRateLimiter(concurrency={int(self.concurrency)}, in_flight={self.in_flight}, '
+                f'max_concurrency={self.max_concurrency}, requests_per_second={self.requests_per_second})')
+
+    @property
+    def limit(self) -> int:
+        return int(self.concurrency)
+
+    def _try_acquire(self) -> float:
+        """
+        Take a slot if one is free, otherwise return the number of seconds to wait before trying again.
+        Must be called with the condition held.
+        """
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.in_flight >= self.limit:
+            return _async_poll_interval
+
+        if self.requests_per_second:
+            capacity = max(1.0, self.requests_per_second)
+            self._tokens = min(capacity, self._tokens + (now - self._tokens_updated) * self.requests_per_second)
+            self._tokens_updated = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.requests_per_second
+            self._tokens -= 1
+
+        self.in_flight += 1
+        return 0
+
+    def acquire(self):
+        """Block the calling thread until a request may be sent."""
+        with self._condition:
+            while True:
+                wait = self._try_acquire()
+                if not wait:
+                    return
+                self._condition.wait(wait)
+
+    async def acquire_async(self):
+        """Wait, without blocking the event loop, until a request may be sent."""
+        while True:
+            with self._condition:
+                wait = self._try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, status: int = None, headers=None):
+        """
+        Return a slot taken with :meth:`acquire` and feed the response back into the limiter.
+
+        :param status: HTTP status of the response, None when the request failed without a response
+        :param headers: response headers
+        """
+        with self._condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._on_response(status, headers)
+            self._condition.notify_all()
+
+    async def release_async(self, status: int = None, headers=None):
+        """:meth:`release` from the event loop."""
+        self.release(status, headers)
+
+    def _on_response(self, status, headers):
+        """AIMD update, must be called with the condition held."""
+        if status == 429:
+            self._on_throttled(headers)
+        elif status is not None and status < 400:
+            self._successes += 1
+            if self._successes >= self.limit and self.concurrency < self.max_concurrency:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self._successes = 0
+
+    def _on_throttled(self, headers):
+        now = time.monotonic()
+        self.throttled_count += 1
+        self._successes = 0
+
+        request_count = _header_number(headers, 'rate_limit_request_count')
+        if request_count and request_count >= 1:
+            self.max_concurrency = max(self.min_concurrency, min(self.max_concurrency, int(request_count)))
+
+        # requests already in flight when the first 429 arrived belong to the same burst, decrease only once
+        if now - self._last_decrease >= self.cooldown:
+            self.concurrency = max(self.min_concurrency, min(self.max_concurrency, self.concurrency / 2))
+            self._last_decrease = now
+
+        retry_after = _header_number(headers, 'Retry-After')
+        self._blocked_until = max(self._blocked_until, now + (retry_after if retry_after is not None else self.cooldown))
+        LOGGER.info('Throttled by server, concurrency reduced to %s', self.limit)
@@ -0,0 +1,311 @@
+import asyncio
+import contextvars
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Iterable, Optional, Tuple, Type
+
+LOGGER = logging.getLogger(__name__)
+
+# statuses worth sending again: timeouts, throttling and server side errors
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+# how often requests waiting for a half open circuit check whether the trial request completed
+_trial_poll_interval = 0.1
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request when the circuit breaker stays open past the query deadline."""
+
+
+def retry_after(headers) -> Optional[float]:
+    """
+    Seconds to wait according to the ``Retry-After`` header, given in seconds or as a HTTP date.
+
+    :return: seconds, None when the header is missing or invalid
+    """
+    value = headers.get('Retry-After') if headers else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _status_of(response) -> Optional[int]:
+    # requests.Response or TransportResponse
+    status = getattr(response, 'status_code', None)
+    return status if status is not None else getattr(response, 'status', None)
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an api that keeps failing.
+
+    After ``failure_threshold`` consecutive failures (errors without a response or 5xx statuses) the circuit opens
+    and requests wait instead of being sent. After ``reset_timeout`` seconds it is half open: one trial request is
+    let through, its success closes the circuit, its failure opens it again. Throttling (429) is not a failure.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+
+        :param failure_threshold: consecutive failures opening the circuit
+        :param reset_timeout: seconds the circuit stays open before a trial request
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'CircuitBreaker(state={self.state}, failures={self.failures})'
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def wait_time(self) -> float:
+        """Seconds to wait before a request may be sent, 0 when it may be sent now."""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return 0
+            if state == self.OPEN:
+                return self.reset_timeout - (time.monotonic() - self._opened_at)
+            if self._trial_running:
+                return _trial_poll_interval
+            self._trial_running = True
+            return 0
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def abandon_trial(self):
+        """The request let through was not sent or its outcome is unknown, e.g. it was cancelled."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_running:
+                    LOGGER.warning('Circuit opened after %s consecutive failures, pausing requests for %ss',
+                                   self.failures, self.reset_timeout)
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+
+class RetryBudget:
+    """
+    Retries allowed to one query, shared by all its requests: ``min_retries`` plus ``ratio`` retries per request
+    sent, and no retry past the ``deadline``. A query against a failing api stops quickly instead of retrying each
+    of its pages on its own.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 20, deadline: float = None):
+        """
+
+        :param ratio: retries allowed per request sent
+        :param min_retries: retries allowed regardless of the number of requests
+        :param deadline: (optional) seconds from now after which requests are not retried
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.deadline = time.monotonic() + deadline if deadline is not None else None
+        self.requests = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'RetryBudget(requests={self.requests}, retries={self.retries})'
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def remaining_time(self) -> Optional[float]:
+        return self.deadline - time.monotonic() if self.deadline is not None else None
+
+    def spend(self, delay: float) -> bool:
+        """Take one retry sent after ``delay`` seconds, False when the budget or the deadline does not allow it."""
+        with self._lock:
+            remaining = self.remaining_time()
+            if remaining is not None and remaining <= delay:
+                return False
+            if self.retries >= self.min_retries + self.ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
+
+
+# budget of the running query, requests of concurrent pages spend it together
+current_budget: contextvars.ContextVar = contextvars.ContextVar('synmax_retry_budget', default=None)
+
+
+class RetryPolicy:
+    """
+    Retries of the sync and async clients.
+
+    A request is sent again after an error without response or a status of :data:`RETRY_STATUSES`, up to
+    ``max_attempts`` times. Waits grow exponentially with full jitter, or follow the ``Retry-After`` header. The
+    retries of a query come out of its :class:`RetryBudget`, and a :class:`CircuitBreaker` shared by the clients
+    of the policy holds back every request to a failing api.
+
+    Throttling is coordinated by the :class:`AdaptiveRateLimiter` of the client: a 429 pauses every request in
+    flight, the retries then wait for the limiter like any other request.
+    """
+
+    def __init__(self, max_attempts: int = 6, backoff: float = 0.5, max_backoff: float = 30.0,
+                 retry_statuses: Iterable[int] = RETRY_STATUSES, budget_ratio: float = 0.2,
+                 budget_min_retries: int = 20, deadline: float = None, circuit_breaker: CircuitBreaker = None):
+        """
+
+        :param max_attempts: attempts of one request, first one included
+        :param backoff: seconds before the first retry, doubled at each attempt
+        :param max_backoff: upper bound of the wait between two attempts
+        :param retry_statuses: HTTP statuses retried
+        :param budget_ratio: retries allowed per request of a query, see :class:`RetryBudget`
+        :param budget_min_retries: retries allowed to a query regardless of its number of requests
+        :param deadline: (optional) seconds after which the requests of a query are not retried anymore
+        :param circuit_breaker: (optional) breaker, shared with other policies hitting the same api
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.budget_ratio = budget_ratio
+        self.budget_min_retries = budget_min_retries
+        self.deadline = deadline
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+    def __repr__(self):
+        return (f'RetryPolicy(max_attempts={self.max_attempts}, backoff={self.backoff}, '
+                f'max_backoff={self.max_backoff}, circuit_breaker={self.circuit_breaker})')
+
+    def new_budget(self) -> RetryBudget:
+        """Budget of a new query."""
+        return RetryBudget(self.budget_ratio, self.budget_min_retries, self.deadline)
+
+    def delay(self, attempt: int, headers=None) -> float:
+        """Seconds to wait before sending attempt ``attempt + 1``."""
+        wait = retry_after(headers)
+        if wait is not None:
+            # a little jitter so that the requests told to wait do not come back all at once
+            return min(wait, self.max_backoff) + random.uniform(0, self.backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def _circuit_wait(self, url, budget: RetryBudget) -> float:
+        """Seconds to wait for the circuit breaker before sending, raises past the deadline of the query."""
+        wait = self.circuit_breaker.wait_time()
+        remaining = budget.remaining_time()
+        if wait and remaining is not None and remaining <= wait:
+            raise CircuitOpenError(f'Circuit breaker open past the deadline of the query, not sending {url}')
+        return wait
+
+    def _retry_delay(self, url, attempt: int, budget: RetryBudget, response=None,
+                     error: Exception = None) -> Optional[float]:
+        """
+        Feed the outcome of an attempt to the circuit breaker and decide on a retry.
+
+        :return: seconds to wait before the next attempt, None to give up
+        """
+        status = _status_of(response) if error is None else None
+        if error is not None or status >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+        if error is None and status not in self.retry_statuses:
+            return None
+        if attempt >= self.max_attempts:
+            LOGGER.warning('Giving up %s after %s attempts: %s', url, attempt, error or f'HTTP {status}')
+            return None
+        delay = self.delay(attempt, getattr(response, 'headers', None))
+        if not budget.spend(delay):
+            LOGGER.warning('Retry budget of the query exhausted, giving up %s: %s', url, error or f'HTTP {status}')
+            return None
+        LOGGER.info('Retrying %s in %.1fs (attempt %s of %s): %s', url, delay, attempt + 1, self.max_attempts,
+                    error or f'HTTP {status}')
+        return delay
+
+    def call(self, send: Callable[[int], object], url: str = None,
+             retry_on: Tuple[Type[BaseException], ...] = ()):
+        """
+        Send a request with retries.
+
+        :param send: called with the attempt number, from 1, returns the response
+        :param url: for the logs
+        :param retry_on: exceptions retried, others are raised immediately
+        :return: response of the last attempt, which may be an error when no retry was left
+        """
+        budget = current_budget.get() or self.new_budget()
+        attempt = 0
+        while True:
+            wait = self._circuit_wait(url, budget)
+            if wait:
+                time.sleep(wait)
+                continue
+            attempt += 1
+            budget.record_request()
+            try:
+                response = send(attempt)
+            except retry_on as e:
+                delay = self._retry_delay(url, attempt, budget, error=e)
+                if delay is None:
+                    raise
+            except BaseException:
+                self.circuit_breaker.abandon_trial()
+                raise
+            else:
+                delay = self._retry_delay(url, attempt, budget, response=response)
+                if delay is None:
+                    return response
+            time.sleep(delay)
+
+    async def call_async(self, send: Callable[[int], Awaitable], url: str = None,
+                         retry_on: Tuple[Type[BaseException], ...] = ()):
+        """:meth:`call` for coroutines, ``send`` returns an awaitable."""
+        budget = current_budget.get() or self.new_budget()
+        attempt = 0
+        while True:
+            wait = self._circuit_wait(url, budget)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            attempt += 1
+            budget.record_request()
+            try:
+                response = await send(attempt)
+            except retry_on as e:
+                delay = self._retry_delay(url, attempt, budget, error=e)
+                if delay is None:
+                    raise
+            except BaseException:
+                self.circuit_breaker.abandon_trial()
+                raise
+            else:
+                delay = self._retry_delay(url, attempt, budget, response=response)
+                if delay is None:
+                    return response
+            await asyncio.sleep(delay)
@@ -0,0 +1,206 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from synmax.common.rate_limiter import AdaptiveRateLimiter
+
+LOGGER = logging.getLogger(__name__)
+
+_default_path = os.path.join(Path.home(), '.cache', 'synmax', 'rate_limits.sqlite3')
+
+_schema = (
+    'CREATE TABLE IF NOT EXISTS limits (key TEXT PRIMARY KEY, concurrency REAL, max_concurrency INTEGER, '
+    'successes INTEGER, tokens REAL, tokens_updated REAL, blocked_until REAL, last_decrease REAL, '
+    'throttled INTEGER, updated REAL)',
+    # requests in flight per process, rows of processes that died are dropped
+    'CREATE TABLE IF NOT EXISTS holders (key TEXT, pid INTEGER, in_flight INTEGER, updated REAL, '
+    'PRIMARY KEY (key, pid))',
+)
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == 'nt':
+        # os.kill would terminate the process, stale holders expire with stale_after instead
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedRateLimiter(AdaptiveRateLimiter):
+    """
+    :class:`AdaptiveRateLimiter` shared by every process of the host using the same access key.
+
+    The limiter state (concurrency allowed, requests in flight, token bucket and the pause after a 429) is kept in
+    a SQLite file, updated in a transaction at each acquire and release. A 429 received by one process pauses and
+    slows down all of them, and the requests in flight of all processes together stay within the concurrency
+    learned from the server, so their aggregate throughput stays under the quota of the key.
+
+    The first process creating the state sets its ``initial_concurrency`` and ``max_concurrency``. The state is
+    reset to the settings of the next process once it was left idle for ``idle_reset`` seconds.
+
+    >>> limiter = SharedRateLimiter(access_token, requests_per_second=20)
+    >>> client = HyperionApiClient(access_token, rate_limiter=limiter)
+    """
+
+    def __init__(self, access_key: str, path: str = None, initial_concurrency: int = 4, max_concurrency: int = 25,
+                 min_concurrency: int = 1, requests_per_second: float = None, cooldown: float = 1.0,
+                 poll_interval: float = 0.05, stale_after: float = 900, idle_reset: float = 600):
+        """
+
+        :param access_key: processes using the same access key share a limiter, the key itself is not stored
+        :param path: (optional) SQLite file of the state, defaults to ~/.cache/synmax/rate_limits.sqlite3
+        :param initial_concurrency: requests allowed in flight, across processes, before any feedback from the server
+        :param max_concurrency: upper bound for requests in flight across processes
+        :param min_concurrency: lower bound for requests in flight across processes
+        :param requests_per_second: optional token bucket rate shared by the processes, None to disable
+        :param cooldown: seconds every caller waits after a 429 without ``Retry-After``
+        :param poll_interval: seconds between two attempts to take a slot, other processes cannot notify waiters
+        :param stale_after: seconds after which the requests in flight of a process that did not update the state
+            are considered lost, e.g. the process was killed
+        :param idle_reset: seconds without requests after which the state is reset
+        """
+        super().__init__(initial_concurrency=initial_concurrency, max_concurrency=max_concurrency,
+                         min_concurrency=min_concurrency, requests_per_second=requests_per_second, cooldown=cooldown)
+        self.key = hashlib.sha256(access_key.encode('utf-8')).hexdigest()[:32]
+        self.path = os.path.expanduser(path or _default_path)
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.idle_reset = idle_reset
+        self._initial = (self.concurrency, self.max_concurrency)
+        self._local = threading.local()
+        # transactions of the async callers, one thread: they are serialized by the database anyway
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='synmax-limiter')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._transaction() as conn:
+            for statement in _schema:
+                conn.execute(statement)
+
+    def __repr__(self):
+        return (f'SharedRateLimiter(path={self.path!r}, concurrency={self.limit}, in_flight={self.in_flight}, '
+                f'max_concurrency={self.max_concurrency}, requests_per_second={self.requests_per_second})')
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, opened again in forked processes
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.pid = os.getpid()
+        return local.connection
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _load(self, conn: sqlite3.Connection):
+        """Read the shared state into the attributes used by :class:`AdaptiveRateLimiter`."""
+        now = time.time()
+        # times are stored as wall clock, the base class works with the monotonic clock
+        offset = time.monotonic() - now
+        pid = os.getpid()
+
+        self.in_flight = 0
+        for holder_pid, in_flight, updated in conn.execute(
+                'SELECT pid, in_flight, updated FROM holders WHERE key = ?', (self.key,)).fetchall():
+            if holder_pid != pid and (now - updated > self.stale_after or not _pid_alive(holder_pid)):
+                LOGGER.debug('Dropping %s requests in flight of process %s', in_flight, holder_pid)
+                conn.execute('DELETE FROM holders WHERE key = ? AND pid = ?', (self.key, holder_pid))
+                continue
+            self.in_flight += in_flight
+
+        row = conn.execute('SELECT concurrency, max_concurrency, successes, tokens, tokens_updated, blocked_until, '
+                           'last_decrease, throttled, updated FROM limits WHERE key = ?', (self.key,)).fetchone()
+        if row is None or (not self.in_flight and now - row[-1] > self.idle_reset):
+            self.concurrency, self.max_concurrency = self._initial
+            self._successes, self._last_decrease, self._blocked_until = 0, 0.0, 0.0
+            self._tokens, self._tokens_updated = float(max(1.0, self.requests_per_second or 1.0)), now + offset
+            self.throttled_count = 0 if row is None else row[7]
+            return
+        (self.concurrency, self.max_concurrency, self._successes, self._tokens, tokens_updated, blocked_until,
+         last_decrease, self.throttled_count, _) = row
+        self._tokens_updated = tokens_updated + offset
+        self._blocked_until = blocked_until + offset
+        self._last_decrease = last_decrease + offset
+
+    def _store(self, conn: sqlite3.Connection, in_flight_change: int):
+        """Write the attributes back and count the requests taken or returned by this process."""
+        now = time.time()
+        offset = now - time.monotonic()
+        conn.execute('INSERT OR REPLACE INTO limits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (self.key, self.concurrency, self.max_concurrency, self._successes, self._tokens,
+                      self._tokens_updated + offset, self._blocked_until + offset, self._last_decrease + offset,
+                      self.throttled_count, now))
+        if in_flight_change:
+            conn.execute('INSERT INTO holders VALUES (?, ?, ?, ?) ON CONFLICT (key, pid) DO UPDATE SET '
+                         'in_flight = in_flight + excluded.in_flight, updated = excluded.updated',
+                         (self.key, os.getpid(), in_flight_change, now))
+            conn.execute('DELETE FROM holders WHERE key = ? AND pid = ? AND in_flight <= 0', (self.key, os.getpid()))
+
+    def _try_acquire(self) -> float:
+        with self._transaction() as conn:
+            self._load(conn)
+            wait = super()._try_acquire()
+            self._store(conn, 0 if wait else 1)
+        return max(wait, self.poll_interval) if wait else 0
+
+    def _acquire_once(self) -> float:
+        with self._condition:
+            return self._try_acquire()
+
+    async def _run_async(self, function, *args):
+        """
+        Run the transaction of ``function`` in the thread of the limiter: while other processes hold the database,
+        the loop keeps serving the other requests instead of blocking for up to the busy timeout.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, function, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if function == self._acquire_once:
+                # the transaction can not be interrupted, give back the slot it may take
+                future.add_done_callback(functools.partial(self._release_unused, loop))
+            raise
+
+    def _release_unused(self, loop: asyncio.AbstractEventLoop, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None and not future.result():
+            loop.run_in_executor(self._executor, self.release)
+
+    async def acquire_async(self):
+        """Wait until a request may be sent, without blocking the loop while other processes hold the database."""
+        while True:
+            wait = await self._run_async(self._acquire_once)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def release_async(self, status: int = None, headers=None):
+        await self._run_async(self.release, status, headers)
+
+    def release(self, status: int = None, headers=None):
+        with self._condition:
+            with self._transaction() as conn:
+                self._load(conn)
+                self._on_response(status, headers)
+                self._store(conn, -1)
+            self._condition.notify_all()
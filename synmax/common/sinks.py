@@ -0,0 +1,142 @@
+import itertools
+import logging
+import os
+import uuid
+from typing import List, Dict, Union
+
+from synmax.common.frames import Schema
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('Writing to parquet requires pyarrow: pip install "synmax-api-python-client[parquet]"') from e
+    return pyarrow
+
+
+class ParquetSink:
+    """
+    Appends pages of rows to a parquet file, or to a hive partitioned parquet dataset when ``partition_by``
+    is set, converting each page straight from the json records to an arrow table.
+
+    The columns are fixed by the first page. Columns listed in ``column_types`` get the arrow type of their dtype
+    (dates as timestamps, categoricals as strings), other integer columns are stored as float64 and other columns
+    empty in the first page as strings. Later pages are converted to this schema, a page with a column missing from
+    it raises a ValueError. Pass ``schema`` to control the columns and their types.
+    """
+
+    def __init__(self, path: str, partition_by: Union[str, List[str]] = None, schema=None, compression='snappy',
+                 column_types: Schema = None):
+        """
+
+        :param path: parquet file, or root directory of the dataset when partitioned
+        :param partition_by: (optional) column name(s) used to partition the dataset, e.g. 'date' or 'state_code'
+        :param schema: (optional) pyarrow.Schema of the rows
+        :param compression: parquet compression codec
+        :param column_types: (optional) pandas dtypes of known columns, e.g. an endpoint schema
+        """
+        self._pa = _import_pyarrow()
+        self.path = str(path)
+        self.partition_by = [partition_by] if isinstance(partition_by, str) else partition_by
+        self.schema = schema
+        self.compression = compression
+        self.column_types = column_types or {}
+        self.rows_written = 0
+
+        self._writer = None
+        self._part = 0
+        # unique per sink, appending to an existing dataset never overwrites earlier files
+        self._basename = uuid.uuid4().hex
+
+    def __repr__(self):
+        return f'ParquetSink(path={self.path!r}, partition_by={self.partition_by}, rows_written={self.rows_written})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _to_table(self, records: List[Dict]):
+        pa = self._pa
+        # rows may leave out columns, every column of the page is kept
+        names = list(dict.fromkeys(itertools.chain.from_iterable(records)))
+        table = pa.Table.from_pydict({name: [record.get(name) for record in records] for name in names})
+        if self.schema is None:
+            self.schema = pa.schema([self._storage_field(field) for field in table.schema])
+        unknown = [name for name in names if self.schema.get_field_index(name) < 0]
+        if unknown:
+            raise ValueError(f'Columns {unknown} are not in the schema of {self.path}, which was fixed by the first '
+                             f'page. Pass a schema listing them to ParquetSink')
+
+        # cast column by column, safe casts refuse to truncate a value that does not fit the schema
+        columns = []
+        for field in self.schema:
+            if field.name in table.column_names:
+                columns.append(table.column(field.name).cast(field.type))
+            else:
+                columns.append(pa.nulls(table.num_rows, field.type))
+        return pa.Table.from_arrays(columns, schema=self.schema)
+
+    def _storage_field(self, field):
+        pa = self._pa
+        dtype = self.column_types.get(field.name)
+        arrow_type = self._arrow_type(dtype) if dtype else None
+        if arrow_type is not None:
+            return field.with_type(arrow_type)
+        if pa.types.is_null(field.type):
+            return field.with_type(pa.string())
+        if pa.types.is_integer(field.type):
+            # a later page may carry fractional values in the same column
+            return field.with_type(pa.float64())
+        return field
+
+    def _arrow_type(self, dtype: str):
+        """Arrow type of a pandas dtype of ``column_types``, None for dtypes without one."""
+        pa = self._pa
+        dtype = dtype.lower()
+        if dtype.startswith('datetime64'):
+            # 'datetime64[ns]'
+            return pa.timestamp(dtype[len('datetime64['):-1] or 'ns')
+        if dtype in ('category', 'string', 'str', 'object'):
+            return pa.string()
+        try:
+            # 'Int64', 'int32', 'float64'...
+            return pa.from_numpy_dtype(dtype)
+        except (TypeError, ValueError, pa.ArrowNotImplementedError):
+            return None
+
+    def write_records(self, records: List[Dict]):
+        """
+        Append rows to the sink.
+
+        :param records: rows as returned in the ``data`` of a page
+        """
+        if not records:
+            return
+        table = self._to_table(records)
+
+        if self.partition_by:
+            self._pa.parquet.write_to_dataset(
+                table, self.path, partition_cols=self.partition_by, compression=self.compression,
+                basename_template=f'part-{self._basename}-{self._part}-{{i}}.parquet'
+            )
+        else:
+            if self._writer is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._writer = self._pa.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+            self._writer.write_table(table)
+
+        self._part += 1
+        self.rows_written += table.num_rows
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
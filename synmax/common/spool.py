@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from synmax.common.cache import canonical_payload, query_key
+from synmax.common.decoder import JsonDecoder, get_decoder
+from synmax.common.model import PayloadModelBase
+
+LOGGER = logging.getLogger(__name__)
+
+_default_spool_dir = os.path.join(Path.home(), '.cache', 'synmax', 'spool')
+_manifest = 'manifest.json'
+
+
+def _dumps(value) -> bytes:
+    try:
+        import orjson
+    except ImportError:
+        return json.dumps(value).encode('utf-8')
+    return orjson.dumps(value)
+
+
+def _write_atomic(path: str, body: bytes):
+    tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class PageSpool:
+    """
+    Checkpoints of paginated queries on disk, so that an interrupted download resumes where it stopped.
+
+    Every page is written to its own file as soon as it arrives, in one directory per query keyed on the url, the
+    query filters and the access key. When the same query runs again, pages found in the spool are read from disk
+    and only the missing ones are requested. The directory of a query is removed once all its pages were read,
+    unless ``keep`` is set.
+
+    The manifest of a query records its ``total_count`` and ``page_size``. The first page is always requested again
+    and the spooled pages are discarded when either changed, so a resumed query never mixes two versions of the
+    result. Queries spooled more than ``max_age`` seconds ago are discarded too.
+    """
+
+    def __init__(self, directory: str = None, keep=False, json_decoder: Union[str, JsonDecoder] = None,
+                 max_age: Optional[float] = 7 * 24 * 3600):
+        """
+
+        :param directory: spool folder, defaults to ~/.cache/synmax/spool
+        :param keep: keep the pages of completed queries
+        :param json_decoder: (optional) 'orjson', 'msgspec' or 'json' to read the pages back
+        :param max_age: seconds after which the pages of a query are stale and removed, None to keep them
+        """
+        self.directory = os.path.expanduser(directory or _default_spool_dir)
+        self.keep = keep
+        self.json_decoder = get_decoder(json_decoder)
+        self.max_age = max_age
+        os.makedirs(self.directory, exist_ok=True)
+        self.expire()
+
+    def __repr__(self):
+        return f'PageSpool(directory={self.directory!r}, keep={self.keep}, max_age={self.max_age})'
+
+    @staticmethod
+    def key(url: str, payload: PayloadModelBase = None, scope: str = None) -> str:
+        """
+        Spool key of a paginated query, pagination is ignored.
+
+        :param url:
+        :param payload: (optional) POST filters
+        :param scope: (optional) e.g. the access key
+        :return: hex digest
+        """
+        return query_key(url, payload, scope=scope)
+
+    def _query_dir(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _page_path(self, key: str, start: int) -> str:
+        return os.path.join(self._query_dir(key), f'page-{start:012d}.json')
+
+    def pages(self, key: str) -> List[int]:
+        """Pagination start of every page spooled for ``key``, sorted."""
+        directory = self._query_dir(key)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(entry.name[5:-5]) for entry in os.scandir(directory)
+                      if entry.name.startswith('page-') and entry.name.endswith('.json'))
+
+    def read_page(self, key: str, start: int) -> Optional[Dict]:
+        """
+        Json body of the page starting at ``start``, None when it was not spooled yet or cannot be read.
+        """
+        path = self._page_path(key, start)
+        try:
+            with open(path, 'rb') as f:
+                return self.json_decoder.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            LOGGER.warning('Ignoring unreadable spooled page %s: %s', path, e)
+            return None
+
+    def write_page(self, key: str, start: int, json_result: Dict, url: str = None,
+                   payload: PayloadModelBase = None):
+        """
+        Spool the json body of the page starting at ``start``. The first page of a query also writes a manifest
+        describing it.
+        """
+        directory = self._query_dir(key)
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(os.path.join(directory, _manifest)):
+            pagination = json_result.get('pagination') or {}
+            _write_atomic(os.path.join(directory, _manifest), _dumps({
+                'url': url,
+                'payload': canonical_payload(payload),
+                'pagination': pagination,
+                'total_count': pagination.get('total_count'),
+                'page_size': pagination.get('page_size'),
+                'created': time.time(),
+            }))
+        _write_atomic(self._page_path(key, start), _dumps(json_result))
+
+    def manifest(self, key: str) -> Optional[Dict]:
+        """Url, filters and pagination of a spooled query, None when nothing was spooled for ``key``."""
+        try:
+            with open(os.path.join(self._query_dir(key), _manifest), 'rb') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def check(self, key: str, pagination: Dict):
+        """
+        Discard the pages spooled for ``key`` when they do not belong to the result described by ``pagination``,
+        the pagination of a first page just fetched: the total count or the page size changed, the pages are
+        older than ``max_age``, or they have no manifest.
+        """
+        if not os.path.isdir(self._query_dir(key)):
+            return
+        manifest = self.manifest(key)
+        if manifest is None:
+            reason = 'no manifest'
+        elif (manifest.get('total_count'), manifest.get('page_size')) != (pagination.get('total_count'),
+                                                                          pagination.get('page_size')):
+            reason = (f"total_count {manifest.get('total_count')} and page_size {manifest.get('page_size')} "
+                      f"are now {pagination.get('total_count')} and {pagination.get('page_size')}")
+        elif self._is_expired(key):
+            reason = 'expired'
+        else:
+            return
+        LOGGER.warning('Discarding the spooled pages of %s: %s', manifest and manifest.get('url') or key, reason)
+        self.discard(key)
+
+    def _is_expired(self, key: str) -> bool:
+        if self.max_age is None:
+            return False
+        manifest = self.manifest(key)
+        created = manifest.get('created') if manifest else None
+        if created is None:
+            try:
+                created = os.stat(self._query_dir(key)).st_mtime
+            except OSError:
+                return False
+        return time.time() - created > self.max_age
+
+    def expire(self):
+        """Remove the queries spooled more than ``max_age`` seconds ago."""
+        if self.max_age is None:
+            return
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and self._is_expired(entry.name):
+                LOGGER.info('Removing expired spool %s', entry.path)
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def is_complete(self, key: str, total_pages: int) -> bool:
+        return len(self.pages(key)) >= total_pages
+
+    def finish(self, key: str, total_pages: int):
+        """Called once every page of a query was read, removes its pages when they are all spooled."""
+        if self.keep or not self.is_complete(key, total_pages):
+            return
+        self.discard(key)
+
+    def discard(self, key: str):
+        """Remove the pages spooled for ``key``."""
+        shutil.rmtree(self._query_dir(key), ignore_errors=True)
+
+    def clear(self):
+        """Remove every spooled query."""
+        for entry in os.scandir(self.directory):
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
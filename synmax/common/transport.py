@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import time
+from typing import Mapping, NamedTuple, Optional, Union
+
+from synmax.common.compression import StreamDecoder
+
+LOGGER = logging.getLogger(__name__)
+
+_chunk_size = 64 * 1024
+
+TRANSPORTS = ('aiohttp', 'httpx')
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f'HTTP {status} for {url}')
+        self.status = status
+        self.url = url
+
+
+class TransportResponse(NamedTuple):
+    status: int
+    headers: Mapping[str, str]
+    # decompressed body
+    content: bytes
+    url: str
+    # size of the body as received, compressed
+    wire_bytes: int = 0
+    # seconds until the headers arrived, and reading the body
+    ttfb: float = 0.0
+    transfer_time: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPStatusError(self.status, self.url)
+
+
+class Transport:
+    """
+    Connection pool of the async client. The pool is opened in the event loop of the first request and kept
+    for the lifetime of the transport, so connections are reused across queries. Used from another loop, e.g.
+    after ``asyncio.run`` returned, the pool is opened again and the previous one closed.
+
+    Compressed bodies are decompressed here, chunk by chunk as they arrive.
+    """
+
+    name = None
+
+    def __init__(self, pool_size: int = 25, keepalive_timeout: float = 60, verify_ssl=False):
+        """
+
+        :param pool_size: maximum number of open connections
+        :param keepalive_timeout: seconds an idle connection is kept open
+        :param verify_ssl: verify the server certificate
+        """
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.verify_ssl = verify_ssl
+        self._client = None
+        self._loop = None
+
+    def __repr__(self):
+        return f'{type(self).__name__}(pool_size={self.pool_size}, keepalive_timeout={self.keepalive_timeout})'
+
+    @property
+    def is_open(self) -> bool:
+        return self._client is not None
+
+    @property
+    def retryable_errors(self) -> tuple:
+        """Exceptions of a request that failed without a response, e.g. connection reset or timeout."""
+        return OSError, asyncio.TimeoutError
+
+    def _open(self):
+        raise NotImplementedError
+
+    async def _close(self, client):
+        raise NotImplementedError
+
+    async def _send(self, client, method: str, url: str, headers=None, data=None, params=None,
+                    timeout: float = None) -> TransportResponse:
+        raise NotImplementedError
+
+    async def _client_of_running_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            if self._client is not None:
+                LOGGER.debug('Opening a new connection pool, the previous one belongs to another event loop')
+                await self._discard(self._client, self._loop)
+            self._client = self._open()
+            self._loop = loop
+        return self._client
+
+    async def _discard(self, client, loop):
+        """Close ``client``, opened in the event loop ``loop``, from another loop."""
+        if not loop.is_closed():
+            # the loop runs in another thread, or will run again
+            asyncio.run_coroutine_threadsafe(self._close(client), loop)
+            return
+        # the connections went away with their loop, release what the client still holds
+        try:
+            await self._close(client)
+        except RuntimeError as e:
+            LOGGER.debug('Connection pool of a closed event loop not closed cleanly: %s', e)
+
+    async def request(self, method: str, url: str, headers=None, data=None, params=None,
+                      timeout: float = None) -> TransportResponse:
+        """
+        Send a request and read the whole body.
+
+        :return: TransportResponse
+        """
+        return await self._send(await self._client_of_running_loop(), method, url, headers=headers, data=data,
+                                params=params, timeout=timeout)
+
+    async def close(self):
+        """Close the pooled connections, on the loop they were opened in."""
+        client, loop, self._client, self._loop = self._client, self._loop, None, None
+        if client is None:
+            return
+        if loop is asyncio.get_running_loop():
+            await self._close(client)
+        else:
+            await self._discard(client, loop)
+
+
+class AiohttpTransport(Transport):
+    """aiohttp connection pool with DNS caching and keep-alive."""
+
+    name = 'aiohttp'
+
+    def __init__(self, pool_size: int = 25, keepalive_timeout: float = 60, verify_ssl=False,
+                 dns_cache_ttl: Optional[int] = 300):
+        """
+
+        :param pool_size: maximum number of open connections
+        :param keepalive_timeout: seconds an idle connection is kept open
+        :param verify_ssl: verify the server certificate
+        :param dns_cache_ttl: seconds a resolved host name is cached, None to cache forever
+        """
+        super().__init__(pool_size=pool_size, keepalive_timeout=keepalive_timeout, verify_ssl=verify_ssl)
+        self.dns_cache_ttl = dns_cache_ttl
+
+    def _open(self):
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size,
+                                         keepalive_timeout=self.keepalive_timeout, use_dns_cache=True,
+                                         ttl_dns_cache=self.dns_cache_ttl, ssl=None if self.verify_ssl else False)
+        # bodies are decompressed by StreamDecoder, which also counts the compressed bytes
+        return aiohttp.ClientSession(connector=connector, auto_decompress=False)
+
+    @property
+    def retryable_errors(self) -> tuple:
+        import aiohttp
+        return aiohttp.ClientError, asyncio.TimeoutError
+
+    async def _close(self, client):
+        await client.close()
+
+    async def _send(self, client, method: str, url: str, headers=None, data=None, params=None,
+                    timeout: float = None) -> TransportResponse:
+        import aiohttp
+        started = time.monotonic()
+        async with client.request(method, url, headers=headers, data=data, params=params,
+                                  timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            ttfb = time.monotonic() - started
+            decoder = StreamDecoder(response.headers.get('Content-Encoding'))
+            async for chunk in response.content.iter_chunked(_chunk_size):
+                decoder.write(chunk)
+            return TransportResponse(response.status, response.headers, decoder.finish(), str(response.url),
+                                     decoder.wire_bytes, ttfb, time.monotonic() - started - ttfb)
+
+
+class HttpxTransport(Transport):
+    """httpx connection pool, with HTTP/2 when the h2 package is installed."""
+
+    name = 'httpx'
+
+    def __init__(self, pool_size: int = 25, keepalive_timeout: float = 60, verify_ssl=False, http2=True):
+        """
+
+        :param pool_size: maximum number of open connections
+        :param keepalive_timeout: seconds an idle connection is kept open
+        :param verify_ssl: verify the server certificate
+        :param http2: negotiate HTTP/2, requests are then multiplexed over few connections
+        """
+        super().__init__(pool_size=pool_size, keepalive_timeout=keepalive_timeout, verify_ssl=verify_ssl)
+        _import_httpx()
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                LOGGER.warning('HTTP/2 needs the h2 package: pip install "httpx[http2]", using HTTP/1.1')
+                http2 = False
+        self.http2 = http2
+
+    def _open(self):
+        httpx = _import_httpx()
+        limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size,
+                              keepalive_expiry=self.keepalive_timeout)
+        return httpx.AsyncClient(http2=self.http2, limits=limits, verify=self.verify_ssl)
+
+    @property
+    def retryable_errors(self) -> tuple:
+        return _import_httpx().TransportError, asyncio.TimeoutError
+
+    async def _close(self, client):
+        await client.aclose()
+
+    async def _send(self, client, method: str, url: str, headers=None, data=None, params=None,
+                    timeout: float = None) -> TransportResponse:
+        started = time.monotonic()
+        async with client.stream(method, url, headers=headers, content=data, params=params,
+                                 timeout=timeout) as response:
+            ttfb = time.monotonic() - started
+            decoder = StreamDecoder(response.headers.get('Content-Encoding'))
+            async for chunk in response.aiter_raw(_chunk_size):
+                decoder.write(chunk)
+            return TransportResponse(response.status_code, response.headers, decoder.finish(), str(response.url),
+                                     decoder.wire_bytes, ttfb, time.monotonic() - started - ttfb)
+
+
+def _import_httpx():
+    try:
+        import httpx
+    except ImportError as e:
+        raise ImportError('HttpxTransport needs httpx: pip install "synmax-api-python-client[http2]"') from e
+    return httpx
+
+
+def get_transport(transport: Union[str, Transport] = None, **options) -> Transport:
+    """
+    :param transport: (optional) transport or one of :data:`TRANSPORTS`, defaults to aiohttp
+    :param options: passed to the transport class
+    :return: Transport
+    """
+    if isinstance(transport, Transport):
+        return transport
+    if transport is None or transport == 'aiohttp':
+        return AiohttpTransport(**options)
+    if transport == 'httpx':
+        return HttpxTransport(**options)
+    raise ValueError(f'Unknown transport {transport}, use one of {TRANSPORTS}')
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
 
-PROJECT_DIR = Path(__file__).parent.parent.absolute()
+# DATA is installed next to the synmax package
+PROJECT_DIR = Path(__file__).parent.parent.parent.absolute()
 DATA_FOLDER = os.path.join(PROJECT_DIR, 'DATA')
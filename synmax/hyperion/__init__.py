@@ -1,9 +1,19 @@
+from __future__ import annotations
+
 import calendar
 import os
 
-import pandas as pd
+from synmax.common.lazy import LazyModule
+
+from .hyperion_client import HyperionApiClient, AsyncHyperionApiClient, ApiPayload
+from .incremental import IncrementalStore
+from .fips import FipsLookup, get_fips_lookup
+from .aggregation import StreamingAggregator
+from .reference import ReferenceData
+from .planner import QueryPlan, QueryPlanError
 
-from .hyperion_client import HyperionApiClient, ApiPayload
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
 
 
 def monthly_to_daily(row, prod_column='gas_monthly', date_column='date'):
@@ -24,7 +34,7 @@ def monthly_to_daily(row, prod_column='gas_monthly', date_column='date'):
 
 
 def add_daily(df: pd.DataFrame, date_column='date', monthly_columns=['gas_monthly', 'oil_monthly', 'water_monthly'],
-              daily_columns=['gas_daily', 'oil_daily', 'water_daily']):
+              daily_columns=['gas_daily', 'oil_daily', 'water_daily'], inplace=True):
     """
     Used to add daily production columns to a Pandas dataframe containing monthly production columns.
     :param df: A Pandas dataframe containing monthly columns of production and a date column
@@ -32,24 +42,57 @@ def add_daily(df: pd.DataFrame, date_column='date', monthly_columns=['gas_monthl
     :param monthly_columns: a list of strings contaning the monthly production columns
     :param daily_columns: a list of strings containing the desired names of the outputed daily columns
     which correspond positionaly to the monthly_columns
+    :param inplace: add the columns to ``df`` itself, set to False to leave ``df`` untouched and get a copy
     :return: a Pandas dataframe
     """
+    if not inplace:
+        df = df.copy(deep=False)
+
+    days_in_month = None
     for index, column in enumerate(monthly_columns):
         if column in df.columns:
-            df[daily_columns[index]] = df.apply(monthly_to_daily, axis=1, args=(column, date_column,))
+            if days_in_month is None:
+                # parsed once for all columns
+                days_in_month = pd.to_datetime(df[date_column]).dt.days_in_month.to_numpy()
+            df[daily_columns[index]] = _monthly_to_daily_column(df[column], days_in_month)
         else:
             print(f'Skipping {column} which does not exists')
 
     return df
 
 
+def _monthly_to_daily_column(values: pd.Series, days_in_month):
+    """Vectorized :func:`monthly_to_daily`, values that are not numbers give 0."""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return values.to_numpy(dtype='float64') / days_in_month
+
+    is_number = values.map(lambda value: isinstance(value, (int, float))).to_numpy(dtype=bool)
+    numbers = pd.to_numeric(values.where(is_number), errors='coerce').to_numpy(dtype='float64')
+    return np.where(is_number, numbers, 0) / days_in_month
+
+
 def get_fips():
     """
     Returns lookup table for FIPS codes
     :return: Pandas dataframe
     """
-    from synmax.config import DATA_FOLDER
-    return pd.read_csv(os.path.join(DATA_FOLDER, 'fips_lookup.csv'))
+    # loaded once per process, copied so callers can modify their frame
+    return get_fips_lookup().frame.copy()
+
+
+def attach_fips(df: pd.DataFrame, state_column='state_ab', county_column='county', fips_column='fips',
+                inplace=False):
+    """
+    Adds a FIPS code column to a Pandas dataframe with state abbreviation and county columns.
+    :param df: A Pandas dataframe, e.g. production_by_well results
+    :param state_column: name of the state abbreviation column
+    :param county_column: name of the county column
+    :param fips_column: name of the added FIPS column
+    :param inplace: add the column to ``df`` itself instead of a copy
+    :return: a Pandas dataframe
+    """
+    return get_fips_lookup().attach_fips(df, state_column=state_column, county_column=county_column,
+                                         fips_column=fips_column, inplace=inplace)
 
 
 def make_fips():
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import logging
+from typing import Dict, Iterable, List, Optional, Union
+
+from synmax.common.lazy import LazyModule
+
+pandas = LazyModule('pandas')
+
+LOGGER = logging.getLogger(__name__)
+
+AGGREGATIONS = ('sum', 'mean', 'count', 'min', 'max')
+
+# partial results kept per page for each aggregation, and how partials of several pages are merged
+_PARTIALS = {'sum': ('sum',), 'count': ('count',), 'mean': ('sum', 'count'), 'min': ('min',), 'max': ('max',)}
+_MERGE = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+# group-bys the api computes itself through ``aggregate_by``: endpoint -> result column -> aggregate_by value.
+# The api sums its rows per date and aggregate_by value, the rollup to the requested groups is finished here.
+SERVER_AGGREGATE_BY: Dict[str, Dict[str, str]] = {
+    'v3/ducsbyoperator': {'operator': 'operator', 'operator_name': 'operator'},
+}
+# group columns the api keeps in aggregated rows
+_SERVER_KEPT_COLUMNS = ('date',)
+
+Aggregations = Union[str, List[str], Dict[str, Union[str, List[str]]]]
+
+
+def normalize_aggregations(aggregations: Aggregations) -> Dict[str, List[str]]:
+    """
+    :param aggregations: column name(s) to sum, or a dict of column name to function name(s) among
+        :data:`AGGREGATIONS`, e.g. ``{'gas_monthly': ['sum', 'mean'], 'api': 'count'}``
+    :return: dict of column name to list of function names
+    """
+    if isinstance(aggregations, str):
+        aggregations = [aggregations]
+    if not isinstance(aggregations, dict):
+        aggregations = {column: 'sum' for column in aggregations}
+
+    normalized = {}
+    for column, functions in aggregations.items():
+        functions = [functions] if isinstance(functions, str) else list(functions)
+        unknown = [function for function in functions if function not in AGGREGATIONS]
+        if unknown:
+            raise ValueError(f'Unsupported aggregation {unknown} of {column}, use one of {AGGREGATIONS}')
+        normalized[column] = functions
+    return normalized
+
+
+def server_aggregate_by(endpoint: str, group_by: List[str], aggregations: Dict[str, List[str]]) -> Optional[List[str]]:
+    """
+    ``aggregate_by`` value computing ``group_by`` on the api, None when the api can not compute it.
+
+    Only sums are pushed to the api: summing its per group sums again gives the same result, averaging or
+    counting them does not.
+    """
+    supported = SERVER_AGGREGATE_BY.get(endpoint)
+    if not supported or any(functions != ['sum'] for functions in aggregations.values()):
+        return None
+    columns = [column for column in group_by if column not in _SERVER_KEPT_COLUMNS]
+    if not columns or any(column not in supported for column in columns):
+        return None
+    return sorted({supported[column] for column in columns})
+
+
+class StreamingAggregator:
+    """
+    Group-by aggregation computed page by page: each page is reduced to partial results per group (sums, counts,
+    minimums and maximums), which are merged with the partials of the previous pages. Memory grows with the number
+    of groups, not with the number of rows.
+
+    >>> aggregator = StreamingAggregator(['date'], {'gas_monthly': ['sum']})
+    >>> for df in client.production_by_well(payload, stream=True):
+    ...     aggregator.add(df)
+    >>> totals = aggregator.result()
+    """
+
+    def __init__(self, group_by: Union[str, List[str]], aggregations: Aggregations, compact_rows: int = 100000):
+        """
+
+        :param group_by: column name(s) of the groups
+        :param aggregations: see :func:`normalize_aggregations`
+        :param compact_rows: partial rows buffered before they are merged
+        """
+        self.group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        self.aggregations = normalize_aggregations(aggregations)
+        self.compact_rows = compact_rows
+        self.rows = 0
+
+        # partial column name -> (source column, partial function)
+        self._partial_columns = {}
+        for column, functions in self.aggregations.items():
+            for function in functions:
+                for partial in _PARTIALS[function]:
+                    self._partial_columns[f'{column}__{partial}'] = (column, partial)
+        self._partials: List[pandas.DataFrame] = []
+        self._buffered_rows = 0
+
+    def __repr__(self):
+        return f'StreamingAggregator(group_by={self.group_by}, aggregations={self.aggregations}, rows={self.rows})'
+
+    def add(self, df: pandas.DataFrame):
+        """Reduce a page to its partial results."""
+        if df is None or df.empty:
+            return
+        missing = [column for column in self.group_by + list(self.aggregations) if column not in df.columns]
+        if missing:
+            raise KeyError(f'Columns {missing} are not in the results, available: {list(df.columns)}')
+
+        partial = df.groupby(self.group_by, observed=True, dropna=False, sort=False).agg(**self._partial_columns)
+        self._partials.append(partial)
+        self._buffered_rows += len(partial)
+        self.rows += len(df)
+        if self._buffered_rows > self.compact_rows and len(self._partials) > 1:
+            self._compact()
+
+    def add_pages(self, frames: Iterable[pandas.DataFrame]) -> 'StreamingAggregator':
+        for df in frames:
+            self.add(df)
+        return self
+
+    def _compact(self):
+        partials = pandas.concat(self._partials)
+        merge = {name: _MERGE[partial] for name, (_, partial) in self._partial_columns.items()}
+        merged = partials.groupby(level=list(range(len(self.group_by))), observed=True, dropna=False,
+                                  sort=False).agg(merge)
+        self._partials = [merged]
+        self._buffered_rows = len(merged)
+
+    def result(self) -> pandas.DataFrame:
+        """
+        Aggregated values indexed by the groups, sorted like ``DataFrame.groupby``. Columns are named after their
+        source column, or ``<column>_<function>`` for columns with several functions.
+        """
+        if not self._partials:
+            return pandas.DataFrame(columns=self.group_by).set_index(self.group_by)
+        self._compact()
+        partials = self._partials[0]
+
+        result = pandas.DataFrame(index=partials.index)
+        for column, functions in self.aggregations.items():
+            for function in functions:
+                name = column if len(functions) == 1 else f'{column}_{function}'
+                if function == 'mean':
+                    counts = partials[f'{column}__count']
+                    result[name] = partials[f'{column}__sum'] / counts.where(counts > 0)
+                else:
+                    result[name] = partials[f'{column}__{_PARTIALS[function][0]}']
+        return result.sort_index()
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import functools
+import os
+from typing import Optional, Tuple
+
+from synmax.common.lazy import LazyModule
+
+pd = LazyModule('pandas')
+
+
+def _normalize_county(counties: pd.Index) -> pd.Index:
+    """Same spelling as the lookup table: upper case, without the ' County' / ' Parish' suffix."""
+    counties = counties.astype(str).str.strip().str.upper()
+    return counties.str.replace(r' (COUNTY|PARISH)$', '', regex=True)
+
+
+class FipsLookup:
+    """
+    Indexed FIPS code lookup table.
+
+    Rows are indexed on ``(state_ab, county)`` and on ``fips``, single lookups are dictionary reads and
+    :meth:`attach_fips` resolves each distinct state/county pair of a frame once instead of joining every row.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        """
+
+        :param df: table with 'fips', 'county' and 'state_ab' columns
+        """
+        self.frame = df.reset_index(drop=True)
+        fips = self.frame['fips'].tolist()
+        states = self.frame['state_ab'].astype(str).str.upper()
+        counties = _normalize_county(pd.Index(self.frame['county']))
+        self._by_pair = dict(zip(zip(states, counties), fips))
+        self._by_fips = dict(zip(fips, zip(self.frame['county'], self.frame['state_ab'])))
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __repr__(self):
+        return f'FipsLookup(rows={len(self)})'
+
+    @classmethod
+    def load(cls, path: str = None) -> 'FipsLookup':
+        """
+        Load the lookup table from csv, or from a prebuilt parquet or pickle file written by :meth:`save`.
+
+        :param path: (optional) defaults to the fips_lookup.csv shipped with the package
+        """
+        if path is None:
+            from synmax.config import DATA_FOLDER
+            path = os.path.join(DATA_FOLDER, 'fips_lookup.csv')
+
+        if path.endswith('.parquet'):
+            df = pd.read_parquet(path)
+        elif path.endswith('.pkl'):
+            df = pd.read_pickle(path)
+        else:
+            df = pd.read_csv(path)
+        return cls(df)
+
+    def save(self, path: str):
+        """Write the table to parquet or pickle for faster loading, based on the extension of ``path``."""
+        if path.endswith('.parquet'):
+            self.frame.to_parquet(path, index=False)
+        else:
+            self.frame.to_pickle(path)
+
+    def fips(self, state_ab: str, county: str) -> Optional[int]:
+        """FIPS code of a county, None when unknown."""
+        key = (str(state_ab).upper(), _normalize_county(pd.Index([county]))[0])
+        return self._by_pair.get(key)
+
+    def county(self, fips: int) -> Optional[Tuple[str, str]]:
+        """(county, state_ab) of a FIPS code, None when unknown."""
+        return self._by_fips.get(fips)
+
+    def attach_fips(self, df: pd.DataFrame, state_column='state_ab', county_column='county', fips_column='fips',
+                    inplace=False) -> pd.DataFrame:
+        """
+        Add a FIPS code column to ``df``, matched on its state and county columns. County names are matched
+        case insensitively and with or without a ' County' / ' Parish' suffix. Unknown counties get <NA>.
+
+        :param df: frame with state abbreviation and county columns
+        :param state_column:
+        :param county_column:
+        :param fips_column: name of the added column
+        :param inplace: add the column to ``df`` itself instead of a copy
+        :return: pandas.DataFrame
+        """
+        if not inplace:
+            df = df.copy(deep=False)
+
+        # resolve every distinct state/county pair once, then broadcast through the codes
+        state_codes, states = pd.factorize(df[state_column])
+        county_codes, counties = pd.factorize(df[county_column])
+        states = pd.Index(states).astype(str).str.upper()
+        counties = _normalize_county(pd.Index(counties))
+
+        pair_codes = state_codes.astype('int64') * max(1, len(counties)) + county_codes
+        # rows with a missing state or county never match
+        pair_codes[(state_codes < 0) | (county_codes < 0)] = -1
+        row_pairs, pairs = pd.factorize(pair_codes)
+
+        pair_fips = pd.array([
+            self._by_pair.get((states[pair // len(counties)], counties[pair % len(counties)]))
+            if pair >= 0 else None for pair in pairs
+        ], dtype='Int64')
+        row_fips = pair_fips.take(row_pairs, allow_fill=True)
+        df[fips_column] = row_fips
+        return df
+
+
+@functools.lru_cache(maxsize=None)
+def get_fips_lookup(path: str = None) -> FipsLookup:
+    """
+    Process wide :class:`FipsLookup`, loaded on first use.
+
+    :param path: (optional) csv, parquet or pickle file, defaults to the table shipped with the package
+    """
+    return FipsLookup.load(path)
@@ -1,21 +1,82 @@
+from __future__ import annotations
+
+import copy
 import json
 import logging
 import os
-from typing import Optional
-
-import pandas
-
-from synmax.common import ApiClient, ApiClientAsync, PayloadModelBase
+from typing import Optional, Iterator, AsyncIterator, Union, List, Dict
+
+from pydantic import PrivateAttr
+
+from synmax.common import ApiClient, ApiClientAsync, PayloadModelBase, AdaptiveRateLimiter, ParquetSink, ResponseCache
+from synmax.common.api_client import PARALLEL_REQUESTS
+from synmax.common.decoder import DECODERS, JsonDecoder, get_decoder
+from synmax.common.frames import frame_from_records
+from synmax.common.lazy import LazyModule
+from synmax.common.metrics import MetricsCollector
+from synmax.common.process_pool import fetch_in_processes
+from synmax.common.retry import RetryPolicy
+from synmax.common.spool import PageSpool
+from synmax.common.transport import Transport
+
+from .aggregation import Aggregations, StreamingAggregator, server_aggregate_by
+from .planner import QueryPlan, QueryPlanError, choose_strategy, validate_payload
+from .reference import REFERENCE_DATASETS, ReferenceData
+from .schemas import endpoint_schema
+from .incremental import IncrementalStore, fetch_incremental
+from .sharding import shard_payload, run_sharded
+
+pandas = LazyModule('pandas')
 
 LOGGER = logging.getLogger(__name__)
 
+# POST endpoints return a DataFrame, an iterator of per page DataFrames with stream=True, or the sink
+QueryResult = Union['pandas.DataFrame', Iterator['pandas.DataFrame'], ParquetSink]
+
 
 class ApiPayload(PayloadModelBase):
     first_production_month_start: Optional[str] = None
     first_production_month_end: Optional[str] = None
     modeled: Optional[bool] = None
 
+    # filters encoded once, see _encoded_filters
+    _encoded: Optional[tuple] = PrivateAttr(default=None)
+
     def payload(self, pagination_start=None) -> str:
+        """
+        Request body of the page at ``pagination_start``, ``self.pagination_start`` by default. The filters are
+        encoded once and reused for every page while they are unchanged, only the pagination offset is added.
+        """
+        prefix, _ = self._encoded_filters()
+        return f'{prefix}{pagination_start if pagination_start else self.pagination_start}}}}}'
+
+    def canonical(self) -> str:
+        """Filters with sorted keys, pagination excluded: equal queries give equal strings."""
+        return self._encoded_filters()[1]
+
+    def _filter_values(self) -> dict:
+        return dict(self.__dict__, pagination_start=None)
+
+    def _encoded_filters(self) -> tuple:
+        """
+        Body of the request up to the pagination offset, and the canonical form of the filters. Encoded again only
+        when a filter changed since the last call.
+        """
+        # read from the private storage directly, pydantic 2 resolves private attributes slowly
+        private = getattr(self, '__pydantic_private__', None)
+        encoded = private.get('_encoded') if private is not None else self._encoded
+        if encoded is not None and encoded[0] == self._filter_values():
+            return encoded[1:]
+
+        filters = self._filters()
+        body = json.dumps(filters)
+        prefix = body[:-1] + (', ' if filters else '') + '"pagination": {"start": '
+        canonical = json.dumps(filters, sort_keys=True, separators=(',', ':'))
+        # copied, filters changed in place must not match
+        self._encoded = (copy.deepcopy(self._filter_values()), prefix, canonical)
+        return prefix, canonical
+
+    def _filters(self) -> dict:
 
         if self.start_date is None:
             payload_start_date = None
@@ -89,9 +150,6 @@ class ApiPayload(PayloadModelBase):
             "frac_class": self.frac_class,
             "category": self.category,
             "modeled": self.modeled,
-            "pagination": {
-                "start": pagination_start if pagination_start else self.pagination_start
-            }
         }
 
         if _payload["production_month"] == None:
@@ -100,91 +158,571 @@ class ApiPayload(PayloadModelBase):
         if _payload["modeled"] == None:
             _payload.pop("modeled")
 
-        return json.dumps(_payload)
+        return _payload
 
 
 class HyperionApiClient(object):
-    def __init__(self, access_token: str = None, local_server=False, async_client=True):
+    def __init__(self, access_token: str = None, local_server=False, async_client=True,
+                 rate_limiter: AdaptiveRateLimiter = None, cache: ResponseCache = None, typed_columns=True,
+                 json_decoder: Union[str, JsonDecoder] = None, transport: Union[str, Transport] = None,
+                 metrics: MetricsCollector = None, spool: PageSpool = None, retry_policy: RetryPolicy = None,
+                 reference_ttl: Union[float, Dict[str, float]] = None, reference_dir: str = None):
         """
+        The client keeps its connections open between calls, release them with :meth:`close` or use the client
+        as a context manager.
 
         :param access_token:
         :param local_server:
+        :param async_client: fetch pages concurrently, concurrency adapts to the server rate limit
+        :param rate_limiter: (optional) limiter shared with other clients using the same access token
+        :param cache: (optional) on-disk cache of query results, see ``use_cache`` and ``refresh_cache`` on each call
+        :param typed_columns: build results with the column dtypes of each endpoint (dates, categoricals, nullable
+            integers), False to let pandas infer every column
+        :param json_decoder: (optional) 'orjson', 'msgspec' or 'json', defaults to the fastest one installed
+        :param transport: (optional) connection pool of the async client, 'aiohttp' (default), 'httpx' for HTTP/2,
+            or a :class:`synmax.common.Transport` with custom pool size, keep-alive and DNS cache settings
+        :param metrics: (optional) collector of per request timings, sizes and status codes, see ``self.metrics``
+        :param spool: (optional) checkpoints every page of paginated queries on disk, an interrupted query run
+            again only fetches the pages it is missing
+        :param retry_policy: (optional) attempts, backoff, per query retry budget and deadline, and circuit breaker
+            of the requests, see :class:`synmax.common.RetryPolicy`
+        :param reference_ttl: (optional) seconds the reference datasets (regions, operator classification, ...)
+            are kept before being revalidated, for all of them or per dataset name, see ``self.reference``
+        :param reference_dir: (optional) folder keeping a copy of the reference datasets across processes
         """
 
         if access_token is None:
             access_token = os.getenv('access_token')
         self.access_key = access_token
+        self.typed_columns = typed_columns
 
         if local_server:
             self._base_uri = 'http://127.0.0.1:8080/'
         else:
             self._base_uri = 'https://hyperion.api.synmax.com/'
 
-        async_client = False  # do not run in async to avoid http 429 throttle limit
+        # one limiter for both clients, they draw from the same server quota
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.cache = cache
+        self.json_decoder = get_decoder(json_decoder)
+        self.metrics = metrics or MetricsCollector()
+        self.spool = spool
+        # one circuit breaker for both clients
+        self.retry_policy = retry_policy or RetryPolicy()
+        clients_args = dict(access_token=access_token, rate_limiter=self.rate_limiter, cache=cache,
+                            json_decoder=self.json_decoder, metrics=self.metrics, spool=spool,
+                            retry_policy=self.retry_policy)
         if async_client:
             LOGGER.info('Initializing async client')
-            self.api_client = ApiClientAsync(access_token=access_token)
+            self.api_client = ApiClientAsync(transport=transport, **clients_args)
         else:
-            self.api_client = ApiClient(access_token=access_token)
+            self.api_client = ApiClient(**clients_args)
+
+        self.api_client_sync = ApiClient(**clients_args)
+        # datasets loaded on first use, see fetch_regions, fetch_operator_classification, ...
+        self.reference = ReferenceData(self._load_reference, ttl=reference_ttl, directory=reference_dir,
+                                       scope=access_token)
 
-        self.api_client_sync = ApiClient(access_token=access_token)
+    def close(self):
+        """Close the open connections of the client."""
+        self.api_client.close()
+        self.api_client_sync.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     # GET
 
-    def fetch_regions(self) -> pandas.DataFrame:
-        return self.api_client_sync.get(f"{self._base_uri}/v3/regions", return_json=True)
+    def _load_reference(self, endpoint: str, etag: str = None, last_modified: str = None):
+        return self.api_client_sync.get_revalidated(f"{self._base_uri}/{endpoint}", etag=etag,
+                                                    last_modified=last_modified)
+
+    def _reference(self, name: str, refresh=False, **kwargs) -> pandas.DataFrame:
+        """
+        Copy of reference dataset ``name``, see :class:`ReferenceData`.
+
+        :param refresh: revalidate the dataset even if it is still fresh
+        :param kwargs: ``refresh_cache=True`` or ``use_cache=False`` also revalidate, other request options
+            send the GET directly
+        """
+        refresh = refresh or kwargs.pop('refresh_cache', False) or not kwargs.pop('use_cache', True)
+        if kwargs:
+            return self.api_client_sync.get(f"{self._base_uri}/{REFERENCE_DATASETS[name][0]}", return_json=True,
+                                            **kwargs)
+        return self.reference.get(name, refresh=refresh).copy()
+
+    def fetch_regions(self, **kwargs) -> pandas.DataFrame:
+        return self._reference('regions', **kwargs)
     
-    def fetch_dtils(self) -> pandas.DataFrame:
-        return self.api_client_sync.get(f"{self._base_uri}/v3/dtils", return_json=True)
+    def fetch_dtils(self, **kwargs) -> pandas.DataFrame:
+        return self._reference('dtils', **kwargs)
 
-    def fetch_operator_classification(self) -> pandas.DataFrame:
-        return self.api_client_sync.get(f"{self._base_uri}/v3/operatorclassification", return_json=True)
+    def fetch_operator_classification(self, **kwargs) -> pandas.DataFrame:
+        return self._reference('operator_classification', **kwargs)
 
-    def fetch_pipeline_scrape_status(self) -> pandas.DataFrame:
-        return self.api_client_sync.get(f"{self._base_uri}/v3/pipelinescrapestatus", return_json=True)
+    def fetch_pipeline_scrape_status(self, **kwargs) -> pandas.DataFrame:
+        return self._reference('pipeline_scrape_status', **kwargs)
     
-    def fetch_til_monitoring(self) -> pandas.DataFrame:
-        return self.api_client_sync.get(f"{self._base_uri}/v3/til_monitoring", return_json=True)
+    def fetch_til_monitoring(self, **kwargs) -> pandas.DataFrame:
+        return self._reference('til_monitoring', **kwargs)
     
-    def fetch_forecast_run_dates(self) -> pandas.DataFrame:
-        return self.api_client_sync.get(f"{self._base_uri}/v3/shorttermforecasthistorydates", return_json=True)
+    def fetch_forecast_run_dates(self, **kwargs) -> pandas.DataFrame:
+        return self._reference('forecast_run_dates', **kwargs)
 
     # POST
-    def daily_fracked_feet(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/dailyfrackedfeet", payload=payload, return_json=True)
+    def _post(self, endpoint: str, payload: ApiPayload, stream=False, read_ahead: int = None,
+              sink: Union[str, ParquetSink] = None, partition_by: Union[str, List[str]] = None,
+              **kwargs) -> QueryResult:
+        """
+        Query a paginated endpoint.
+
+        :param endpoint: path of the endpoint, relative to the api root
+        :param payload: query filters
+        :param stream: yield one DataFrame per page as pages arrive instead of returning the full result
+        :param read_ahead: (optional) with ``stream`` or ``sink``, number of pages fetched ahead of the consumer
+        :param sink: (optional) parquet path or :class:`ParquetSink`, pages are appended to it as they arrive
+            and the sink is returned instead of a DataFrame
+        :param partition_by: (optional) with a ``sink`` path, column name(s) used to partition the dataset
+        :param kwargs: ``use_cache`` and ``refresh_cache``, ignored when streaming or writing to a sink, the response
+            cache holds full results only, and the options of ``request``
+        :return: pandas.DataFrame, an iterator of pandas.DataFrame when streaming, or the sink
+        :raises QueryPlanError: for unknown filters or inverted date ranges, before anything is sent
+        """
+        problems = validate_payload(payload)
+        if problems:
+            raise QueryPlanError(problems)
+        url = f"{self._base_uri}/{endpoint}"
+        if stream or sink is not None:
+            kwargs.pop('use_cache', None)
+            kwargs.pop('refresh_cache', None)
+        if sink is not None:
+            if not isinstance(sink, ParquetSink):
+                sink = ParquetSink(sink, partition_by=partition_by,
+                                   column_types=endpoint_schema(endpoint) if self.typed_columns else None)
+            return self.api_client.write_pages(sink, url, payload=payload, return_json=True, read_ahead=read_ahead,
+                                               **kwargs)
+        if self.typed_columns:
+            kwargs.setdefault('schema', endpoint_schema(endpoint))
+        if stream:
+            return self.api_client.iter_pages(url, payload=payload, return_json=True, read_ahead=read_ahead,
+                                              **kwargs)
+        return self.api_client.post(url, payload=payload, return_json=True, **kwargs)
+
+    def daily_fracked_feet(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/dailyfrackedfeet", payload, **kwargs)
+
+    def long_term_forecast(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/longtermforecast", payload, **kwargs)
+
+    def well_completion(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/completions", payload, **kwargs)
+
+    def ducs_by_operator(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/ducsbyoperator", payload, **kwargs)
 
-    def long_term_forecast(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/longtermforecast", payload=payload, return_json=True)
+    def frac_crews(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/fraccrews", payload, **kwargs)
 
-    def well_completion(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/completions", payload=payload, return_json=True)
+    def production_by_well(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/productionbywell", payload, **kwargs)
 
-    def ducs_by_operator(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/ducsbyoperator", payload=payload, return_json=True)
+    def rigs(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/rigs", payload, **kwargs)
 
-    def frac_crews(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/fraccrews", payload=payload, return_json=True)
+    def wells(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/wells", payload, **kwargs)
 
-    def production_by_well(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/productionbywell", payload=payload, return_json=True)
+    def short_term_forecast(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/shorttermforecast", payload, **kwargs)
 
-    def rigs(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/rigs", payload=payload, return_json=True)
+    def short_term_forecast_history(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/shorttermforecasthistory", payload, **kwargs)
 
-    def wells(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/wells", payload=payload, return_json=True)
+    def short_term_forecast_declines(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/shorttermforecastdeclines", payload, **kwargs)
 
-    def short_term_forecast(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/shorttermforecast", payload=payload, return_json=True)
+    def daily_production(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/dailyproduction", payload, **kwargs)
 
-    def short_term_forecast_history(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/shorttermforecasthistory", payload=payload, return_json=True)
+    def pipeline_scrapes(self, payload: ApiPayload = ApiPayload(), **kwargs) -> QueryResult:
+        return self._post("v3/pipelinescrapes", payload, **kwargs)
 
-    def short_term_forecast_declines(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/shorttermforecastdeclines", payload=payload, return_json=True)
+    # query planning
 
-    def daily_production(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/dailyproduction", payload=payload, return_json=True)
+    def plan(self, endpoint: str, payload: ApiPayload, max_rows: int = None, sequential_pages: int = 2,
+             shard_rows: Optional[int] = 2000000, stream_rows: int = None) -> QueryPlan:
+        """
+        Check a query before fetching it: its filters are validated against the reference data, its size is
+        estimated from the ``total_count`` of its first page and an execution strategy is chosen for that size,
+        see :func:`synmax.hyperion.planner.choose_strategy`. Bad or oversized queries fail here, after one request.
+
+        :param endpoint: name of a paginated method, e.g. 'production_by_well'
+        :param payload: query filters
+        :param max_rows: (optional) queries returning more rows are rejected
+        :param sequential_pages: queries of up to this many pages are fetched one page after another
+        :param shard_rows: (optional) queries of this many rows or more with a filter of several values are sharded
+        :param stream_rows: (optional) queries of this many rows or more are streamed page by page
+        :return: QueryPlan, run it with :meth:`execute`
+        :raises QueryPlanError: listing the problems of the query
+        """
+        path = _ENDPOINTS[endpoint]
+        problems = validate_payload(payload, self.reference)
+        if problems:
+            raise QueryPlanError(problems)
+
+        url = f"{self._base_uri}/{path}"
+        client = self.api_client_sync
+        payload.pagination_start = 0
+        first_page = client._spooled_page(url, payload, 0, lambda: client._fetch_json_page(url, payload))
+        pagination = (first_page or {}).get('pagination') or {}
+        total_count = pagination.get('total_count', 0)
+        if max_rows is not None and total_count > max_rows:
+            raise QueryPlanError([f'{endpoint} would return {total_count} rows, more than max_rows={max_rows}'])
+
+        strategy = choose_strategy(total_count, pagination.get('page_size', 0), payload,
+                                   sequential_pages=sequential_pages, shard_rows=shard_rows, stream_rows=stream_rows)
+        plan = QueryPlan(endpoint, payload, first_page, strategy)
+        LOGGER.info('Query plan: %s', plan)
+        return plan
+
+    def execute(self, plan: QueryPlan, **kwargs) -> QueryResult:
+        """
+        Run a query planned with :meth:`plan`. The first page fetched by the plan is not requested again, except
+        by the 'sharded' strategy which runs other queries.
+
+        :param plan:
+        :param kwargs: passed to the endpoint method, e.g. ``use_cache``
+        :return: pandas.DataFrame, or an iterator of pandas.DataFrame for the 'streamed' strategy
+        """
+        path = _ENDPOINTS[plan.endpoint]
+        schema = endpoint_schema(path) if self.typed_columns else None
+        if plan.strategy == 'single_page':
+            self.api_client_sync._finish_spool(f"{self._base_uri}/{path}", plan.payload, 1)
+            return frame_from_records(plan.first_page['data'] if plan.first_page else [], schema)
+        if plan.strategy == 'sharded':
+            return self.fetch_sharded(plan.endpoint, plan.payload, **kwargs)
+        if plan.first_page is not None:
+            kwargs['first_page'] = plan.first_page
+        if plan.strategy == 'sequential':
+            kwargs.setdefault('schema', schema)
+            return self.api_client_sync.post(f"{self._base_uri}/{path}", payload=plan.payload, return_json=True,
+                                             **kwargs)
+        return self._post(path, plan.payload, stream=plan.strategy == 'streamed', **kwargs)
+
+    def query(self, endpoint: str, payload: ApiPayload, max_rows: int = None, stream_rows: int = None,
+              **kwargs) -> QueryResult:
+        """
+        :meth:`plan` and :meth:`execute` a query.
+
+        >>> df = client.query('production_by_well', ApiPayload(state_code='TX', sub_region='Midland'), max_rows=10 ** 7)
+
+        :param endpoint: name of a paginated method, e.g. 'production_by_well'
+        :param payload: query filters
+        :param max_rows: (optional) queries returning more rows are rejected
+        :param stream_rows: (optional) queries of this many rows or more are streamed page by page
+        :param kwargs: passed to the endpoint method, e.g. ``use_cache``
+        :return: pandas.DataFrame, or an iterator of pandas.DataFrame when streamed
+        """
+        return self.execute(self.plan(endpoint, payload, max_rows=max_rows, stream_rows=stream_rows), **kwargs)
+
+    # incremental refresh
+
+    def fetch_incremental(self, endpoint: str, payload: ApiPayload, store: IncrementalStore = None,
+                          lookback_days: int = 7, date_column: str = 'date',
+                          key_columns: List[str] = None) -> pandas.DataFrame:
+        """
+        Keep a local copy of a date ranged query and only fetch what changed since the last call.
+
+        The first call fetches the whole ``start_date`` - ``end_date`` window. Later calls with the same filters
+        only request the dates not fetched yet plus the last ``lookback_days`` already stored, to pick up
+        restatements, and merge them into the local copy.
+
+        :param endpoint: name of a date ranged method, e.g. 'daily_production', 'pipeline_scrapes', 'rigs' or
+            'frac_crews'
+        :param payload: query filters, ``start_date`` is required and ``end_date`` defaults to today
+        :param store: (optional) where the local copies are kept, defaults to ~/.cache/synmax/incremental
+        :param lookback_days: days at the end of the stored data fetched again on every call
+        :param date_column: column holding the date of each row
+        :param key_columns: (optional) natural key of the rows, duplicates keep the latest value
+        :return: pandas.DataFrame of the requested window
+        """
+        return fetch_incremental(getattr(self, endpoint), endpoint, payload, store or IncrementalStore(),
+                                 lookback_days=lookback_days, date_column=date_column, key_columns=key_columns,
+                                 scope=self.access_key)
+
+    # sharding
+
+    def fetch_sharded(self, endpoint: str, payload: ApiPayload, shard_by: Union[str, List[str]] = None,
+                      window_days: int = 365, max_workers: int = 4, key_columns: List[str] = None,
+                      **kwargs) -> pandas.DataFrame:
+        """
+        Split a large query into shards, run them concurrently and return one merged, de-duplicated DataFrame.
+        All shards draw from the rate limiter of this client.
+
+        :param endpoint: name of a paginated method, e.g. 'rigs' or 'production_by_well'
+        :param payload: query filters
+        :param shard_by: (optional) filter name(s) among 'state_code', 'region', 'sub_region', 'county',
+            'operator' and 'api', one shard per value, and/or 'date' for one shard per ``window_days``.
+            Defaults to the filter with the most values, else to 'date'.
+        :param window_days: size of the date windows when sharding by date
+        :param max_workers: shards queried at the same time
+        :param key_columns: (optional) columns identifying a row when dropping duplicates, all columns by default
+        :param kwargs: passed to the endpoint method, e.g. ``use_cache``
+        :return: pandas.DataFrame
+        """
+        shards = shard_payload(payload, shard_by=shard_by, window_days=window_days)
+        return run_sharded(getattr(self, endpoint), shards, max_workers=max_workers, key_columns=key_columns,
+                           **kwargs)
+
+    # aggregation
+
+    def aggregate(self, endpoint: str, payload: ApiPayload, group_by: Union[str, List[str]],
+                  aggregations: Aggregations, server_side: bool = None, **kwargs) -> pandas.DataFrame:
+        """
+        Group-by aggregation of a paginated endpoint, without materializing the rows. When the api can compute the
+        groups itself through ``aggregate_by``, see :data:`synmax.hyperion.aggregation.SERVER_AGGREGATE_BY`, only
+        the aggregated rows are fetched. Otherwise the pages are streamed and aggregated one by one.
+
+        >>> client.aggregate('short_term_forecast', payload, group_by='date', aggregations='gas_monthly')
+
+        :param endpoint: name of a paginated method, e.g. 'production_by_well'
+        :param payload: query filters
+        :param group_by: column name(s) of the groups
+        :param aggregations: column name(s) to sum, or a dict of column name to 'sum', 'mean', 'count', 'min' or
+            'max', or a list of them
+        :param server_side: (optional) True to require the api to aggregate, False to aggregate here only,
+            by default the api aggregates when it can
+        :param kwargs: passed to the endpoint method, e.g. ``read_ahead``
+        :return: pandas.DataFrame indexed by the groups
+        """
+        path = _ENDPOINTS[endpoint]
+        aggregator = StreamingAggregator(group_by, aggregations)
+        aggregate_by = None
+        if server_side is not False:
+            aggregate_by = server_aggregate_by(path, aggregator.group_by, aggregator.aggregations)
+            if aggregate_by is None and server_side:
+                raise ValueError(f'{endpoint} can not aggregate {aggregator.aggregations} by {aggregator.group_by} '
+                                 f'on the api')
+        if aggregate_by is not None:
+            LOGGER.info('Aggregating %s by %s on the api', endpoint, aggregate_by)
+            payload = payload.copy_with(aggregate_by=aggregate_by)
+
+        aggregator.add_pages(self._post(path, payload, stream=True, **kwargs))
+        LOGGER.info('Aggregated %s rows of %s', aggregator.rows, endpoint)
+        return aggregator.result()
+
+    # multiple processes
+
+    def fetch_in_processes(self, endpoint: str, payload: ApiPayload, processes: int = None, use_cache=True,
+                           refresh_cache=False) -> pandas.DataFrame:
+        """
+        Query a paginated endpoint with a pool of worker processes, for large pulls where decoding the responses
+        and building the DataFrame keep one core busy. Each worker fetches a range of pages and builds its rows
+        into a chunk, handed back as Arrow IPC instead of a pickled DataFrame. Rows come in page order.
+
+        Needs pyarrow. The workers are started with 'spawn', call this under ``if __name__ == '__main__':`` in
+        scripts.
+
+        :param endpoint: name of a paginated method, e.g. 'production_by_well'
+        :param payload: query filters
+        :param processes: (optional) worker processes, defaults to the number of cores
+        :param use_cache: (optional) False to bypass the response cache
+        :param refresh_cache: (optional) True to fetch from the api and replace the cached result
+        :return: pandas.DataFrame
+        """
+        problems = validate_payload(payload)
+        if problems:
+            raise QueryPlanError(problems)
+        path = _ENDPOINTS[endpoint]
+        url = f"{self._base_uri}/{path}"
+        client = self.api_client_sync
+        # decoders are passed by name, the functions of custom ones must be picklable
+        json_decoder = self.json_decoder.name if self.json_decoder.name in DECODERS else self.json_decoder
+        client_options = dict(access_token=self.access_key, json_decoder=json_decoder, spool=self.spool)
+        transport = getattr(self.api_client, 'transport', None)
+        if transport is not None:
+            client_options['transport'] = transport.name
+
+        def fetch():
+            return fetch_in_processes(client, url, payload, client_options, processes=processes,
+                                      schema=endpoint_schema(path) if self.typed_columns else None)
+
+        return client._cached((url, payload), fetch, use_cache, refresh_cache)
+
+
+class AsyncHyperionApiClient(object):
+    """
+    Hyperion api for asyncio code: every method of :class:`HyperionApiClient` as a coroutine, all calls share one
+    long-lived session of the running loop. Use it as an async context manager, or ``await client.close()``.
+
+    >>> async with AsyncHyperionApiClient(access_token) as client:
+    ...     rigs, wells = await asyncio.gather(client.rigs(payload), client.wells(payload))
+    """
+
+    def __init__(self, access_token: str = None, local_server=False, rate_limiter: AdaptiveRateLimiter = None,
+                 cache: ResponseCache = None, typed_columns=True, json_decoder: Union[str, JsonDecoder] = None,
+                 transport: Union[str, Transport] = None, metrics: MetricsCollector = None, spool: PageSpool = None,
+                 retry_policy: RetryPolicy = None):
+        """
 
-    def pipeline_scrapes(self, payload: ApiPayload = ApiPayload()) -> pandas.DataFrame:
-        return self.api_client.post(f"{self._base_uri}/v3/pipelinescrapes", payload=payload, return_json=True)
+        :param access_token:
+        :param local_server:
+        :param rate_limiter: (optional) limiter shared with other clients using the same access token
+        :param cache: (optional) on-disk cache of query results
+        :param typed_columns: build results with the column dtypes of each endpoint
+        :param json_decoder: (optional) 'orjson', 'msgspec' or 'json', defaults to the fastest one installed
+        :param transport: (optional) connection pool, 'aiohttp' (default), 'httpx' for HTTP/2, or a
+            :class:`synmax.common.Transport` with custom pool size, keep-alive and DNS cache settings
+        :param metrics: (optional) collector of per request timings, sizes and status codes, see ``self.metrics``
+        :param spool: (optional) checkpoints every page of paginated queries on disk, to resume interrupted queries
+        :param retry_policy: (optional) attempts, backoff, per query retry budget and deadline, and circuit breaker
+            of the requests
+        """
+        if access_token is None:
+            access_token = os.getenv('access_token')
+        self.access_key = access_token
+        self.typed_columns = typed_columns
+
+        if local_server:
+            self._base_uri = 'http://127.0.0.1:8080/'
+        else:
+            self._base_uri = 'https://hyperion.api.synmax.com/'
+
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.cache = cache
+        self.metrics = metrics or MetricsCollector()
+        self.spool = spool
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.api_client = ApiClientAsync(access_token=access_token, rate_limiter=self.rate_limiter, cache=cache,
+                                         json_decoder=json_decoder, transport=transport, metrics=self.metrics,
+                                         spool=spool, retry_policy=self.retry_policy)
+
+    async def close(self):
+        await self.api_client.close_async()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    # GET
+
+    async def _get(self, endpoint: str, **kwargs) -> pandas.DataFrame:
+        return await self.api_client.get_async(f"{self._base_uri}/{endpoint}", **kwargs)
+
+    async def fetch_regions(self, **kwargs) -> pandas.DataFrame:
+        return await self._get("v3/regions", **kwargs)
+
+    async def fetch_dtils(self, **kwargs) -> pandas.DataFrame:
+        return await self._get("v3/dtils", **kwargs)
+
+    async def fetch_operator_classification(self, **kwargs) -> pandas.DataFrame:
+        return await self._get("v3/operatorclassification", **kwargs)
+
+    async def fetch_pipeline_scrape_status(self, **kwargs) -> pandas.DataFrame:
+        return await self._get("v3/pipelinescrapestatus", **kwargs)
+
+    async def fetch_til_monitoring(self, **kwargs) -> pandas.DataFrame:
+        return await self._get("v3/til_monitoring", **kwargs)
+
+    async def fetch_forecast_run_dates(self, **kwargs) -> pandas.DataFrame:
+        return await self._get("v3/shorttermforecasthistorydates", **kwargs)
+
+    # POST
+
+    async def _post(self, endpoint: str, payload: ApiPayload, **kwargs) -> pandas.DataFrame:
+        """
+        Query a paginated endpoint.
+
+        :param endpoint: path of the endpoint, relative to the api root
+        :param payload: query filters
+        :param kwargs: ``use_cache``, ``refresh_cache`` or ``schema``
+        :return: pandas.DataFrame
+        :raises QueryPlanError: for unknown filters or inverted date ranges, before anything is sent
+        """
+        problems = validate_payload(payload)
+        if problems:
+            raise QueryPlanError(problems)
+        if self.typed_columns:
+            kwargs.setdefault('schema', endpoint_schema(endpoint))
+        return await self.api_client.post_async(f"{self._base_uri}/{endpoint}", payload=payload, **kwargs)
+
+    async def daily_fracked_feet(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/dailyfrackedfeet", payload, **kwargs)
+
+    async def long_term_forecast(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/longtermforecast", payload, **kwargs)
+
+    async def well_completion(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/completions", payload, **kwargs)
+
+    async def ducs_by_operator(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/ducsbyoperator", payload, **kwargs)
+
+    async def frac_crews(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/fraccrews", payload, **kwargs)
+
+    async def production_by_well(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/productionbywell", payload, **kwargs)
+
+    async def rigs(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/rigs", payload, **kwargs)
+
+    async def wells(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/wells", payload, **kwargs)
+
+    async def short_term_forecast(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/shorttermforecast", payload, **kwargs)
+
+    async def short_term_forecast_history(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/shorttermforecasthistory", payload, **kwargs)
+
+    async def short_term_forecast_declines(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/shorttermforecastdeclines", payload, **kwargs)
+
+    async def daily_production(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/dailyproduction", payload, **kwargs)
+
+    async def pipeline_scrapes(self, payload: ApiPayload = ApiPayload(), **kwargs) -> pandas.DataFrame:
+        return await self._post("v3/pipelinescrapes", payload, **kwargs)
+
+    def iter_pages(self, endpoint: str, payload: ApiPayload, read_ahead: int = PARALLEL_REQUESTS,
+                   **kwargs) -> AsyncIterator[pandas.DataFrame]:
+        """
+        Stream a paginated endpoint, one DataFrame per page in page order.
+
+        >>> async for df in client.iter_pages('production_by_well', payload):
+        ...     ...
+
+        :param endpoint: name of a paginated method, e.g. 'production_by_well'
+        :param payload: query filters
+        :param read_ahead: number of pages requested ahead of the consumer
+        :param kwargs: ``schema``, or ``ordered=False`` to get each page as soon as it arrives
+        """
+        path = _ENDPOINTS[endpoint]
+        if self.typed_columns:
+            kwargs.setdefault('schema', endpoint_schema(path))
+        return self.api_client.iter_pages_async(f"{self._base_uri}/{path}", payload=payload, read_ahead=read_ahead,
+                                                **kwargs)
+
+
+# paginated methods and their paths
+_ENDPOINTS = {
+    'daily_fracked_feet': 'v3/dailyfrackedfeet',
+    'long_term_forecast': 'v3/longtermforecast',
+    'well_completion': 'v3/completions',
+    'ducs_by_operator': 'v3/ducsbyoperator',
+    'frac_crews': 'v3/fraccrews',
+    'production_by_well': 'v3/productionbywell',
+    'rigs': 'v3/rigs',
+    'wells': 'v3/wells',
+    'short_term_forecast': 'v3/shorttermforecast',
+    'short_term_forecast_history': 'v3/shorttermforecasthistory',
+    'short_term_forecast_declines': 'v3/shorttermforecastdeclines',
+    'daily_production': 'v3/dailyproduction',
+    'pipeline_scrapes': 'v3/pipelinescrapes',
+}
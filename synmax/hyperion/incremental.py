@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Tuple, Optional
+
+from synmax.common.cache import write_frame, find_frame, read_frame, canonical_payload
+from synmax.common.frames import concat_frames
+from synmax.common.lazy import LazyModule
+from synmax.common.metrics import ATTRS_KEY
+from synmax.common.model import PayloadModelBase
+
+pandas = LazyModule('pandas')
+
+LOGGER = logging.getLogger(__name__)
+
+_default_store_dir = os.path.join(Path.home(), '.cache', 'synmax', 'incremental')
+
+DateRange = Tuple[datetime.date, datetime.date]
+
+
+def as_date(value) -> datetime.date:
+    """Date of a date, datetime or ISO formatted string."""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def merge_ranges(ranges: List[DateRange]) -> List[DateRange]:
+    """Union of inclusive date ranges, sorted, with touching ranges joined."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + datetime.timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(requested: DateRange, covered: List[DateRange]) -> List[DateRange]:
+    """Parts of the inclusive ``requested`` range not in any of the ``covered`` ranges."""
+    start, end = requested
+    missing = []
+    for covered_start, covered_end in merge_ranges(covered):
+        if covered_end < start or covered_start > end:
+            continue
+        if covered_start > start:
+            missing.append((start, covered_start - datetime.timedelta(days=1)))
+        start = max(start, covered_end + datetime.timedelta(days=1))
+    if start <= end:
+        missing.append((start, end))
+    return missing
+
+
+class IncrementalStore:
+    """
+    Local copies of date ranged query results, one per endpoint and set of filters, together with the date
+    ranges already fetched.
+    """
+
+    def __init__(self, directory: str = None):
+        """
+
+        :param directory: store folder, defaults to ~/.cache/synmax/incremental
+        """
+        self.directory = os.path.expanduser(directory or _default_store_dir)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return f'IncrementalStore(directory={self.directory!r})'
+
+    @staticmethod
+    def key(endpoint: str, payload: PayloadModelBase, scope: str = None) -> str:
+        """Dataset key, the filters of ``payload`` except its date range."""
+        filters = canonical_payload(payload.copy_with(start_date=None, end_date=None))
+        raw = '\n'.join([scope or '', endpoint, filters])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path_stem(self, key) -> str:
+        return os.path.join(self.directory, key)
+
+    def load(self, key: str) -> Tuple[Optional[pandas.DataFrame], List[DateRange]]:
+        """
+        Stored dataset and the date ranges it covers, (None, []) when nothing was stored yet.
+        """
+        meta_path = self._path_stem(key) + '.json'
+        path = find_frame(self._path_stem(key))
+        if path is None or not os.path.exists(meta_path):
+            return None, []
+
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        ranges = [(as_date(start), as_date(end)) for start, end in meta['ranges']]
+        return read_frame(path), ranges
+
+    def save(self, key: str, df: pandas.DataFrame, ranges: List[DateRange], **meta):
+        write_frame(df, self._path_stem(key))
+        meta['ranges'] = [(str(start), str(end)) for start, end in merge_ranges(ranges)]
+        meta_path = self._path_stem(key) + '.json'
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def clear(self, key: str):
+        for path in (find_frame(self._path_stem(key)), self._path_stem(key) + '.json'):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+
+def _in_ranges(dates: pandas.Series, ranges: List[DateRange]) -> pandas.Series:
+    mask = pandas.Series(False, index=dates.index)
+    for start, end in ranges:
+        mask |= (dates >= pandas.Timestamp(start)) & (dates <= pandas.Timestamp(end))
+    return mask
+
+
+def fetch_incremental(query, endpoint: str, payload: PayloadModelBase, store: IncrementalStore,
+                      lookback_days: int = 7, date_column: str = 'date', key_columns: List[str] = None,
+                      scope: str = None) -> pandas.DataFrame:
+    """
+    Bring the stored copy of a date ranged query up to date and return the requested window.
+
+    Only the dates not fetched before are requested, plus the last ``lookback_days`` of what was stored so that
+    restated values are picked up. Rows of re-fetched dates replace the stored ones. A date range whose fetch failed,
+    e.g. the api answered 401, is not recorded as fetched: its stored rows are kept and it is requested again on the
+    next refresh.
+
+    :param query: callable taking a payload and returning a DataFrame, e.g. ``client.daily_production``
+    :param endpoint: name of the endpoint, part of the dataset key
+    :param payload: filters, ``start_date`` is required, ``end_date`` defaults to today
+    :param store: where the datasets are kept
+    :param lookback_days: days before the end of the stored data fetched again on every refresh
+    :param date_column: column holding the date of each row
+    :param key_columns: (optional) natural key, rows with the same key keep the latest value
+    :param scope: (optional) e.g. the access key, datasets are not shared across scopes
+    :return: pandas.DataFrame of the requested window
+    """
+    if payload.start_date is None:
+        raise ValueError('Incremental fetch needs a start_date')
+    requested = (as_date(payload.start_date), as_date(payload.end_date or datetime.date.today()))
+
+    key = store.key(endpoint, payload, scope=scope)
+    stored_df, covered = store.load(key)
+
+    to_fetch = missing_ranges(requested, covered)
+    if covered and lookback_days > 0:
+        covered_end = merge_ranges(covered)[-1][1]
+        restated = (max(requested[0], covered_end - datetime.timedelta(days=lookback_days - 1)),
+                    min(requested[1], covered_end))
+        if restated[0] <= restated[1]:
+            to_fetch = merge_ranges(to_fetch + [restated])
+
+    LOGGER.info('Incremental fetch of %s, date ranges to fetch: %s', endpoint, to_fetch)
+    frames, fetched = [], []
+    for start, end in to_fetch:
+        df = query(payload.copy_with(start_date=start, end_date=end, pagination_start=0), use_cache=False)
+        if df is None or not df.attrs.get(ATTRS_KEY, {}).get('complete', True):
+            LOGGER.error('Fetching %s from %s to %s failed, the range is fetched again on the next refresh',
+                         endpoint, start, end)
+            continue
+        fetched.append((start, end))
+        if not df.empty:
+            frames.append(df)
+
+    if stored_df is not None and fetched:
+        # fetched windows are complete, drop what they replace
+        stored_df = stored_df[~_in_ranges(pandas.to_datetime(stored_df[date_column]), fetched)]
+    if stored_df is not None:
+        frames.insert(0, stored_df)
+
+    df = concat_frames(frames)
+    if key_columns and not df.empty:
+        df = df.drop_duplicates(subset=key_columns, keep='last', ignore_index=True)
+
+    if fetched:
+        store.save(key, df, covered + fetched, endpoint=endpoint)
+
+    if df.empty:
+        return df
+    window = _in_ranges(pandas.to_datetime(df[date_column]), [requested])
+    return df[window].reset_index(drop=True)
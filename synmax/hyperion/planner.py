@@ -0,0 +1,150 @@
+import datetime
+import difflib
+import logging
+from typing import Dict, List, Optional
+
+from synmax.common.model import PayloadModelBase
+from .incremental import as_date
+from .reference import ReferenceData
+from .sharding import SHARDABLE_FILTERS, _as_list
+
+LOGGER = logging.getLogger(__name__)
+
+STRATEGIES = ('single_page', 'sequential', 'concurrent', 'sharded', 'streamed')
+
+US_STATE_CODES = frozenset((
+    'AK', 'AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DC', 'DE', 'FL', 'GA', 'HI', 'IA', 'ID', 'IL', 'IN', 'KS', 'KY', 'LA',
+    'MA', 'MD', 'ME', 'MI', 'MN', 'MO', 'MS', 'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM', 'NV', 'NY', 'OH', 'OK', 'OR',
+    'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VA', 'VT', 'WA', 'WI', 'WV', 'WY',
+))
+
+# filter -> (reference dataset, column) its values are checked against
+_REFERENCE_FILTERS = {
+    'region': ('regions', 'region'),
+    'sub_region': ('regions', 'sub_region'),
+}
+_operator_columns = ('operator_name', 'operator')
+
+
+class QueryPlanError(ValueError):
+    """A query rejected before it was sent: invalid filters or a result over the size limit."""
+
+    def __init__(self, problems: List[str]):
+        super().__init__('; '.join(problems))
+        self.problems = problems
+
+
+def _unknown_values(name: str, values, known) -> Optional[str]:
+    """Problem message for the values of filter ``name`` not in ``known``, compared case insensitively."""
+    by_upper = {str(value).upper(): value for value in known}
+    unknown = [value for value in values if str(value).upper() not in by_upper]
+    if not unknown:
+        return None
+    hints = []
+    for value in unknown:
+        matches = difflib.get_close_matches(str(value).upper(), by_upper, n=1)
+        hints.append(f'{value!r}' + (f' (did you mean {by_upper[matches[0]]!r}?)' if matches else ''))
+    return f'Unknown {name} {", ".join(hints)}'
+
+
+def validate_payload(payload: PayloadModelBase, reference: ReferenceData = None) -> List[str]:
+    """
+    Problems of the filters of ``payload`` that would make the api ignore them or return nothing.
+
+    Without ``reference`` only unknown filter names and inverted date ranges are checked, the filters the api would
+    silently ignore or answer with nothing. With it, state codes are checked too, and regions and sub regions
+    against the regions reference data. Operators missing from the operator classification are only logged, the
+    classification does not list every operator.
+
+    :param payload: query filters
+    :param reference: (optional) reference data of the client, loaded when needed
+    :return: list of problems, empty when the filters are valid
+    """
+    problems = []
+    unknown_fields = getattr(payload, 'unknown_fields', ())
+    if unknown_fields:
+        known = sorted(getattr(type(payload), 'model_fields', None) or type(payload).__fields__)
+        problems.append(_unknown_values('filter', unknown_fields, known) + ', these filters would be ignored')
+
+    try:
+        start_date = as_date(payload.start_date) if payload.start_date is not None else None
+        end_date = as_date(payload.end_date) if payload.end_date is not None else None
+    except ValueError as e:
+        problems.append(f'Invalid date: {e}')
+    else:
+        if start_date and end_date and start_date > end_date:
+            problems.append(f'start_date {start_date} is after end_date {end_date}')
+        if start_date and start_date > datetime.date.today():
+            LOGGER.warning('start_date %s is in the future', start_date)
+
+    if reference is None:
+        return problems
+
+    problem = _unknown_values('state_code', _as_list(payload.state_code), US_STATE_CODES)
+    if problem:
+        problems.append(problem)
+    for name, (dataset, column) in _REFERENCE_FILTERS.items():
+        values = _as_list(getattr(payload, name, None))
+        if values:
+            problem = _unknown_values(name, values, reference.values(dataset, column))
+            if problem:
+                problems.append(problem)
+
+    operators = _as_list(payload.operator)
+    if operators:
+        columns = reference.get('operator_classification').columns
+        column = next((column for column in _operator_columns if column in columns), None)
+        if column is not None:
+            problem = _unknown_values('operator', operators, reference.values('operator_classification', column))
+            if problem:
+                LOGGER.warning('%s in the operator classification, the query may return nothing', problem)
+    return problems
+
+
+class QueryPlan:
+    """
+    How a query is going to run: its size, estimated from the ``total_count`` of its first page, and the strategy
+    chosen for that size. Returned by ``HyperionApiClient.plan`` and run with ``HyperionApiClient.execute``.
+    """
+
+    def __init__(self, endpoint: str, payload: PayloadModelBase, first_page: Optional[Dict], strategy: str):
+        self.endpoint = endpoint
+        self.payload = payload
+        # json body of the first page, reused when it is the whole result
+        self.first_page = first_page
+        self.strategy = strategy
+        pagination = (first_page or {}).get('pagination') or {}
+        self.total_count: int = pagination.get('total_count', 0)
+        self.page_size: int = pagination.get('page_size', 0)
+        self.total_pages: int = -(-self.total_count // self.page_size) if self.page_size else 1
+
+    def __repr__(self):
+        return (f'QueryPlan(endpoint={self.endpoint!r}, strategy={self.strategy!r}, total_count={self.total_count}, '
+                f'total_pages={self.total_pages})')
+
+
+def choose_strategy(total_count: int, page_size: int, payload: PayloadModelBase, sequential_pages: int = 2,
+                    shard_rows: Optional[int] = 2000000, stream_rows: Optional[int] = None) -> str:
+    """
+    Execution strategy of a query of ``total_count`` rows:
+
+    - 'single_page': the first page, already fetched, is the whole result
+    - 'sequential': up to ``sequential_pages`` pages, fetched one after another without the overhead of the
+      concurrent client
+    - 'streamed': ``stream_rows`` rows or more, pages are yielded as they arrive instead of held in memory
+    - 'sharded': ``shard_rows`` rows or more and a filter with several values, one concurrent query per value
+    - 'concurrent': otherwise, pages fetched concurrently
+
+    :return: one of :data:`STRATEGIES`
+    """
+    total_pages = -(-total_count // page_size) if page_size else 1
+    if total_pages <= 1:
+        return 'single_page'
+    if total_pages <= sequential_pages:
+        return 'sequential'
+    if stream_rows is not None and total_count >= stream_rows:
+        return 'streamed'
+    if shard_rows is not None and total_count >= shard_rows and any(
+            len(_as_list(getattr(payload, name, None))) > 1 for name in SHARDABLE_FILTERS):
+        return 'sharded'
+    return 'concurrent'
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, Hashable, List, Mapping, Optional, Tuple, Union
+
+from synmax.common.cache import find_frame, read_frame, write_frame
+from synmax.common.lazy import LazyModule
+
+pandas = LazyModule('pandas')
+
+LOGGER = logging.getLogger(__name__)
+
+# reference dataset name -> (endpoint, seconds the dataset stays fresh)
+REFERENCE_DATASETS: Dict[str, Tuple[str, float]] = {
+    'regions': ('v3/regions', 24 * 3600),
+    'operator_classification': ('v3/operatorclassification', 24 * 3600),
+    'dtils': ('v3/dtils', 3600),
+    'forecast_run_dates': ('v3/shorttermforecasthistorydates', 3600),
+    'pipeline_scrape_status': ('v3/pipelinescrapestatus', 600),
+    'til_monitoring': ('v3/til_monitoring', 3600),
+}
+
+# columns naming an operator in the operator classification, by preference
+_operator_columns = ('operator_name', 'operator')
+_classification_columns = ('operator_classification', 'classification')
+
+# (endpoint, ETag, Last-Modified) -> (HTTP status, json body or None, response headers)
+Loader = Callable[[str, Optional[str], Optional[str]], Tuple[int, Optional[Dict], Mapping[str, str]]]
+
+
+class _Dataset:
+    __slots__ = ('df', 'fetched', 'etag', 'last_modified', 'indexes')
+
+    def __init__(self, df: pandas.DataFrame, fetched: float, etag: str = None, last_modified: str = None):
+        self.df = df
+        self.fetched = fetched
+        self.etag = etag
+        self.last_modified = last_modified
+        # lookups built from df, dropped with it
+        self.indexes: Dict[tuple, object] = {}
+
+
+class ReferenceData:
+    """
+    Reference datasets of the api (regions, operator classification, forecast run dates, ...), each loaded on first
+    use and kept in memory, and on disk with ``directory``, for the ttl of its endpoint.
+
+    Once a dataset is older than its ttl it is revalidated with a conditional request (``If-None-Match`` /
+    ``If-Modified-Since``): an unchanged dataset costs a 304 without body. When the revalidation fails, the stale
+    copy is served. Lookups such as :meth:`sub_regions` or :meth:`operator_classification` use indexes built once
+    per version of a dataset, so repeated lookups do not touch the network.
+    """
+
+    def __init__(self, loader: Loader, ttl: Union[float, Dict[str, float]] = None, directory: str = None,
+                 scope: str = None):
+        """
+
+        :param loader: sends the, conditional, GET of an endpoint
+        :param ttl: (optional) seconds a dataset stays fresh, for all datasets or per dataset name, defaults to
+            the ttl of :data:`REFERENCE_DATASETS`
+        :param directory: (optional) folder keeping a copy of the datasets across processes
+        :param scope: (optional) e.g. the access key, copies on disk are not shared across scopes
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.directory = os.path.expanduser(directory) if directory else None
+        self._scope = hashlib.sha256((scope or '').encode('utf-8')).hexdigest()[:16]
+        self._datasets: Dict[str, _Dataset] = {}
+        self._lock = threading.RLock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return f'ReferenceData(loaded={sorted(self._datasets)}, directory={self.directory!r})'
+
+    def ttl_of(self, name: str) -> float:
+        if isinstance(self.ttl, dict):
+            if name in self.ttl:
+                return self.ttl[name]
+        elif self.ttl is not None:
+            return self.ttl
+        return REFERENCE_DATASETS[name][1]
+
+    def _path_stem(self, name: str) -> str:
+        return os.path.join(self.directory, f'{name}-{self._scope}')
+
+    def _read_disk(self, name: str) -> Optional[_Dataset]:
+        if not self.directory:
+            return None
+        stem = self._path_stem(name)
+        path = find_frame(stem)
+        if path is None:
+            return None
+        try:
+            with open(f'{stem}.json') as f:
+                meta = json.load(f)
+            return _Dataset(read_frame(path), meta['fetched'], meta.get('etag'), meta.get('last_modified'))
+        except (OSError, ValueError, KeyError) as e:
+            LOGGER.warning('Ignoring unreadable reference data %s: %s', path, e)
+            return None
+
+    def _write_disk(self, name: str, dataset: _Dataset, frame=True):
+        if not self.directory:
+            return
+        stem = self._path_stem(name)
+        if frame:
+            write_frame(dataset.df, stem)
+        tmp_path = f'{stem}.json.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'fetched': dataset.fetched, 'etag': dataset.etag, 'last_modified': dataset.last_modified}, f)
+        os.replace(tmp_path, f'{stem}.json')
+
+    def _dataset(self, name: str, refresh=False) -> Optional[_Dataset]:
+        if name not in REFERENCE_DATASETS:
+            raise KeyError(f'Unknown reference dataset {name}, use one of {sorted(REFERENCE_DATASETS)}')
+        with self._lock:
+            dataset = self._datasets.get(name)
+            if dataset is None:
+                dataset = self._read_disk(name)
+                if dataset is not None:
+                    self._datasets[name] = dataset
+            if dataset is not None and not refresh and time.time() - dataset.fetched < self.ttl_of(name):
+                return dataset
+
+            endpoint = REFERENCE_DATASETS[name][0]
+            try:
+                status, json_result, headers = self.loader(endpoint, dataset and dataset.etag,
+                                                           dataset and dataset.last_modified)
+            except Exception as e:
+                if dataset is None:
+                    raise
+                LOGGER.warning('Could not revalidate %s, using the copy of %s: %s', name,
+                               time.ctime(dataset.fetched), e)
+                return dataset
+
+            if status == 304 and dataset is not None:
+                LOGGER.debug('Reference data %s not modified', name)
+                dataset.fetched = time.time()
+                self._write_disk(name, dataset, frame=False)
+                return dataset
+            if json_result is None:
+                # error already logged by the client
+                return dataset
+
+            headers = headers or {}
+            dataset = _Dataset(pandas.DataFrame(json_result['data']), time.time(), headers.get('ETag'),
+                               headers.get('Last-Modified'))
+            self._datasets[name] = dataset
+            self._write_disk(name, dataset)
+            LOGGER.info('Loaded reference data %s: %s rows', name, len(dataset.df))
+            return dataset
+
+    def get(self, name: str, refresh=False) -> pandas.DataFrame:
+        """
+        Dataset ``name`` of :data:`REFERENCE_DATASETS`, loaded or revalidated when needed. The frame is shared,
+        copy it before modifying it.
+
+        :param name:
+        :param refresh: revalidate even if the dataset is still fresh
+        :return: pandas.DataFrame, empty when the api answered with an error
+        """
+        dataset = self._dataset(name, refresh)
+        return dataset.df if dataset is not None else pandas.DataFrame()
+
+    def invalidate(self, name: str = None):
+        """Forget dataset ``name``, or all of them, in memory. Copies on disk are revalidated on next use."""
+        with self._lock:
+            for key in ([name] if name else list(self._datasets)):
+                dataset = self._datasets.pop(key, None)
+                if dataset is not None and self.directory:
+                    dataset.fetched = 0
+                    self._write_disk(key, dataset, frame=False)
+
+    def _index(self, name: str, kind: str, columns: tuple, build):
+        dataset = self._dataset(name)
+        if dataset is None:
+            return build(pandas.DataFrame(columns=list(columns)))
+        key = (kind,) + columns
+        index = dataset.indexes.get(key)
+        if index is None:
+            missing = [column for column in columns if column is not None and column not in dataset.df.columns]
+            if missing:
+                raise KeyError(f'Columns {missing} are not in {name}, available: {list(dataset.df.columns)}')
+            index = dataset.indexes[key] = build(dataset.df)
+        return index
+
+    def index(self, name: str, key_column: str, value_column: str = None) -> Dict[Hashable, object]:
+        """
+        Dict of the values of ``key_column`` to ``value_column``, or to the row as a dict, the last row wins for
+        duplicated keys.
+        """
+        def build(df):
+            if value_column is not None:
+                return dict(zip(df[key_column], df[value_column]))
+            return {row[key_column]: row for row in df.to_dict('records')}
+        return self._index(name, 'index', (key_column, value_column), build)
+
+    def groups(self, name: str, key_column: str, value_column: str) -> Dict[Hashable, List]:
+        """Dict of the values of ``key_column`` to the sorted distinct values of ``value_column``."""
+        def build(df):
+            grouped = df.dropna(subset=[value_column]).groupby(key_column, sort=False)[value_column].unique()
+            return {key: sorted(values) for key, values in grouped.items()}
+        return self._index(name, 'groups', (key_column, value_column), build)
+
+    def values(self, name: str, column: str) -> FrozenSet:
+        """Distinct values of ``column``, e.g. to validate filters."""
+        return self._index(name, 'values', (column,), lambda df: frozenset(df[column].dropna()))
+
+    # lookups
+
+    def regions(self) -> List[str]:
+        return sorted(self.values('regions', 'region'))
+
+    def sub_regions(self, region: str = None) -> List[str]:
+        """Sub regions of ``region``, or all of them."""
+        if region is None:
+            return sorted(self.values('regions', 'sub_region'))
+        return self.groups('regions', 'region', 'sub_region').get(region, [])
+
+    def _column(self, name: str, candidates) -> str:
+        columns = self.get(name).columns
+        for column in candidates:
+            if column in columns:
+                return column
+        raise KeyError(f'None of {list(candidates)} in {name}, available: {list(columns)}')
+
+    def operator_classification(self, operator: str) -> Optional[str]:
+        """Classification of ``operator``, None for unknown operators."""
+        index = self.index('operator_classification', self._column('operator_classification', _operator_columns),
+                           self._column('operator_classification', _classification_columns))
+        return index.get(operator)
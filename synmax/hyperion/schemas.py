@@ -0,0 +1,93 @@
+# Column dtypes of the v3 endpoints: dates become datetime64, repeated strings categoricals and counters nullable
+# integers. Volumes stay float64, float32 would round them. Columns not listed are inferred, and a listed column
+# whose values do not fit its dtype falls back to inference.
+from typing import Dict
+
+from synmax.common.frames import Schema
+
+DATE = 'datetime64[ns]'
+CATEGORY = 'category'
+FLOAT = 'float64'
+INT32 = 'Int32'
+INT64 = 'Int64'
+
+# columns shared by most endpoints
+_COMMON: Schema = {
+    'date': DATE,
+    'state_ab': CATEGORY,
+    'state_code': CATEGORY,
+    'county': CATEGORY,
+    'region': CATEGORY,
+    'sub_region': CATEGORY,
+    'operator': CATEGORY,
+    'operator_name': CATEGORY,
+    'operator_classification': CATEGORY,
+    'api': INT64,
+}
+
+_PRODUCTION: Schema = {
+    'production_month': INT32,
+    'first_production_month': DATE,
+    'gas_monthly': FLOAT,
+    'oil_monthly': FLOAT,
+    'water_monthly': FLOAT,
+    'gas_daily': FLOAT,
+    'oil_daily': FLOAT,
+    'water_daily': FLOAT,
+}
+
+_FORECAST: Schema = {
+    'forecast_run_date': DATE,
+    'gas_daily': FLOAT,
+    'oil_daily': FLOAT,
+    'gas_monthly': FLOAT,
+    'oil_monthly': FLOAT,
+}
+
+_ACTIVITY: Schema = {
+    'service_company': CATEGORY,
+    'rig_class': CATEGORY,
+    'frac_class': CATEGORY,
+    'completion_class': CATEGORY,
+    'category': CATEGORY,
+    'spud_date': DATE,
+    'completion_date': DATE,
+    'first_seen_date': DATE,
+    'last_seen_date': DATE,
+}
+
+
+def _schema(*parts: Schema) -> Schema:
+    schema = dict(_COMMON)
+    for part in parts:
+        schema.update(part)
+    return schema
+
+
+ENDPOINT_SCHEMAS: Dict[str, Schema] = {
+    'v3/dailyfrackedfeet': _schema(_ACTIVITY, {'fracked_feet': FLOAT}),
+    'v3/longtermforecast': _schema(_FORECAST),
+    'v3/completions': _schema(_ACTIVITY),
+    'v3/ducsbyoperator': _schema({'ducs': INT32}),
+    'v3/fraccrews': _schema(_ACTIVITY),
+    'v3/productionbywell': _schema(_PRODUCTION),
+    'v3/rigs': _schema(_ACTIVITY, {'rig_count': INT32}),
+    'v3/wells': _schema(_ACTIVITY, _PRODUCTION),
+    'v3/shorttermforecast': _schema(_FORECAST),
+    'v3/shorttermforecasthistory': _schema(_FORECAST),
+    'v3/shorttermforecastdeclines': _schema(_FORECAST, {'production_month': INT32}),
+    'v3/dailyproduction': _schema(_PRODUCTION),
+    'v3/pipelinescrapes': _schema({
+        'pipeline_name': CATEGORY,
+        'point_name': CATEGORY,
+        'flow_direction': CATEGORY,
+        'scheduled_volume': FLOAT,
+        'design_capacity': FLOAT,
+        'operational_capacity': FLOAT,
+    }),
+}
+
+
+def endpoint_schema(endpoint: str) -> Schema:
+    """Column dtypes of ``endpoint``, empty for endpoints without a schema."""
+    return ENDPOINT_SCHEMAS.get(endpoint.strip('/'), {})
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import datetime
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union, Callable
+
+from synmax.common.frames import concat_frames
+from synmax.common.lazy import LazyModule
+from synmax.common.model import PayloadModelBase
+from .incremental import as_date
+
+pandas = LazyModule('pandas')
+
+LOGGER = logging.getLogger(__name__)
+
+# list valued filters a query can be split on
+SHARDABLE_FILTERS = ('state_code', 'region', 'sub_region', 'county', 'operator', 'api')
+DATE_SHARD = 'date'
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+
+def date_windows(start_date, end_date, window_days: int) -> List[tuple]:
+    """Split the inclusive range ``start_date`` - ``end_date`` into consecutive windows of ``window_days``."""
+    start, end = as_date(start_date), as_date(end_date)
+    windows = []
+    while start <= end:
+        window_end = min(end, start + datetime.timedelta(days=window_days - 1))
+        windows.append((start, window_end))
+        start = window_end + datetime.timedelta(days=1)
+    return windows
+
+
+def _default_shard_by(payload: PayloadModelBase) -> List[str]:
+    sizes = {name: len(_as_list(getattr(payload, name))) for name in SHARDABLE_FILTERS}
+    name, size = max(sizes.items(), key=lambda item: item[1])
+    if size > 1:
+        return [name]
+    if payload.start_date is not None:
+        return [DATE_SHARD]
+    return []
+
+
+def shard_payload(payload: PayloadModelBase, shard_by: Union[str, List[str]] = None,
+                  window_days: int = 365) -> List[PayloadModelBase]:
+    """
+    Split a query into queries returning disjoint parts of its result.
+
+    :param payload: query filters
+    :param shard_by: (optional) filter name(s) from :data:`SHARDABLE_FILTERS`, one shard per value, and/or
+        'date' for one shard per ``window_days`` between ``start_date`` and ``end_date``. Defaults to the
+        filter with the most values, or to 'date' when no filter has more than one value.
+    :param window_days: size of the date windows
+    :return: list of payloads
+    """
+    shard_by = _default_shard_by(payload) if shard_by is None else _as_list(shard_by)
+
+    dimensions = []
+    for name in shard_by:
+        if name == DATE_SHARD:
+            if payload.start_date is None:
+                raise ValueError('Sharding by date needs a start_date')
+            windows = date_windows(payload.start_date, payload.end_date or datetime.date.today(), window_days)
+            dimensions.append([{'start_date': start, 'end_date': end} for start, end in windows])
+        elif name in SHARDABLE_FILTERS:
+            values = _as_list(getattr(payload, name))
+            if values:
+                dimensions.append([{name: [value]} for value in values])
+        else:
+            raise ValueError(f'Can not shard on {name}, use one of {SHARDABLE_FILTERS + (DATE_SHARD,)}')
+
+    shards = []
+    for combination in itertools.product(*dimensions):
+        update = {'pagination_start': 0}
+        for part in combination:
+            update.update(part)
+        shards.append(payload.copy_with(**update))
+    return shards
+
+
+def _deduplicate(df: pandas.DataFrame, key_columns: List[str] = None) -> pandas.DataFrame:
+    try:
+        return df.drop_duplicates(subset=key_columns, ignore_index=True)
+    except TypeError:
+        # unhashable cell values, e.g. lists
+        LOGGER.debug('Skipping de-duplication of unhashable rows')
+        return df
+
+
+def run_sharded(query: Callable, shards: List[PayloadModelBase], max_workers: int = 4,
+                key_columns: List[str] = None, **kwargs) -> pandas.DataFrame:
+    """
+    Run ``query`` on every shard concurrently and merge the results.
+
+    :param query: callable taking a payload and returning a DataFrame, e.g. ``client.rigs``
+    :param shards: payloads from :func:`shard_payload`
+    :param max_workers: shards queried at the same time
+    :param key_columns: (optional) columns identifying a row when dropping duplicates, all columns by default
+    :param kwargs: passed to ``query``
+    :return: pandas.DataFrame
+    """
+    LOGGER.info('Querying %s shards with %s workers', len(shards), max_workers)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='synmax-shard') as executor:
+        # map keeps the order of the shards
+        frames = [df for df in executor.map(lambda shard: query(shard, **kwargs), shards)
+                  if df is not None and not df.empty]
+
+    if not frames:
+        return pandas.DataFrame()
+    return _deduplicate(concat_frames(frames), key_columns)
@@ -1,15 +1,48 @@
+import importlib.util
+import json
 import logging
+import asyncio
+import gzip
 import multiprocessing
 
 import pandas
+import pytest
 import pandas as pd
 from tqdm import tqdm
 import os 
+import subprocess
 import sys
+import threading
+import time
+import zlib
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)))))
+# local mock of the api, for the tests that need no access token
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'benchmarks')))
 
-from synmax.hyperion import HyperionApiClient, ApiPayload, add_daily, get_fips
+from synmax.hyperion import HyperionApiClient, AsyncHyperionApiClient, ApiPayload, add_daily, get_fips, attach_fips
+from synmax.hyperion.sharding import shard_payload
+from synmax.hyperion.incremental import IncrementalStore, fetch_incremental
+from synmax.hyperion.schemas import endpoint_schema
+from synmax.hyperion.reference import ReferenceData
+from synmax.hyperion.planner import QueryPlanError, choose_strategy, validate_payload
+from synmax.hyperion.aggregation import StreamingAggregator, server_aggregate_by
+from synmax.common import cache, decoder, frames, spool as spool_module
+from synmax.common.cache import ResponseCache
+from synmax.common.frames import frame_from_records
+from synmax.common.metrics import ATTRS_KEY, MetricsCollector, RequestMetrics
+from synmax.common.sinks import ParquetSink
+from synmax.common.spool import PageSpool
+from synmax.common.process_pool import split_pages
+from synmax.common.rate_limiter import AdaptiveRateLimiter
+from synmax.common.shared_limiter import SharedRateLimiter
+from synmax.common.retry import RetryPolicy, CircuitBreaker, RetryBudget, retry_after
+from synmax.common.api_client import ApiClient, ApiClientAsync, ApiClientBase
+from synmax.common.compression import StreamDecoder, available_encodings
+from synmax.common.transport import AiohttpTransport, HttpxTransport, get_transport
+from synmax.common.metrics import current_query
+from synmax.common.retry import current_budget
+from mock_server import MockHyperionServer, make_row
 
 logging.basicConfig(level=logging.INFO)
 
@@ -35,7 +68,7 @@ def fetch_daily_fracked_feet():
 # Test - POST 
 
 def well_completion():
-    payload = ApiPayload(start_date='2021-05-1', end_date='2022-12-25', state_code='CO', operator_name='GREAT WESTERN OPERATING COMPANY LLC')
+    payload = ApiPayload(start_date='2021-05-1', end_date='2022-12-25', state_code='CO', operator='GREAT WESTERN OPERATING COMPANY LLC')
 
     # result_df = client.wells(payload)
     result_df = client.well_completion(payload)
@@ -57,6 +90,69 @@ def test_rigs():
         print(df.count())
 
 
+def _mock_client(server: MockHyperionServer, **kwargs) -> HyperionApiClient:
+    """Client of the mock server ``server``."""
+    client = HyperionApiClient(access_token='x', local_server=True, **kwargs)
+    client._base_uri = f'{server.url}/'
+    return client
+
+
+def test_rigs_sharded():
+    payload = ApiPayload(start_date='2016-01-01', end_date='2022-01-31', state_code=['ND', 'NM', 'TX'])
+    with MockHyperionServer(total_count=6000) as server:
+        client = _mock_client(server)
+        df = client.fetch_sharded('rigs', payload, shard_by='state_code')
+        requests = server.requests
+        expected = client.rigs(payload)
+
+    # one query per state, of 1200, 1200 and 600 rows
+    assert requests == 2 + 2 + 1 and len(df) == 3000
+    assert sorted(df['state_ab'].astype(str).unique()) == ['ND', 'NM', 'TX']
+    columns = ['api', 'date', 'county']
+    pd.testing.assert_frame_equal(df.sort_values(columns, ignore_index=True),
+                                  expected.sort_values(columns, ignore_index=True), check_categorical=False)
+
+
+def test_stream_pages():
+    for async_client in (True, False):
+        for read_ahead in (0, 2):
+            # total_count an exact multiple of page_size, then with a short last page
+            for total_count, sizes in ((2000, [500] * 4), (2100, [500] * 4 + [100])):
+                with MockHyperionServer(total_count=total_count, page_size=500) as server:
+                    client = _mock_client(server, async_client=async_client)
+                    pages = list(client.production_by_well(ApiPayload(), stream=True, read_ahead=read_ahead))
+                    requests = server.requests
+                assert [len(page) for page in pages] == sizes
+                assert requests == len(sizes)
+                assert pd.concat(pages)['api'].is_monotonic_increasing
+
+
+def test_async_client():
+    async def fetch(url):
+        async with AsyncHyperionApiClient(access_token='x', local_server=True) as client:
+            client._base_uri = f'{url}/'
+            wells, rigs = await asyncio.gather(client.production_by_well(ApiPayload()),
+                                               client.rigs(ApiPayload(state_code=['TX'])))
+            pages = [page async for page in client.iter_pages('production_by_well', ApiPayload(), read_ahead=2)]
+            regions = await client.fetch_regions()
+        return wells, rigs, pages, regions
+
+    with MockHyperionServer(total_count=2100, page_size=500) as server:
+        wells, rigs, pages, regions = asyncio.run(fetch(server.url))
+        client = _mock_client(server)
+        expected_wells = client.production_by_well(ApiPayload())
+        expected_rigs = client.rigs(ApiPayload(state_code=['TX']))
+        expected_regions = client.fetch_regions()
+
+    pd.testing.assert_frame_equal(wells, expected_wells)
+    pd.testing.assert_frame_equal(rigs, expected_rigs)
+    assert [len(page) for page in pages] == [500] * 4 + [100]
+    # each page has its own categories, concat turns them back into strings
+    pd.testing.assert_frame_equal(pd.concat(pages, ignore_index=True), expected_wells, check_dtype=False,
+                                  check_categorical=False)
+    pd.testing.assert_frame_equal(regions, expected_regions)
+
+
 def test_ducs_by_operator():
     payload = ApiPayload(start_date='2021-01-01', end_date='2021-01-31', aggregate_by='operator', operator='LIME ROCK RESOURCES LP')
 
@@ -65,7 +161,7 @@ def test_ducs_by_operator():
 
 
 def test_production_by_county_and_operator():
-    payload = ApiPayload(start_date='1929-04-01', end_date='1934-01-01', operator_name='Stephens Production Company', state_code='AR')
+    payload = ApiPayload(start_date='1929-04-01', end_date='1934-01-01', operator='Stephens Production Company', state_code='AR')
     result_df = client.production_by_county_and_operator(payload)
     print(result_df.count())
 
@@ -79,7 +175,7 @@ def test_frac_crews():
 
 def test_production_by_well():
     # payload = ApiPayload(start_date='2016-01-01', end_date='2016-01-31', production_month=529)
-    payload = ApiPayload(state_code='WY', start_date='2017-01-01', end_date='2017-12-31', operator_name='CITATION OIL & GAS CORP', region='west', sub_region='Wyoming')
+    payload = ApiPayload(state_code='WY', start_date='2017-01-01', end_date='2017-12-31', operator='CITATION OIL & GAS CORP', region='west', sub_region='Wyoming')
     # payload = ApiPayload(state_code='LA', start_date='2021-01-01', end_date='2021-01-01', production_month=2)
     # result_df = client.production_by_well(payload)
     # print(result_df.count())
@@ -128,6 +224,757 @@ def test_daily_func():
 
     df = add_daily(df)
     print(df)
+    assert df['gas_daily'].round(4).tolist() == [32.2581, 71.4286, 96.7742]
+
+
+def test_daily_func_not_inplace():
+    df = pd.DataFrame({'date': ['2024-02-01', '2024-03-01'], 'gas_monthly': [2900, 'n/a']})
+
+    daily_df = add_daily(df, monthly_columns=['gas_monthly'], daily_columns=['gas_daily'], inplace=False)
+    assert 'gas_daily' not in df.columns
+    assert daily_df['gas_daily'].tolist() == [100.0, 0.0]
+
+
+def test_shard_payload():
+    payload = ApiPayload(start_date='2020-01-01', end_date='2021-12-31', state_code=['CO', 'TX'])
+
+    shards = shard_payload(payload)
+    assert [shard.state_code for shard in shards] == [['CO'], ['TX']]
+
+    shards = shard_payload(payload, shard_by=['state_code', 'date'], window_days=366)
+    assert len(shards) == 4
+    assert [(str(shard.start_date), str(shard.end_date)) for shard in shards[:2]] == [
+        ('2020-01-01', '2020-12-31'), ('2021-01-01', '2021-12-31')]
+
+
+def test_typed_columns(monkeypatch):
+    records = [
+        {'date': '2021-01-01', 'state_ab': 'TX', 'api': 42329000010000, 'gas_monthly': 10.5, 'other': 'a'},
+        {'date': '2021-02-01', 'state_ab': 'NM', 'api': None, 'gas_monthly': None, 'other': 'b'},
+    ]
+    df = frame_from_records(records, endpoint_schema('v3/productionbywell'))
+    assert str(df['date'].dtype) == 'datetime64[ns]'
+    assert isinstance(df['state_ab'].dtype, pd.CategoricalDtype)
+    assert df['api'].tolist() == [42329000010000, pd.NA]
+    assert df['other'].tolist() == ['a', 'b']
+
+    # values not fitting the schema are kept as they are
+    df = frame_from_records([{'date': 'unknown'}], {'date': 'datetime64[ns]'})
+    assert df['date'].tolist() == ['unknown']
+
+    # format='ISO8601' is not known before pandas 2.0
+    monkeypatch.setattr(pd, '__version__', '1.5.3')
+    frames._iso_date_options.cache_clear()
+    try:
+        assert frames._iso_date_options() == {'infer_datetime_format': True}
+    finally:
+        frames._iso_date_options.cache_clear()
+
+
+def test_metrics_collector():
+    seen = []
+    collector = MetricsCollector(hooks=[seen.append])
+    for status in (200, 200, 429):
+        request = RequestMetrics('POST', 'https://hyperion.api.synmax.com//v3/rigs')
+        request.status, request.ttfb, request.rows = status, 0.5, 100 if status == 200 else 0
+        collector.record(request)
+
+    assert len(seen) == 3
+    summary = {row['status']: row for row in collector.summary()}
+    assert summary['200']['requests'] == 2 and summary['200']['rows'] == 200
+    assert summary['429']['mean_ttfb'] == 0.5
+    assert 'synmax_requests_total{endpoint="v3/rigs",status="429"} 1' in collector.to_prometheus()
+
+
+def test_page_spool(tmp_path):
+    spool = PageSpool(str(tmp_path))
+    url = 'https://hyperion.api.synmax.com//v3/rigs'
+    key = spool.key(url, ApiPayload(state_code='TX', pagination_start=2000), scope='token')
+    assert key == spool.key(url, ApiPayload(state_code='TX'), scope='token')
+
+    pagination = {'start': 0, 'page_size': 1000, 'total_count': 2500}
+    for start in (0, 2000):
+        spool.write_page(key, start, {'data': [{'start': start}], 'pagination': dict(pagination, start=start)},
+                         url=url)
+    assert spool.pages(key) == [0, 2000]
+    assert spool.read_page(key, 2000)['data'] == [{'start': 2000}]
+    assert spool.read_page(key, 1000) is None
+
+    # the page at 1000 is missing, the checkpoints are kept
+    spool.finish(key, total_pages=3)
+    assert spool.manifest(key)['url'] == url
+    spool.write_page(key, 1000, {'data': [], 'pagination': pagination})
+    spool.finish(key, total_pages=3)
+    assert spool.pages(key) == [] and spool.manifest(key) is None
+
+
+def test_page_spool_check(tmp_path, monkeypatch):
+    clock = _FakeClock()
+    monkeypatch.setattr(spool_module, 'time', clock)
+    spool = PageSpool(str(tmp_path), max_age=3600)
+    pagination = {'start': 0, 'page_size': 1000, 'total_count': 2500}
+    spool.write_page('key', 1000, {'data': [], 'pagination': dict(pagination, start=1000)})
+    manifest = spool.manifest('key')
+    assert (manifest['total_count'], manifest['page_size']) == (2500, 1000)
+
+    spool.check('key', pagination)
+    assert spool.pages('key') == [1000]
+    # the result grew since the pages were spooled
+    spool.check('key', dict(pagination, total_count=2600))
+    assert spool.pages('key') == [] and spool.manifest('key') is None
+
+    spool.write_page('key', 1000, {'data': [], 'pagination': dict(pagination, start=1000)})
+    clock.now += 1800
+    spool.check('key', pagination)
+    assert spool.pages('key') == [1000]
+    clock.now += 3600
+    spool.check('key', pagination)
+    assert spool.pages('key') == []
+
+    # expired queries are removed when a spool is opened
+    spool.write_page('key', 1000, {'data': [], 'pagination': dict(pagination, start=1000)})
+    clock.now += 7200
+    PageSpool(str(tmp_path), max_age=3600)
+    assert os.listdir(tmp_path) == []
+
+
+def test_page_spool_resume(tmp_path):
+    spool = PageSpool(str(tmp_path))
+    with MockHyperionServer(total_count=2100, page_size=500) as server:
+        client = _mock_client(server, spool=spool)
+        url = f'{client._base_uri}/v3/productionbywell'
+        key = client.api_client._spool_key(url, ApiPayload())
+        # pages left by an interrupted download of the same query, when it had fewer rows
+        stale = {'start': 0, 'page_size': 500, 'total_count': 1600}
+        for start in (500, 1000):
+            spool.write_page(key, start, {'data': [make_row(0)] * 500, 'pagination': dict(stale, start=start)},
+                             url=url)
+
+        df = client.production_by_well(ApiPayload())
+        assert server.requests == 5
+        expected = _mock_client(server).production_by_well(ApiPayload())
+    pd.testing.assert_frame_equal(df, expected)
+    assert spool.pages(key) == []
+
+
+def test_parquet_sink(tmp_path):
+    path = str(tmp_path / 'production_by_well.parquet')
+    with MockHyperionServer(total_count=2100, page_size=500) as server:
+        sink = _mock_client(server).production_by_well(ApiPayload(), sink=path)
+    df = pd.read_parquet(path)
+    assert sink.rows_written == len(df) == 2100 and df['api'].is_monotonic_increasing
+    # types of the endpoint schema
+    assert df['api'].dtype == 'int64' and df['production_month'].dtype == 'int32'
+    assert df['date'].dtype == 'datetime64[ns]' and df['water_monthly'].dtype == 'float64'
+
+    # other integer columns are stored as float64, a later page may hold fractional values
+    sink = ParquetSink(str(tmp_path / 'untyped.parquet'))
+    with sink:
+        sink.write_records([{'api': 1, 'count': 2}])
+        sink.write_records([{'api': 2, 'count': 2.5}])
+    assert pd.read_parquet(sink.path)['count'].tolist() == [2, 2.5]
+
+
+def test_parquet_sink_schema(tmp_path):
+    schema = endpoint_schema('v3/productionbywell')
+    sink = ParquetSink(str(tmp_path / 'production_by_well.parquet'), column_types=schema)
+    with sink:
+        # water_monthly is empty in the first page
+        sink.write_records([{'api': 1, 'date': '2023-01-01', 'water_monthly': None, 'note': None}])
+        sink.write_records([{'api': 2, 'date': '2023-02-01', 'water_monthly': 10.5, 'note': 'x'}])
+        # a column the first page did not have
+        with pytest.raises(ValueError, match='gas_monthly'):
+            sink.write_records([{'api': 3, 'date': '2023-03-01'}, {'api': 4, 'gas_monthly': 1.0}])
+    df = pd.read_parquet(sink.path)
+    assert df['water_monthly'].tolist()[1:] == [10.5] and df['water_monthly'].dtype == 'float64'
+    assert df['date'].tolist() == [pd.Timestamp('2023-01-01'), pd.Timestamp('2023-02-01')]
+    # columns without a type, empty in the first page, are stored as strings
+    assert df['note'].tolist()[1:] == ['x']
+
+
+def test_parquet_sink_partitioned(tmp_path):
+    path = str(tmp_path / 'production_by_well')
+    with MockHyperionServer(total_count=2100, page_size=500) as server:
+        sink = _mock_client(server).production_by_well(ApiPayload(), sink=path, partition_by='state_ab')
+        expected = _mock_client(server).production_by_well(ApiPayload())
+    assert sink.rows_written == 2100
+    assert sorted(os.listdir(path)) == sorted(f'state_ab={state}' for state in expected['state_ab'].unique())
+
+    df = pd.read_parquet(path)
+    assert len(df) == 2100
+    counts = df['state_ab'].astype(str).value_counts().sort_index()
+    pd.testing.assert_series_equal(counts, expected['state_ab'].astype(str).value_counts().sort_index())
+
+
+class _FakeClock:
+    """Stands for the ``time`` module of :mod:`synmax.common.cache`."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+def test_response_cache_ttl(tmp_path, monkeypatch):
+    clock = _FakeClock()
+    monkeypatch.setattr(cache, 'time', clock)
+    response_cache = ResponseCache(str(tmp_path), ttl=60)
+    response_cache.put('key', pd.DataFrame({'api': [1, 2]}))
+
+    clock.now += 30
+    assert response_cache.get('key')['api'].tolist() == [1, 2]
+    clock.now += 60
+    assert response_cache.get('key') is None
+    # expired entries are removed
+    assert os.listdir(tmp_path) == []
+
+
+def test_response_cache_lru(tmp_path, monkeypatch):
+    clock = _FakeClock()
+    monkeypatch.setattr(cache, 'time', clock)
+    df = pd.DataFrame({'api': range(100)})
+    response_cache = ResponseCache(str(tmp_path), ttl=None)
+    response_cache.put('first', df)
+    response_cache.put('second', df)
+    # room for two entries
+    response_cache.max_size = int(sum(entry.stat().st_size for entry in os.scandir(tmp_path)) * 1.25)
+
+    clock.now += 10
+    assert response_cache.get('first') is not None
+    response_cache.put('third', df)
+    # the least recently read entry is evicted, not the oldest one
+    assert response_cache.get('second') is None
+    assert response_cache.get('first') is not None and response_cache.get('third') is not None
+
+
+def test_response_cache_refresh(tmp_path):
+    payload = ApiPayload(state_code='TX')
+    with MockHyperionServer(total_count=1200, page_size=500) as server:
+        client = _mock_client(server, cache=ResponseCache(str(tmp_path)))
+        df = client.production_by_well(payload)
+        assert server.requests == 1
+        pd.testing.assert_frame_equal(client.production_by_well(payload), df)
+        assert server.requests == 1
+        client.production_by_well(payload, refresh_cache=True)
+        assert server.requests == 2
+        client.production_by_well(payload, use_cache=False)
+        assert server.requests == 3
+        # a different query is not served from the cache
+        client.production_by_well(ApiPayload(state_code='NM'))
+        assert server.requests == 4
+
+
+def test_json_decoder(monkeypatch):
+    body = b'{"data": [{"api": 42000000000000, "county": "Midland"}], "pagination": {"start": 0}}'
+    fastest = next(name for name in decoder.DECODERS if name == 'json' or importlib.util.find_spec(name))
+    monkeypatch.setattr(decoder, '_default', None)
+    assert decoder.get_decoder().name == fastest
+    for name in decoder.DECODERS:
+        if name == 'json' or importlib.util.find_spec(name):
+            assert decoder.get_decoder(name).loads(body) == json.loads(body)
+    try:
+        decoder.get_decoder('simplejson')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError not raised')
+
+    # without the optional libraries the standard library is used
+    monkeypatch.setattr(decoder, '_default', None)
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    monkeypatch.setitem(sys.modules, 'msgspec', None)
+    assert decoder.get_decoder().name == 'json'
+    assert decoder.get_decoder().loads(body) == json.loads(body)
+
+    with MockHyperionServer(total_count=1200, page_size=500) as server:
+        df = _mock_client(server, json_decoder='json').production_by_well(ApiPayload())
+    assert len(df) == 1200 and df['api'].dtype == 'Int64'
+
+
+def test_cache_options_streamed(tmp_path):
+    # the response cache only holds full results, its options are ignored by streamed and sink queries
+    with MockHyperionServer(total_count=1200, page_size=500) as server:
+        for async_client in (True, False):
+            client = _mock_client(server, async_client=async_client, cache=ResponseCache(str(tmp_path / 'cache')))
+            for options in ({'use_cache': False}, {'refresh_cache': True}):
+                pages = list(client.production_by_well(ApiPayload(), stream=True, **options))
+                assert sum(len(page) for page in pages) == 1200
+                path = str(tmp_path / f'{async_client}-{list(options)[0]}.parquet')
+                sink = client.production_by_well(ApiPayload(), sink=path, **options)
+                assert sink.rows_written == len(pd.read_parquet(path)) == 1200
+
+
+def test_split_pages():
+    # page 0 is fetched before the workers start
+    assert split_pages(total_pages=8, page_size=1000, tasks=3) == [
+        [1000, 2000, 3000], [4000, 5000, 6000], [7000]]
+    assert split_pages(total_pages=2, page_size=500, tasks=4) == [[500]]
+    assert split_pages(total_pages=1, page_size=500, tasks=4) == []
+
+
+def test_fetch_in_processes_shares_the_rate_limit():
+    limiter = AdaptiveRateLimiter(initial_concurrency=3, max_concurrency=3)
+    with MockHyperionServer(total_count=12000, page_size=500, latency=0.02) as server:
+        client = _mock_client(server, rate_limiter=limiter)
+        df = client.fetch_in_processes('production_by_well', ApiPayload(), processes=3)
+    assert len(df) == 12000 and df['api'].is_monotonic_increasing
+    # the workers together, not each of them, stay within the limit of the client
+    assert server.max_in_flight <= 3
+
+
+def test_streaming_aggregator():
+    df = pd.DataFrame({'date': ['2021-01-01', '2021-01-01', '2021-02-01', '2021-02-01'],
+                       'gas_monthly': [1.0, 3.0, 5.0, None]})
+    aggregator = StreamingAggregator('date', {'gas_monthly': ['sum', 'mean', 'count']}, compact_rows=1)
+    aggregator.add_pages([df.iloc[:1], df.iloc[1:3], df.iloc[3:]])
+
+    expected = df.groupby('date')['gas_monthly'].agg(['sum', 'mean', 'count']).add_prefix('gas_monthly_')
+    pd.testing.assert_frame_equal(aggregator.result(), expected, check_dtype=False)
+
+    assert server_aggregate_by('v3/ducsbyoperator', ['date', 'operator_name'], {'ducs': ['sum']}) == ['operator']
+    assert server_aggregate_by('v3/ducsbyoperator', ['operator_name'], {'ducs': ['mean']}) is None
+
+
+def _decode(encoding: str, compressed: bytes, chunk_size: int) -> StreamDecoder:
+    decoder = StreamDecoder(encoding)
+    for start in range(0, len(compressed), chunk_size):
+        decoder.write(compressed[start:start + chunk_size])
+    return decoder
+
+
+def _assert_round_trip(encoding: str, compress):
+    body = json.dumps({'data': [make_row(index) for index in range(500)]}).encode('utf-8')
+    compressed = compress(body)
+    # one byte at a time, then in chunks of the transport size
+    for chunk_size in (1, 64 * 1024):
+        decoder = _decode(encoding, compressed, chunk_size)
+        assert decoder.finish() == body
+        assert decoder.wire_bytes == len(compressed) and decoder.decoded_bytes == len(body)
+
+
+def test_stream_decoder_gzip():
+    _assert_round_trip('gzip', gzip.compress)
+    _assert_round_trip('identity', bytes)
+    # deflate with and without the zlib header
+    _assert_round_trip('deflate', zlib.compress)
+    _assert_round_trip('deflate', lambda body: zlib.compress(body)[2:-4])
+    with pytest.raises(ValueError):
+        StreamDecoder('compress')
+
+
+def test_stream_decoder_brotli():
+    brotli = pytest.importorskip('brotli')
+    assert 'br' in available_encodings()
+    _assert_round_trip('br', brotli.compress)
+
+
+def test_stream_decoder_zstd():
+    zstandard = pytest.importorskip('zstandard')
+    assert available_encodings()[0] == 'zstd' and 'zstd' not in available_encodings(zstd=False)
+    _assert_round_trip('zstd', zstandard.ZstdCompressor().compress)
+
+
+def _transports() -> list:
+    transports = [AiohttpTransport()]
+    if importlib.util.find_spec('httpx'):
+        transports.append(HttpxTransport(http2=False))
+    return transports
+
+
+def _is_closed(client) -> bool:
+    # aiohttp.ClientSession or httpx.AsyncClient
+    return client.closed if hasattr(client, 'closed') else client.is_closed
+
+
+def test_transport():
+    with MockHyperionServer(total_count=10) as server:
+        for transport in _transports():
+            async def request():
+                try:
+                    return await transport.request('POST', f'{server.url}/v3/rigs', data=ApiPayload().payload(),
+                                                   headers={'Accept-Encoding': 'gzip'})
+                finally:
+                    await transport.close()
+
+            response = asyncio.run(request())
+            assert response.ok and response.headers['Content-Encoding'] == 'gzip'
+            # decompressed as it arrives, wire_bytes counts the compressed body
+            assert len(json.loads(response.content)['data']) == 10
+            assert 0 < response.wire_bytes < len(response.content)
+            assert not transport.is_open
+    try:
+        get_transport('requests')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError not raised')
+
+
+def test_transport_loop_change():
+    with MockHyperionServer(total_count=10) as server:
+        async def request(transport):
+            return (await transport.request('GET', f'{server.url}/v3/regions')).status
+
+        for transport in _transports():
+            # the pool of a closed loop, e.g. of a previous asyncio.run, is released by the next loop
+            assert asyncio.run(request(transport)) == 200
+            first = transport._client
+            assert asyncio.run(request(transport)) == 200
+            assert _is_closed(first) and not _is_closed(transport._client)
+
+            # the pool of a loop running in another thread is closed on that loop
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, daemon=True)
+            thread.start()
+            try:
+                assert asyncio.run_coroutine_threadsafe(request(transport), loop).result(10) == 200
+                in_thread = transport._client
+                assert asyncio.run(request(transport)) == 200
+                for _ in range(100):
+                    if _is_closed(in_thread):
+                        break
+                    time.sleep(0.01)
+                assert _is_closed(in_thread)
+                asyncio.run(transport.close())
+                assert not transport.is_open
+            finally:
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join()
+                loop.close()
+
+
+def test_payload_encoding():
+    payload = ApiPayload(state_code='TX', start_date='2021-01-01', production_month=3)
+    body = json.loads(payload.payload(2000))
+    assert body['pagination'] == {'start': 2000} and body['state_code'] == ['TX']
+    assert 'modeled' not in body
+    assert json.loads(payload.payload())['pagination'] == {'start': 0}
+
+    # the encoded filters are reused across pages, and rebuilt when a filter changes
+    digest = payload.digest()
+    payload.pagination_start = 1000
+    assert payload.digest() == digest
+    payload.state_code.append('NM')
+    assert json.loads(payload.payload())['state_code'] == ['TX', 'NM']
+    assert payload.digest() != digest
+
+
+class _Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_retry_policy():
+    assert retry_after({'Retry-After': '3'}) == 3 and retry_after({}) is None
+
+    policy = RetryPolicy(max_attempts=4, backoff=0.001, circuit_breaker=CircuitBreaker(failure_threshold=10))
+    statuses = iter([503, 429, 200])
+    attempts = []
+    response = policy.call(lambda attempt: attempts.append(attempt) or _Response(next(statuses)))
+    assert response.status_code == 200 and attempts == [1, 2, 3]
+
+    # gives up after max_attempts, with the last response
+    response = policy.call(lambda attempt: _Response(500))
+    assert response.status_code == 500
+
+    # the budget of a query is shared by its requests
+    budget = RetryBudget(ratio=0, min_retries=1)
+    assert budget.spend(0) and not budget.spend(0)
+
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open' and breaker.wait_time() > 0
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.wait_time() == 0
+
+
+def test_rate_limiter_aimd():
+    class RecordingLimiter(AdaptiveRateLimiter):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.limits = []
+
+        def release(self, status=None, headers=None):
+            super().release(status, headers)
+            self.limits.append((status, self.limit))
+
+    async def post(url):
+        client = ApiClientAsync('x', rate_limiter=limiter)
+        try:
+            return await client.post_async(f'{url}/v3/productionbywell', ApiPayload())
+        finally:
+            await client.close_async()
+
+    limiter = RecordingLimiter(initial_concurrency=8, max_concurrency=8, cooldown=0.05)
+    with MockHyperionServer(total_count=20000, page_size=500, latency=0.02, rate_limit=6) as server:
+        df = asyncio.run(post(server.url))
+    assert len(df) == 20000 and server.throttled > 0 and limiter.throttled_count == server.throttled
+
+    first_throttled = [status for status, _ in limiter.limits].index(429)
+    # the 429 halves the limit, below the rate_limit_request_count ceiling of 6 sent with it
+    assert limiter.limits[first_throttled - 1][1] == 8 and limiter.limits[first_throttled][1] == 4
+    # and successes raise it again, up to the ceiling
+    assert limiter.limit == limiter.max_concurrency == 6
+    assert all(limit <= 6 for _, limit in limiter.limits[first_throttled:])
+
+
+def test_shared_rate_limiter(tmp_path):
+    path = str(tmp_path / 'limits.sqlite3')
+    first = SharedRateLimiter('key', path=path, initial_concurrency=2)
+    second = SharedRateLimiter('key', path=path, initial_concurrency=2)
+    other_key = SharedRateLimiter('other key', path=path, initial_concurrency=2)
+
+    first.acquire()
+    first.acquire()
+    # the slots of the access key are taken by the first client
+    assert second._try_acquire() > 0
+    assert other_key._try_acquire() == 0
+
+    first.release(429, {'Retry-After': '60'})
+    # the pause after a 429 applies to every client of the key
+    assert second._try_acquire() > 1
+    assert second.limit == 1 and second.throttled_count == 1
+
+
+def test_shared_rate_limiter_async(tmp_path):
+    limiter = SharedRateLimiter('key', path=str(tmp_path / 'limits.sqlite3'), initial_concurrency=2)
+    threads = set()
+    try_acquire = limiter._try_acquire
+
+    def recording_try_acquire():
+        threads.add(threading.get_ident())
+        return try_acquire()
+
+    limiter._try_acquire = recording_try_acquire
+
+    async def request():
+        await limiter.acquire_async()
+        await asyncio.sleep(0.01)
+        await limiter.release_async(200)
+        return threading.get_ident()
+
+    async def requests():
+        return await asyncio.gather(*(request() for _ in range(6)))
+
+    loop_threads = set(asyncio.run(requests()))
+    # the transactions ran off the event loop
+    assert threads and not threads & loop_threads
+    assert limiter._acquire_once() == 0 and limiter.in_flight == 1
+
+
+def test_reference_data(tmp_path):
+    requests = []
+
+    def loader(endpoint, etag, last_modified):
+        requests.append((endpoint, etag))
+        if etag == '"v1"':
+            return 304, None, {'ETag': '"v1"'}
+        data = [{'region': 'west', 'sub_region': 'Wyoming'}, {'region': 'west', 'sub_region': 'Colorado wo SJ'},
+                {'region': 'gulf', 'sub_region': 'South Texas'}]
+        return 200, {'data': data}, {'ETag': '"v1"'}
+
+    reference = ReferenceData(loader, directory=str(tmp_path))
+    assert reference.sub_regions('west') == ['Colorado wo SJ', 'Wyoming']
+    assert reference.regions() == ['gulf', 'west'] and reference.sub_regions('east') == []
+    assert requests == [('v3/regions', None)]
+
+    # expired: revalidated, not downloaded again
+    reference.ttl = 0
+    assert len(reference.get('regions')) == 3
+    assert requests[-1] == ('v3/regions', '"v1"')
+
+    # another process reads the copy on disk
+    other = ReferenceData(loader, directory=str(tmp_path))
+    assert other.index('regions', 'sub_region', 'region')['Wyoming'] == 'west'
+    assert len(requests) == 2
+
+
+def test_validate_payload():
+    def loader(endpoint, etag, last_modified):
+        return 200, {'data': [{'region': 'west', 'sub_region': 'Wyoming'}]}, {}
+
+    reference = ReferenceData(loader)
+    assert validate_payload(ApiPayload(state_code='WY', sub_region='wyoming'), reference) == []
+
+    payload = ApiPayload(state_code='WX', sub_region='Wyomin', operator_name='CITATION OIL & GAS CORP',
+                         start_date='2023-01-01', end_date='2022-01-01')
+    problems = validate_payload(payload, reference)
+    assert len(problems) == 4 and "'operator_name' (did you mean 'operator'?)" in problems[0]
+    assert "'Wyomin' (did you mean 'Wyoming'?)" in problems[-1]
+    # without reference data only the checks that need no request
+    assert len(validate_payload(payload)) == 2
+
+    assert choose_strategy(10, 1000, payload) == 'single_page'
+    assert choose_strategy(1500, 1000, payload) == 'sequential'
+    assert choose_strategy(50000, 1000, payload, stream_rows=10000) == 'streamed'
+    assert choose_strategy(5000000, 1000, ApiPayload(state_code=['TX', 'NM'])) == 'sharded'
+    assert choose_strategy(5000000, 1000, ApiPayload(state_code='TX')) == 'concurrent'
+
+    # both clients reject the payload before sending it
+    for query in (HyperionApiClient('').production_by_well,
+                  lambda payload: asyncio.run(AsyncHyperionApiClient('').production_by_well(payload))):
+        try:
+            query(payload)
+        except QueryPlanError as e:
+            assert len(e.problems) == 2
+        else:
+            raise AssertionError('QueryPlanError not raised')
+
+
+def test_execute_strategies(tmp_path):
+    # strategy, rows, page requests including the first page fetched by the plan, plan options
+    cases = [('single_page', ApiPayload(), 800, 1, {}),
+             ('sequential', ApiPayload(), 1500, 2, {}),
+             ('concurrent', ApiPayload(), 5000, 5, {}),
+             ('streamed', ApiPayload(), 5000, 5, {'stream_rows': 1000}),
+             # one query per state after the first page, TX and NM are 2/10 of the rows each
+             ('sharded', ApiPayload(state_code=['TX', 'NM']), 20000, 1 + 4 + 4, {'shard_rows': 100})]
+    for strategy, payload, total_count, requests, options in cases:
+        for async_client in (True, False):
+            with MockHyperionServer(total_count=total_count) as server:
+                client = _mock_client(server, async_client=async_client, cache=ResponseCache(str(tmp_path)))
+                plan = client.plan('production_by_well', payload, **options)
+                assert plan.strategy == strategy
+                result = client.execute(plan, use_cache=False)
+                if strategy == 'streamed':
+                    result = pd.concat(list(result), ignore_index=True)
+                assert len(result) == plan.total_count
+                # shards are concatenated one after another
+                assert strategy == 'sharded' or result['api'].is_monotonic_increasing
+                # the first page is not requested again
+                assert server.requests == requests
+
+    with MockHyperionServer(total_count=5000) as server:
+        client = _mock_client(server, cache=ResponseCache(str(tmp_path)))
+        pages = client.query('production_by_well', ApiPayload(), stream_rows=1000, use_cache=False)
+        assert sum(len(page) for page in pages) == 5000
+        totals = client.aggregate('production_by_well', ApiPayload(), group_by='state_ab',
+                                  aggregations='gas_monthly', use_cache=False)
+        # the mock rows span 8 states
+        assert len(totals) == 8 and totals['gas_monthly'].sum() > 0
+
+
+def test_import_is_lazy():
+    # heavy dependencies are imported by the first call needing them, see benchmarks/import_time.py
+    code = ('import sys, synmax.hyperion; '
+            'print([name for name in ("pandas", "numpy", "pyarrow", "aiohttp", "tqdm") if name in sys.modules])')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', code], cwd=root, check=True, capture_output=True, text=True)
+    assert output.stdout.strip() == '[]'
+
+
+def test_post_async_resets_current_query():
+    async def post(url):
+        client = ApiClientAsync('x')
+        try:
+            df = await client.post_async(f'{url}/v3/productionbywell', ApiPayload())
+        finally:
+            await client.close_async()
+        # the query and its retry budget do not leak into the next requests of the caller
+        return df, current_query.get(), current_budget.get()
+
+    with MockHyperionServer(total_count=2500) as server:
+        df, query, budget = asyncio.run(post(server.url))
+    assert len(df) == 2500 and df.attrs['synmax_metrics']['requests'] == 3
+    assert query is None and budget is None
+
+
+def test_api_client_base_is_abstract():
+    with pytest.raises(TypeError):
+        ApiClientBase('x')
+
+
+def test_streamed_query_budget(tmp_path):
+    class RecordingPolicy(RetryPolicy):
+        def __init__(self):
+            super().__init__(deadline=60)
+            self.budgets = []
+
+        def call(self, send, url=None, retry_on=()):
+            self.budgets.append(current_budget.get())
+            return super().call(send, url, retry_on)
+
+        async def call_async(self, send, url=None, retry_on=()):
+            self.budgets.append(current_budget.get())
+            return await super().call_async(send, url, retry_on)
+
+    with MockHyperionServer(total_count=5000) as server:
+        url = f'{server.url}/v3/productionbywell'
+        for client_class in (ApiClient, ApiClientAsync):
+            policy = RecordingPolicy()
+            client = client_class('x', retry_policy=policy)
+            queries = [
+                lambda: list(client.iter_json_pages(url, ApiPayload())),
+                lambda: client.write_pages(ParquetSink(str(tmp_path / f'{client_class.__name__}.parquet')), url,
+                                           ApiPayload()),
+            ]
+            for query in queries:
+                policy.budgets.clear()
+                query()
+                # one deadline for all the pages of the query, and no budget left to the caller
+                assert len(policy.budgets) == 5 and policy.budgets[0].deadline is not None
+                assert all(budget is policy.budgets[0] for budget in policy.budgets)
+                assert current_budget.get() is None
+
+        policy = RecordingPolicy()
+        ApiClient('x', retry_policy=policy).get(f'{server.url}/v3/wells', return_json=True)
+        assert policy.budgets[0] is not None and current_budget.get() is None
+
+
+def test_async_pages_reordered():
+    async def starts(url, **kwargs):
+        client = ApiClientAsync('x')
+        try:
+            return [json_result['pagination']['start'] async for json_result in
+                    client.iter_json_pages_async(f'{url}/v3/productionbywell', ApiPayload(), read_ahead=8, **kwargs)]
+        finally:
+            await client.close_async()
+
+    # concurrent pages complete in random order
+    with MockHyperionServer(total_count=12000, page_size=500, jitter=0.05) as server:
+        pages = list(range(0, 12000, 500))
+        assert asyncio.run(starts(server.url)) == pages
+        # with at most 2 pages fetched past the oldest one not yielded yet
+        assert asyncio.run(starts(server.url, reorder_buffer=2)) == pages
+        unordered = asyncio.run(starts(server.url, ordered=False))
+        # as they arrive, which the ordered runs above had to put back in order
+        assert unordered[0] == 0 and sorted(unordered) == pages and unordered != pages
+
+        async def post(url):
+            client = ApiClientAsync('x')
+            try:
+                return await client.post_async(f'{url}/v3/productionbywell', ApiPayload())
+            finally:
+                await client.close_async()
+
+        df = asyncio.run(post(server.url))
+    assert len(df) == 12000 and df['api'].is_monotonic_increasing
+
+
+def test_fetch_incremental_failed_range(tmp_path):
+    store = IncrementalStore(str(tmp_path))
+    payload = ApiPayload(start_date='2023-01-01', end_date='2023-01-10')
+
+    def refused(payload, use_cache=True):
+        # what the clients return on a 401
+        df = pd.DataFrame()
+        df.attrs[ATTRS_KEY] = {'complete': False}
+        return df
+
+    def daily(payload, use_cache=True):
+        dates = pd.date_range(payload.start_date, payload.end_date).strftime('%Y-%m-%d')
+        return pd.DataFrame({'date': dates, 'value': 1})
+
+    assert fetch_incremental(refused, 'rigs', payload, store).empty
+    assert store.load(store.key('rigs', payload)) == (None, [])
+    # fetched again instead of being served as an empty covered range
+    assert len(fetch_incremental(daily, 'rigs', payload, store)) == 10
+    # a failed refresh keeps the stored rows
+    assert len(fetch_incremental(refused, 'rigs', payload, store)) == 10
 
 
 def test_add_fips():
@@ -135,6 +982,13 @@ def test_add_fips():
     print(df)
 
 
+def test_attach_fips():
+    df = pd.DataFrame({'state_ab': ['TX', 'TX', 'LA', None], 'county': ['Midland', 'MIDLAND', 'Caddo Parish', 'Eddy']})
+
+    df = attach_fips(df)
+    assert df['fips'].tolist() == [48329, 48329, 22017, pd.NA]
+
+
 def compare_df():
     cols = ['api', 'gas_monthly']
     df1 = pandas.read_csv('df_data.csv')